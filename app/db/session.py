@@ -1,12 +1,33 @@
+import json
+
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
 
+try:
+    import orjson
+except ImportError:  # orjson 미설치 환경에서는 표준 json으로 동작
+    orjson = None
+
+
+def _json_serializer(obj) -> str:
+    """JSON/JSONB 컬럼 직렬화 (orjson 우선, 못 다루는 값은 표준 json으로 fallback)."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False)
+
+
 
 
 engine = create_engine(settings.sqlalchemy_url,
                        echo=settings.SYNC_ECHO,
-                       pool_pre_ping=True)
+                       pool_pre_ping=True,
+                       insertmanyvalues_page_size=1000,  # executemany INSERT 배치 크기
+                       json_serializer=_json_serializer,
+                       json_deserializer=orjson.loads if orjson is not None else json.loads)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
 
@@ -10,7 +10,7 @@ from sqlalchemy.orm import Session
 
 from app.db.session import get_db
 from app.core.logging import get_logger
-from app.services.agent.orchestrator_react import run_orchestrated
+from app.services.agent.orchestrator_react import arun_orchestrated
 
 # ✅ 새 스키마 사용
 from app.schemas.simulation_request import SimulationStartRequest
@@ -37,7 +37,7 @@ class SimulationResponse(BaseModel):
     response_model=SimulationResponse,
     summary="툴 기반 React 오케스트레이션 시뮬레이션",
 )
-def start_simulation(req: SimulationStartRequest, db: Session = Depends(get_db)):
+async def start_simulation(req: SimulationStartRequest, db: Session = Depends(get_db)):
     """
     프론트 → 오케스트레이터(툴 기반) 단일 진입점.
 
@@ -58,7 +58,7 @@ def start_simulation(req: SimulationStartRequest, db: Session = Depends(get_db))
         payload: Dict[str, Any] = req.model_dump(mode="python")
         payload["use_tavily"] = tavily_used_flag
 
-        result: Dict[str, Any] = run_orchestrated(db, payload)
+        result: Dict[str, Any] = await arun_orchestrated(db, payload)
 
         if result.get("status") != "success":
             raise HTTPException(status_code=500, detail=result.get("error", "simulation failed"))
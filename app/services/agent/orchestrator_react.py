@@ -1,20 +1,40 @@
 # VP\app\services\agent\orchestrator_react.py
 from __future__ import annotations
-from typing import Dict, Any, List, Tuple, Optional, Set, AsyncGenerator
+from typing import Dict, Any, List, Tuple, Optional, Set, AsyncGenerator, Callable
+from collections import OrderedDict, Counter, defaultdict, deque
 from dataclasses import dataclass, field
+from itertools import chain, groupby
 import json
+import codecs
+import copy
+import functools
+import hashlib
 import re
 import ast
+import threading
+import time
 from datetime import datetime
 import os
 from pathlib import Path
+from types import MappingProxyType
 
+from sqlalchemy import bindparam, delete, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
 from fastapi import HTTPException
 
+try:
+    import orjson
+except ImportError:  # orjson 미설치 환경에서는 표준 json으로 동작
+    orjson = None
+
 from langchain.agents import create_react_agent, AgentExecutor
+from langchain_core.agents import AgentAction
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnablePassthrough
 from langchain_core.callbacks.base import BaseCallbackHandler
+from langchain_core.tools import tool
+from openai import DefaultAsyncHttpxClient
 
 from app.services.llm_providers import agent_chat
 from app.services.agent.tools_sim import make_sim_tools
@@ -24,6 +44,7 @@ from app.services.agent.tools_emotion import label_victim_emotions
 from app.services.agent.tools_tavily import make_tavily_tools
 from app.services.agent.guideline_repo_db import GuidelineRepoDB
 from app.core.logging import get_logger
+from app.db.session import SessionLocal
 
 
 from app.schemas.simulation_request import SimulationStartRequest
@@ -35,6 +56,52 @@ from app.services.tts_service import (
 
 logger = get_logger(__name__)
 
+# ─────────────────────────────────────────────────────────
+# JSON 인코딩/디코딩 (hot path는 orjson 우선)
+# - orjson이 직렬화 못 하는 값(TypeError: 임의 객체 등)만 표준 json으로 fallback
+# - ⚠️ NaN/Infinity는 fallback하지 않는다: orjson은 이를 null로 기록한다 (json.dumps의 NaN 토큰과 다름)
+# - pretty print(indent)나 default=가 필요한 곳은 json을 그대로 사용
+# ─────────────────────────────────────────────────────────
+def _dumps(obj: Any) -> str:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False)
+
+def _dumps_bytes(obj: Any) -> bytes:
+    """_dumps와 같지만 UTF-8 bytes로 바로 반환 (orjson이면 str 왕복 없음)."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+def _digest(obj: Any) -> bytes:
+    """
+    dedupe/set 키용 16바이트 해시 (키 정렬된 JSON 기준).
+    - 긴 JSON 문자열 자체를 set에 넣지 않기 위함
+    """
+    raw: Optional[bytes] = None
+    if orjson is not None:
+        try:
+            raw = orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            raw = None
+    if raw is None:
+        raw = json.dumps(obj, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return hashlib.blake2b(raw, digest_size=16).digest()
+
+def _loads(s: Any) -> Any:
+    if orjson is not None:
+        try:
+            return orjson.loads(s)
+        except ValueError:
+            pass
+    return json.loads(s)
+
 # ─────────────────────────────────────────────────────────
 # 전역 설정
 # ─────────────────────────────────────────────────────────
@@ -45,9 +112,144 @@ MIN_ROUNDS = 2
 MAX_ROUNDS_DEFAULT = 5
 MAX_ROUNDS_UI_LIMIT = 5
 
+# ✅ emotion pair_mode 별칭 → tools_emotion.PairMode 허용값 (키는 소문자/strip 기준)
+_EMOTION_PAIR_MODE_ALIAS = MappingProxyType({
+    # victim only => tools_emotion에서는 "none"으로 취급
+    "victimonly": "none",
+    "victim_only": "none",
+    "victim-only": "none",
+    "only_victim": "none",
+    "victim": "none",
+
+    # prev offender
+    "prev": "prev_offender",
+    "prev_offender": "prev_offender",
+    "previous_offender": "prev_offender",
+    "victim+prev": "prev_offender",
+    "victim+prev_offender": "prev_offender",
+
+    # prev victim
+    "prev_victim": "prev_victim",
+    "previous_victim": "prev_victim",
+    "victim+prev_victim": "prev_victim",
+
+    # thoughts
+    "thought": "thoughts",
+    "thoughts": "thoughts",
+    "victim+thought": "thoughts",
+    "victim+thoughts": "thoughts",
+
+    # combos
+    "prev_offender+thoughts": "prev_offender+thoughts",
+    "prev_victim+thoughts": "prev_victim+thoughts",
+    "none": "none",
+})
+
+# 요청에서 pair_mode를 찾는 필드 (앞에서부터 우선). FE/배치 호환: pair_mode / emotion_pair_mode 둘 다 지원
+_EMOTION_PAIR_MODE_FIELDS = ("emotion_pair_mode", "pair_mode")
+
+def _normalize_emotion_pair_mode(v: Any) -> Optional[str]:
+    """pair_mode 표준화: tools_emotion.PairMode 허용값으로만 정규화 (모르는 값은 None)."""
+    if v is None:
+        return None
+    return _EMOTION_PAIR_MODE_ALIAS.get(str(v).strip().lower())
+
+def _req_emotion_pair_mode(req: Any, payload: Dict[str, Any]) -> Optional[str]:
+    # SimulationStartRequest에 필드가 없을 수도 있으니 payload도 같이 본다.
+    # (기존과 동일하게 "값이 있는 첫 필드"의 정규화 결과를 사용)
+    for source in (req, payload):
+        for name in _EMOTION_PAIR_MODE_FIELDS:
+            v = payload.get(name) if source is payload else getattr(source, name, None)
+            if v is not None:
+                return _normalize_emotion_pair_mode(v)
+    return None
+
 # 전역 캐시를 유지하되 "stream_id 스코프"를 강제한다.
 # (기존 로직은 finally에서 "round_" 포함 키를 싹 지워서 다른 케이스 캐시까지 오염/삭제 가능)
-_PROMPT_CACHE: Dict[str, Dict[str, Any]] = {}
+# ✅ 장시간 프로세스에서 무한히 쌓이지 않도록 LRU 상한을 둔다.
+#    (엔트리마다 scenario/victim_profile/프롬프트 2개를 통째로 들고 있음)
+_PROMPT_CACHE_MAX = 512
+
+
+class _PromptLRU:
+    """
+    prompt_id -> 캐시 엔트리. 조회 시 최신으로 갱신, 상한 초과 시 가장 오래된 것부터 제거.
+    - stream_id별 키 버킷을 같이 유지해서 stream 종료 정리가 전체 스캔 없이 버킷 pop으로 끝난다.
+    - 도구 스레드(저장/조회)와 run 종료 정리가 동시에 돌 수 있어 OrderedDict+버킷 갱신은 lock 하나로 묶는다.
+    """
+
+    def __init__(self, maxsize: int = _PROMPT_CACHE_MAX):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._by_stream: Dict[str, Set[str]] = {}
+        self._owner: Dict[str, str] = {}
+
+    @staticmethod
+    def _owner_of(key: str, value: Dict[str, Any]) -> str:
+        sid = value.get("stream_id") if isinstance(value, dict) else None
+        return str(sid) if sid else key.split(":", 1)[0]
+
+    def _unindex(self, key: str) -> None:
+        sid = self._owner.pop(key, None)
+        if sid is None:
+            return
+        bucket = self._by_stream.get(sid)
+        if bucket is not None:
+            bucket.discard(key)
+            if not bucket:
+                del self._by_stream[sid]
+
+    def __getitem__(self, key: str) -> Dict[str, Any]:
+        with self._lock:
+            value = self._data[key]
+            self._data.move_to_end(key)
+            return value
+
+    def __setitem__(self, key: str, value: Dict[str, Any]) -> None:
+        sid = self._owner_of(key, value)
+        with self._lock:
+            if key in self._data:
+                self._unindex(key)
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self._owner[key] = sid
+            self._by_stream.setdefault(sid, set()).add(key)
+            while len(self._data) > self.maxsize:
+                old_key, _ = self._data.popitem(last=False)
+                self._unindex(old_key)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def move_to_end(self, key: str) -> None:
+        with self._lock:
+            self._data.move_to_end(key)
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            self._unindex(key)
+            return self._data.pop(key, default)
+
+    def has_stream(self, sid: str) -> bool:
+        return sid in self._by_stream
+
+    def drop_stream(self, sid: str) -> int:
+        """stream 종료 시 해당 stream_id 소유 엔트리만 제거. 제거 개수 반환."""
+        with self._lock:
+            keys = self._by_stream.pop(sid, None)
+            if not keys:
+                return 0
+            for k in keys:
+                self._owner.pop(k, None)
+                self._data.pop(k, None)
+            return len(keys)
+
+
+_PROMPT_CACHE = _PromptLRU()
 
 # ✅ Emotion/HMM 캐시 (stream_id 스코프)
 # - label_victim_emotions 결과(라벨링된 turns, hmm)를 저장해두고
@@ -57,13 +259,85 @@ _EMO_CACHE: Dict[str, Dict[str, Any]] = {}
 
 # SSE 모듈
 import asyncio, logging, uuid, contextvars, contextlib, sys
-from threading import Event as ThreadEvent
+import queue
+from threading import Event as ThreadEvent, Lock as ThreadLock, Thread
 from starlette.responses import StreamingResponse
 from fastapi import APIRouter, status
 
-_StreamState = Tuple[asyncio.AbstractEventLoop, asyncio.Queue, Set[asyncio.Queue]]
+@dataclass(slots=True)
+class _StreamState:
+    """stream_id 하나의 SSE 상태 (loop/큐/싱크 + 실행 task/연결 수). stream_id당 dict 조회 1번으로 전부 접근."""
+    loop: asyncio.AbstractEventLoop
+    queue: asyncio.Queue
+    # sink 큐 → 그 큐를 main_q로 옮기는 pump task (폴링 없이 await get)
+    sinks: Dict[asyncio.Queue, asyncio.Task] = field(default_factory=dict)
+    task: Optional[asyncio.Task] = None
+    conn_count: int = 0
+    # 다른 스레드 → loop 전달용 대기열 (여러 producer, loop 1개가 소비)
+    pending: "deque[Dict[str, Any]]" = field(default_factory=deque)
+    pending_lock: Any = field(default_factory=ThreadLock)
+    dropped: int = 0  # high-water mark에서 버린 저우선 이벤트 수
+    hb_refs: int = 0  # heartbeat를 받는 SSE generator 수 (공용 타이머가 참조)
 
 _STREAMS: dict[str, _StreamState] = {}
+
+# main_q high-water mark: 느린 SSE 클라이언트 때문에 메모리가 끝없이 늘지 않도록
+# - 큐 길이가 이 값 이상이면 저우선 이벤트(_SSE_DROPPABLE_TYPES)는 버린다
+# - 그 외(결과/판정/라운드 등) 이벤트는 절대 버리거나 밀어내지 않는다 (run당 개수가 유한)
+_SSE_QMAX = max(1, int(os.getenv("VP_SSE_QMAX", "1024") or 1024))
+# high-water mark에서 버려도 되는 이벤트
+_SSE_DROPPABLE_TYPES = frozenset({"token", "terminal", "log", "heartbeat", "ping", "tool_start", "turn_event"})
+
+# 프로세스 전체 누적 드롭 수 (stream별 값은 _StreamState.dropped)
+_SSE_DROPPED_TOTAL = 0
+
+def sse_dropped_total() -> int:
+    """high-water mark에서 버려진 저우선 SSE 이벤트 누적 수 (모니터링용)."""
+    return _SSE_DROPPED_TOTAL
+
+def _enqueue(state: _StreamState, ev: Dict[str, Any]) -> None:
+    """loop 스레드 전용: main_q에 넣기. high-water mark 이상이면 저우선 이벤트만 버린다(중요 이벤트는 항상 넣음)."""
+    q = state.queue
+    if q.qsize() >= _SSE_QMAX and ev.get("type") in _SSE_DROPPABLE_TYPES:
+        global _SSE_DROPPED_TOTAL
+        if state.dropped == 0:
+            logger.warning("[SSE] main_q high-water(%d) 도달: 저우선 이벤트 드롭 시작", _SSE_QMAX)
+        state.dropped += 1
+        _SSE_DROPPED_TOTAL += 1
+        return
+    q.put_nowait(ev)
+
+# (epoch 초, "YYYY-MM-DDTHH:MM:SS") — 초가 바뀔 때만 strftime, 나머지는 마이크로초만 붙인다
+_ISO_SECOND: Tuple[int, str] = (0, "")
+
+def _now_iso() -> str:
+    """datetime.now().isoformat()과 같은 로컬시각 ISO 문자열 (초 단위 prefix 캐시)."""
+    global _ISO_SECOND
+    sec, us = divmod(time.time_ns() // 1000, 1_000_000)
+    cached_sec, head = _ISO_SECOND
+    if cached_sec != sec:
+        head = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(sec))
+        _ISO_SECOND = (sec, head)  # 튜플 통째로 교체 → 스레드 간에도 sec/head가 어긋나지 않음
+    return f"{head}.{us:06d}"
+
+def _post_events(state: _StreamState, events: List[Dict[str, Any]]) -> None:
+    """
+    아무 스레드에서나 stream main_q로 이벤트 전달.
+    - pending이 비어 있다가 처음 채워질 때만 call_soon_threadsafe (이미 예약돼 있으면 append만)
+    """
+    with state.pending_lock:
+        wake = not state.pending
+        state.pending.extend(events)
+    if wake:
+        state.loop.call_soon_threadsafe(_drain_pending, state)
+
+def _drain_pending(state: _StreamState) -> None:
+    """loop 스레드 전용: pending에 쌓인 이벤트를 순서대로 main_q로 옮긴다."""
+    with state.pending_lock:
+        items = list(state.pending)
+        state.pending.clear()
+    for ev in items:
+        _enqueue(state, ev)
 _current_stream_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("_current_stream_id", default=None)
 
 def _sse_enabled(payload: Optional[Dict[str, Any]] = None) -> bool:
@@ -80,8 +354,39 @@ def _sse_enabled(payload: Optional[Dict[str, Any]] = None) -> bool:
         pass
     return True
 
-_ACTIVE_STREAMS: Set[str] = set()
-_ACTIVE_RUN_KEYS: Set[str] = set()
+def _stream_has_subscribers(stream_id: str) -> bool:
+    """
+    stream_id에 붙은(또는 붙을 준비가 된) 소비자가 있는지.
+    - /api/sse/agent/{id} 구독이나 run_orchestrated_stream이 이미 _STREAMS에 등록한 경우
+    """
+    return stream_id in _STREAMS
+
+# run_key -> 등록 시각(monotonic). 비정상 종료로 finally를 못 탄 키도 TTL이 지나면 자동 만료
+_ACTIVE_RUN_KEYS: Dict[str, float] = {}
+_ACTIVE_RUN_LOCK = ThreadLock()
+_ACTIVE_RUN_TTL = 3600.0
+
+def _claim_run_key(run_key: str) -> bool:
+    """중복 실행이 아니면 run_key를 등록하고 True. (확인+등록을 lock 안에서 원자적으로)"""
+    now = time.monotonic()
+    with _ACTIVE_RUN_LOCK:
+        started = _ACTIVE_RUN_KEYS.get(run_key)
+        if started is not None and now - started < _ACTIVE_RUN_TTL:
+            return False
+        expired = [k for k, t in _ACTIVE_RUN_KEYS.items() if now - t >= _ACTIVE_RUN_TTL]
+        for k in expired:
+            del _ACTIVE_RUN_KEYS[k]
+        _ACTIVE_RUN_KEYS[run_key] = now
+        return True
+
+def _is_sole_active_run() -> bool:
+    """현재 등록된 run이 하나(자기 자신)뿐인지."""
+    with _ACTIVE_RUN_LOCK:
+        return len(_ACTIVE_RUN_KEYS) <= 1
+
+def _release_run_key(run_key: str) -> None:
+    with _ACTIVE_RUN_LOCK:
+        _ACTIVE_RUN_KEYS.pop(run_key, None)
 
 def _make_run_key(payload: Dict[str, Any]) -> str:
     key = {
@@ -91,7 +396,7 @@ def _make_run_key(payload: Dict[str, Any]) -> str:
         "victim_profile": payload.get("victim_profile_id") or payload.get("victim_profile"),
     }
     try:
-        return json.dumps(key, sort_keys=True, ensure_ascii=False)
+        return _digest(key).hex()
     except Exception:
         return str(key)
 
@@ -143,106 +448,249 @@ def _ensure_stream(stream_id: str) -> _StreamState:
         except RuntimeError:
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
-        main_q: asyncio.Queue = asyncio.Queue()
-        sinks: Set[asyncio.Queue] = set()
-        state = (loop, main_q, sinks)
+        state = _StreamState(loop=loop, queue=asyncio.Queue())
         _STREAMS[stream_id] = state
     return state
 
 def _get_loop(stream_id: str) -> asyncio.AbstractEventLoop:
-    return _ensure_stream(stream_id)[0]
+    return _ensure_stream(stream_id).loop
 
 def _get_main_queue(stream_id: str) -> asyncio.Queue:
-    return _ensure_stream(stream_id)[1]
+    return _ensure_stream(stream_id).queue
+
+def _get_sinks(stream_id: str) -> Dict[asyncio.Queue, asyncio.Task]:
+    return _ensure_stream(stream_id).sinks
+
+async def _pump_sink(state: _StreamState, sink_q: asyncio.Queue) -> None:
+    """sink 큐에 들어온 항목을 turn_event로 main_q에 옮긴다. 항목이 올 때까지 await로 대기 (폴링 없음)."""
+    while True:
+        item = await sink_q.get()
+        try:
+            _enqueue(state, {"type": "turn_event", "content": item, "ts": _now_iso()})
+        except Exception:
+            logger.exception("[SSE] sink pump error")
 
-def _get_sinks(stream_id: str) -> Set[asyncio.Queue]:
-    return _ensure_stream(stream_id)[2]
+def _drop_stream_state(stream_id: str, state: _StreamState) -> None:
+    """state가 아직 등록된 그 객체일 때만 제거 (같은 stream_id로 새로 만든 상태는 건드리지 않음)."""
+    if _STREAMS.get(stream_id) is state:
+        _STREAMS.pop(stream_id, None)
+        _EMIT_BUFFERS.pop(stream_id, None)
 
 def sse_current_stream_id() -> Optional[str]:
     return _current_stream_id.get()
 
+def _get_sid() -> str:
+    """캐시 스코프용 stream_id (없으면 "no_stream"). 래퍼 진입 시 1회만 읽어 로컬로 쓴다."""
+    return _current_stream_id.get() or "no_stream"
+
 async def register_sink_to_current_stream(sink_q: asyncio.Queue) -> bool:
     sid = _current_stream_id.get()
     if not sid:
         return False
-    _get_sinks(sid).add(sink_q)
+    state = _ensure_stream(sid)
+    if sink_q not in state.sinks:
+        state.sinks[sink_q] = asyncio.create_task(_pump_sink(state, sink_q))
     return True
 
 async def unregister_sink_from_current_stream(sink_q: asyncio.Queue) -> None:
     sid = _current_stream_id.get()
     if not sid:
         return
-    _get_sinks(sid).discard(sink_q)
-
-async def _sse_event_generator(stream_id: str) -> AsyncGenerator[bytes, None]:
-    loop, main_q, sinks = _ensure_stream(stream_id)
-
-    async def heartbeat():
-        while True:
-            await asyncio.sleep(15)
-            try:
-                await main_q.put({"type": "heartbeat", "ts": datetime.now().isoformat()})
-            except Exception:
-                break
+    state = _STREAMS.get(sid)
+    if state is None:
+        return
+    task = state.sinks.pop(sink_q, None)
+    if task is not None:
+        task.cancel()
 
-    async def fan_in_from_sinks():
-        while True:
-            try:
-                if not sinks:
-                    await asyncio.sleep(0.1)
-                    continue
-                for sq in list(sinks):
-                    try:
-                        item = sq.get_nowait()
-                    except asyncio.QueueEmpty:
-                        continue
-                    else:
-                        await main_q.put({"type": "turn_event", "content": item, "ts": datetime.now().isoformat()})
-                await asyncio.sleep(0)
-            except asyncio.CancelledError:
-                break
-            except Exception:
-                logger.exception("[SSE] fan_in_from_sinks error")
-                await asyncio.sleep(0.5)
+# ─────────────────────────────────────────────────────────
+# SSE heartbeat: stream마다 task를 두지 않고 TimerHandle 하나가 열린 stream 전체에 넣는다
+# - 구독 중인 stream이 하나도 없으면 다시 예약하지 않고 멈춤
+# ─────────────────────────────────────────────────────────
+_SSE_HB_INTERVAL = 15.0
+# (예약한 loop, 핸들). 핸들은 loop에 묶이므로 loop를 같이 들고 있다가 loop가 닫혔거나 바뀌면 다시 예약한다.
+_HB: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.TimerHandle]] = None
+_HB_REFS = 0  # 열린 SSE generator 전체 수 (0이 되면 타이머 해제)
+
+def _cancel_heartbeat(hb: Tuple[asyncio.AbstractEventLoop, asyncio.TimerHandle]) -> None:
+    loop, handle = hb
+    if loop.is_closed():
+        return
+    with contextlib.suppress(RuntimeError):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            handle.cancel()
+        else:
+            loop.call_soon_threadsafe(handle.cancel)
+
+def _heartbeat_tick() -> None:
+    global _HB
+    loop = asyncio.get_running_loop()
+    if _HB is None or _HB[0] is not loop:
+        return  # 다른 loop로 재예약된 뒤 남은 옛 타이머
+    _HB = None
+    ev = {"type": "heartbeat", "ts": _now_iso()}
+    alive = False
+    for state in list(_STREAMS.values()):
+        if state.hb_refs <= 0:
+            continue
+        alive = True
+        with contextlib.suppress(Exception):
+            if state.loop is loop:
+                _enqueue(state, dict(ev))
+            else:
+                _post_events(state, [dict(ev)])
+    if alive:
+        _HB = (loop, loop.call_later(_SSE_HB_INTERVAL, _heartbeat_tick))
+
+def _ensure_heartbeat() -> None:
+    """현재 loop에 살아 있는 heartbeat 타이머가 없으면 (다시) 예약."""
+    global _HB
+    loop = asyncio.get_running_loop()
+    hb = _HB
+    if hb is not None:
+        hb_loop, handle = hb
+        if hb_loop is loop and not handle.cancelled():
+            return
+        if not hb_loop.is_closed() and not handle.cancelled():
+            _cancel_heartbeat(hb)
+    _HB = (loop, loop.call_later(_SSE_HB_INTERVAL, _heartbeat_tick))
+
+def _acquire_heartbeat() -> None:
+    global _HB_REFS
+    _HB_REFS += 1
+    _ensure_heartbeat()
+
+def _release_heartbeat() -> None:
+    global _HB, _HB_REFS
+    _HB_REFS = max(0, _HB_REFS - 1)
+    if _HB_REFS == 0 and _HB is not None:
+        hb, _HB = _HB, None
+        _cancel_heartbeat(hb)
 
-    hb_task = asyncio.create_task(heartbeat())
-    fanin_task = asyncio.create_task(fan_in_from_sinks())
+async def _sse_event_generator(stream_id: str) -> AsyncGenerator[bytes, None]:
+    st = _ensure_stream(stream_id)
+    main_q = st.queue
+    st.hb_refs += 1
+    _acquire_heartbeat()
 
     try:
-        await main_q.put({"type": "ping", "ts": datetime.now().isoformat(), "stream_id": stream_id})
+        # 소비자가 바로 이 코루틴이므로 await put 대신 non-blocking으로 넣는다
+        _enqueue(st, {"type": "ping", "ts": _now_iso(), "stream_id": stream_id})
 
         while True:
             msg = await main_q.get()
-            payload = json.dumps(msg, ensure_ascii=False)
-            yield f"data: {payload}\n\n".encode("utf-8")
+            yield b"data: " + _dumps_bytes(msg) + b"\n\n"
     except asyncio.CancelledError:
         pass
     finally:
-        for t in (hb_task, fanin_task):
+        st.hb_refs = max(0, st.hb_refs - 1)
+        _release_heartbeat()
+        for t in st.sinks.values():
             t.cancel()
-        _STREAMS.pop(stream_id, None)
+        st.sinks.clear()
+        if st.dropped:
+            logger.info("[SSE] stream=%s 종료: high-water에서 버린 저우선 이벤트 %d건", stream_id, st.dropped)
+        _drop_stream_state(stream_id, st)
+
+# ─────────────────────────────────────────────────────────
+# SSE emit 배치
+# - 액션/관찰/로그마다 call_soon_threadsafe를 부르지 않고 stream별 버퍼에 모았다가
+#   _EMIT_BATCH_MAX개 또는 _EMIT_FLUSH_INTERVAL초마다 한 번에 main_q로 넘긴다.
+# - 큐에는 여전히 이벤트가 1개씩 들어가므로 SSE 프레임 형식은 그대로다.
+# - VP_SSE_EMIT_BATCH=0 이면 기존처럼 이벤트마다 즉시 전달
+# ─────────────────────────────────────────────────────────
+_EMIT_BATCH_ENABLED = os.getenv("VP_SSE_EMIT_BATCH", "1").strip() not in ("0", "false", "FALSE", "no", "NO")
+_EMIT_BATCH_MAX = 8
+_EMIT_FLUSH_INTERVAL = 0.05
+# 지연 없이 바로 내보내야 하는 이벤트(종료/에러 계열)
+_EMIT_FLUSH_KINDS = frozenset(("agent_finish", "run_end", "error"))
+_EMIT_BUFFERS: Dict[str, List[Dict[str, Any]]] = {}
+_EMIT_LOCK = ThreadLock()
 
 def _truncate(obj: Any, max_len: int = 800) -> Any:
+    """
+    긴 문자열을 max_len에서 자른 값. 잘린 곳이 없는 dict/list는 복사하지 않고 원본을 그대로 반환하고,
+    잘린 곳이 있으면 그 경로의 컨테이너만 새로 만든다 (copy-on-write).
+    """
     try:
         if isinstance(obj, str):
             return (obj[:max_len] + "…") if len(obj) > max_len else obj
         if isinstance(obj, list):
-            return [_truncate(x, max_len) for x in obj]
+            out: Optional[List[Any]] = None
+            for i, x in enumerate(obj):
+                y = _truncate(x, max_len)
+                if out is None:
+                    if y is x:
+                        continue
+                    out = obj[:i]
+                out.append(y)
+            return obj if out is None else out
         if isinstance(obj, dict):
-            return {k: _truncate(v, max_len) for k, v in obj.items()}
+            changed: Optional[Dict[Any, Any]] = None
+            for k, v in obj.items():
+                y = _truncate(v, max_len)
+                if y is not v:
+                    if changed is None:
+                        changed = {}
+                    changed[k] = y
+            return obj if changed is None else {**obj, **changed}  # 키 순서는 obj 그대로
     except Exception:
         pass
     return obj
 
-def _emit_to_stream(kind: str, content: Any):
+def _emit_to_stream(kind: str, content: Any, *, truncated: bool = False):
+    """
+    현재 stream_id로 SSE 이벤트 전송. content는 여기서 _truncate(2000) 한 번만 적용한다.
+    - 호출부는 2000 이상으로 미리 _truncate하지 말 것 (이미 잘라 둔 경우 truncated=True)
+    """
     stream_id = _current_stream_id.get()
     if not stream_id:
         return
+    # 등록된 스트림(구독 대상)이 없으면 payload(_truncate)를 만들 필요도 없다.
+    state = _STREAMS.get(stream_id)
+    if state is None:
+        return
+    try:
+        loop = state.loop
+        ev = {
+            "type": kind,
+            "content": content if truncated else _truncate(content, 2000),
+            "ts": _now_iso(),
+        }
+        if not _EMIT_BATCH_ENABLED:
+            _post_events(state, [ev])
+            return
+        with _EMIT_LOCK:
+            buf = _EMIT_BUFFERS.get(stream_id)
+            if buf is None:
+                buf = _EMIT_BUFFERS[stream_id] = []
+            first = not buf
+            buf.append(ev)
+            flush_now = len(buf) >= _EMIT_BATCH_MAX or kind in _EMIT_FLUSH_KINDS
+        if flush_now:
+            _flush_emit_buffer(stream_id)
+        elif first:
+            # 버퍼가 비어 있다가 처음 찼을 때만 loop에 지연 flush 예약 (배치당 1회)
+            loop.call_soon_threadsafe(loop.call_later, _EMIT_FLUSH_INTERVAL, _flush_emit_buffer, stream_id)
+    except Exception:
+        pass
+
+def _flush_emit_buffer(stream_id: str) -> None:
+    """stream_id 버퍼에 쌓인 이벤트를 순서대로 main_q에 한 번의 loop 호출로 넣는다."""
     try:
-        loop = _get_loop(stream_id)
-        q = _get_main_queue(stream_id)
-        ev = {"type": kind, "content": _truncate(content, 2000), "ts": datetime.now().isoformat()}
-        loop.call_soon_threadsafe(q.put_nowait, ev)
+        with _EMIT_LOCK:
+            batch = _EMIT_BUFFERS.pop(stream_id, None)
+            if not batch:
+                return
+            state = _STREAMS.get(stream_id)
+            if state is None:
+                return
+            # 락 안에서 넘겨야 다른 스레드의 flush와 순서가 뒤바뀌지 않는다.
+            _post_events(state, batch)
     except Exception:
         pass
 
@@ -274,52 +722,38 @@ class _LogToSSEHandler(logging.Handler):
         except Exception:
             pass
 
+# langchain* 로거의 INFO 이하는 단계마다 쏟아지므로 SSE로 보내지 않는다 (WARNING 이상만)
+_SSE_QUIET_LOGGER_PREFIXES = ("langchain",)
+
+class _SSELogFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        # 핸들러는 root에 상주하므로, SSE run 컨텍스트 밖의 레코드는 format 전에 여기서 거른다
+        sid = _current_stream_id.get()
+        if not sid or sid not in _STREAMS:
+            return False
+        return record.levelno >= logging.WARNING or not record.name.startswith(_SSE_QUIET_LOGGER_PREFIXES)
+
 _sse_log_handler = _LogToSSEHandler()
 _sse_log_handler.setLevel(logging.INFO)
 _sse_log_handler.setFormatter(logging.Formatter("%(message)s"))
+_sse_log_handler.addFilter(_SSELogFilter())
 
-_LANGCHAIN_LOGGERS = [
-    "langchain",
-    "langchain_core",
-    "langchain_community",
-]
 _ATTACHED_FLAG = "_sse_handler_attached"
 
 def _attach_global_sse_logging_handlers():
-    targets = [
-        logging.getLogger(),
-        logging.getLogger("uvicorn"),
-        logging.getLogger("uvicorn.error"),
-        logging.getLogger("uvicorn.access"),
-        logging.getLogger("httpx"),
-    ] + [logging.getLogger(n) for n in _LANGCHAIN_LOGGERS]
-
-    for lg in targets:
-        if not getattr(lg, _ATTACHED_FLAG, False):
-            lg.addHandler(_sse_log_handler)
-            try:
-                if lg.level in (logging.NOTSET,) or lg.level > logging.INFO:
-                    lg.setLevel(logging.INFO)
-            except Exception:
-                pass
-            lg.propagate = True
-            setattr(lg, _ATTACHED_FLAG, True)
-
-def _detach_global_sse_logging_handlers():
-    targets = [
-        logging.getLogger(),
-        logging.getLogger("uvicorn"),
-        logging.getLogger("uvicorn.error"),
-        logging.getLogger("uvicorn.access"),
-        logging.getLogger("httpx"),
-    ] + [logging.getLogger(n) for n in _LANGCHAIN_LOGGERS]
-
-    for lg in targets:
-        with contextlib.suppress(Exception):
-            lg.removeHandler(_sse_log_handler)
-        if getattr(lg, _ATTACHED_FLAG, False):
-            with contextlib.suppress(Exception):
-                delattr(lg, _ATTACHED_FLAG)
+    """
+    root 로거 한 곳에만 SSE 핸들러를 단다.
+    - 하위 로거에도 달면 propagate로 root에서 한 번 더 찍혀 레코드가 중복 format/emit 된다.
+    - 하위 로거의 propagate 설정은 건드리지 않는다 (propagate=False인 로거는 SSE로 안 감)
+    """
+    root = logging.getLogger()
+    if getattr(root, _ATTACHED_FLAG, False):
+        return
+    root.addHandler(_sse_log_handler)
+    with contextlib.suppress(Exception):
+        if root.level == logging.NOTSET or root.level > logging.INFO:
+            root.setLevel(logging.INFO)
+    setattr(root, _ATTACHED_FLAG, True)
 
 router = APIRouter(prefix="/api/sse", tags=["sse"])
 
@@ -338,48 +772,232 @@ def _ensure_console_stream_handler():
         ))
         root.addHandler(sh)
 
+# SSE 로깅 부트스트랩은 프로세스당 1번 (run마다 붙였다 떼면 동시 run의 로그가 끊긴다)
+_SSE_LOGGING_READY = False
+_SSE_LOGGING_LOCK = ThreadLock()
+
+def _init_sse_logging_once() -> None:
+    global _SSE_LOGGING_READY
+    if _SSE_LOGGING_READY:
+        return
+    with _SSE_LOGGING_LOCK:
+        if _SSE_LOGGING_READY:
+            return
+        _attach_global_sse_logging_handlers()
+        _ensure_console_stream_handler()
+        _SSE_LOGGING_READY = True
+
+# ─────────────────────────────────────────────────────────
+# TeeTerminal 백그라운드 writer
+# - 에이전트 스레드는 (tee, text)를 큐에 넣기만 하고 바로 복귀
+# - 콘솔 write/flush와 SSE 전달은 데몬 스레드가 배치로 처리
+# - 큐가 가득 차면 콘솔에는 직접 쓰고 SSE 줄은 버린다(개수는 tee.dropped)
+# ─────────────────────────────────────────────────────────
+_TEE_Q_MAX = 4096
+_TEE_BATCH_MAX = 64
+_TEE_Q: "queue.Queue[Tuple[TeeTerminal, Optional[str], Optional[ThreadEvent]]]" = queue.Queue(maxsize=_TEE_Q_MAX)
+_TEE_WRITER: Optional[Thread] = None
+_TEE_WRITER_LOCK = ThreadLock()
+
+def _tee_writer_loop() -> None:
+    while True:
+        batch = [_TEE_Q.get()]
+        with contextlib.suppress(queue.Empty):
+            while len(batch) < _TEE_BATCH_MAX:
+                batch.append(_TEE_Q.get_nowait())
+
+        touched: Dict[int, Any] = {}
+        tees: Dict[int, TeeTerminal] = {}
+        waiters: List[ThreadEvent] = []
+        for tee, text, done in batch:
+            with contextlib.suppress(Exception):
+                if text is not None:
+                    tee._consume(text)
+                else:
+                    tee._emit_rest()
+                touched[id(tee.orig)] = tee.orig
+                tees[id(tee)] = tee
+            if done is not None:
+                waiters.append(done)
+        for orig in touched.values():
+            with contextlib.suppress(Exception):
+                orig.flush()
+        # 배치에서 모인 줄은 tee당 _post_events 1번으로 넘긴다 (waiter 깨우기 전에)
+        for tee in tees.values():
+            tee._flush_out()
+        for done in waiters:
+            done.set()
+        for _ in batch:
+            _TEE_Q.task_done()
+
+def _ensure_tee_writer() -> None:
+    global _TEE_WRITER
+    if _TEE_WRITER is not None and _TEE_WRITER.is_alive():
+        return
+    with _TEE_WRITER_LOCK:
+        if _TEE_WRITER is None or not _TEE_WRITER.is_alive():
+            _TEE_WRITER = Thread(target=_tee_writer_loop, name="vp-tee-writer", daemon=True)
+            _TEE_WRITER.start()
+
 class TeeTerminal:
     def __init__(self, stream_id: str, which: str = "stdout"):
         self.stream_id = stream_id
         self.which = which
         self.orig = sys.__stdout__ if which == "stdout" else sys.__stderr__
         self.buffer = ""
-        self.loop = _get_loop(stream_id)
-        self.q = _get_main_queue(stream_id)
+        self._out: List[Dict[str, Any]] = []  # writer 스레드가 모은 terminal 이벤트 (flush 전)
+        self.state = _ensure_stream(stream_id)
+        self.dropped = 0
+        _ensure_tee_writer()
 
     def write(self, text: str):
         if not text:
             return
         try:
-            self.orig.write(text)
-            self.orig.flush()
+            _TEE_Q.put_nowait((self, text, None))
+        except queue.Full:
+            self.dropped += 1
+            with contextlib.suppress(Exception):
+                self.orig.write(text)
+
+    def flush(self):
+        # logging 핸들러가 레코드마다 flush를 부르므로 여기서는 기다리지 않는다.
+        with contextlib.suppress(queue.Full):
+            _TEE_Q.put_nowait((self, None, None))
+
+    def drain(self, timeout: float = 2.0) -> bool:
+        """지금까지 write된 내용이 콘솔/SSE로 모두 넘어갈 때까지 대기 (run 종료 시 1회)."""
+        done = ThreadEvent()
+        try:
+            _TEE_Q.put((self, None, done), timeout=timeout)
+        except queue.Full:
+            return False
+        ok = done.wait(timeout)
+        if self.dropped:
+            logger.warning("[TeeTerminal] %s: 큐 포화로 SSE 전달 누락 %d건", self.which, self.dropped)
+        return ok
+
+    # ── 이하 writer 스레드 전용 ──
+    def _send(self, content: str) -> None:
+        self._out.append({"type": "terminal", "content": content, "ts": _now_iso()})
+
+    def _flush_out(self) -> None:
+        """모아 둔 terminal 줄을 한 번에 main_q 쪽으로 전달."""
+        if not self._out:
+            return
+        out, self._out = self._out, []
+        try:
+            _post_events(self.state, out)
         except Exception:
             pass
 
+    def _consume(self, text: str, echo: bool = True) -> None:
+        if echo:
+            with contextlib.suppress(Exception):
+                self.orig.write(text)
         self.buffer += text
         while "\n" in self.buffer:
             line, self.buffer = self.buffer.split("\n", 1)
             line = line.rstrip()
-            if not line:
-                continue
-            msg = {"type": "terminal", "content": line, "ts": datetime.now().isoformat()}
-            try:
-                self.loop.call_soon_threadsafe(self.q.put_nowait, msg)
-            except Exception:
-                pass
+            if line:
+                self._send(line)
 
-    def flush(self):
-        if self.buffer.strip():
-            msg = {"type": "terminal", "content": self.buffer.strip(), "ts": datetime.now().isoformat()}
-            try:
-                self.loop.call_soon_threadsafe(self.q.put_nowait, msg)
-            except Exception:
-                pass
-            self.buffer = ""
+    def _emit_rest(self) -> None:
+        rest = self.buffer.strip()
+        self.buffer = ""
+        if rest:
+            self._send(rest)
+
+# ─────────────────────────────────────────────────────────
+# fd 레벨 tee (옵션: VP_SSE_FD_TEE=1)
+# - redirect_stdout은 파이썬 sys.stdout만 바꾸므로 C 확장/서브프로세스의 fd 1/2 출력은 SSE로 안 간다.
+# - fd 1/2를 pipe로 dup2하고 reader 스레드가 원래 콘솔 fd로 그대로 echo + 줄 단위로 SSE 전송
+# - ⚠️ dup2 캡처는 프로세스 전역: tee가 켜져 있는 동안 서버 로그 전체와 다른 동시 run의 출력까지
+#   이 run의 SSE 스트림으로 나간다. 단일 run 디버깅(CLI/로컬) 전용으로만 켤 것.
+# - 시작 시점에 다른 run이 돌고 있거나 이미 다른 run이 소유 중이면 켜지 않고 TeeTerminal 경로로 fallback
+#   (도중에 시작된 run의 출력이 섞이는 것까지 막지는 못한다)
+# ─────────────────────────────────────────────────────────
+_SSE_FD_TEE = os.getenv("VP_SSE_FD_TEE", "").strip() in ("1", "true", "TRUE", "yes", "YES")
+
+class _FdTee:
+    _owner_lock = ThreadLock()
+    _active = False
+
+    def __init__(self, stream_id: str):
+        self.stream_id = stream_id
+        self._pipes: List[Tuple[int, int, int, int, Thread]] = []  # (fd, saved, r, w, reader)
+        self._line_buffering: Dict[int, bool] = {}
+
+    @classmethod
+    def try_start(cls, stream_id: str) -> Optional["_FdTee"]:
+        with cls._owner_lock:
+            if cls._active:
+                return None
+            cls._active = True
+        tee = cls(stream_id)
         try:
-            self.orig.flush()
-        except Exception:
-            pass
+            tee._start()
+        except Exception as e:
+            tee.stop()
+            logger.warning("[FdTee] 시작 실패 → TeeTerminal 사용: %s", e)
+            return None
+        return tee
+
+    def _start(self) -> None:
+        for fd, which, stream in ((1, "stdout", sys.stdout), (2, "stderr", sys.stderr)):
+            with contextlib.suppress(Exception):
+                stream.flush()
+            # pipe로 바뀌면 block buffering이 되어 줄이 늦게 나가므로 run 동안 line buffering
+            with contextlib.suppress(Exception):
+                self._line_buffering[fd] = stream.line_buffering
+                stream.reconfigure(line_buffering=True)
+            saved = os.dup(fd)
+            r, w = os.pipe()
+            os.dup2(w, fd)
+            line_tee = TeeTerminal(self.stream_id, which)
+            reader = Thread(target=self._pump, args=(r, saved, line_tee), name=f"vp-fd-tee-{which}", daemon=True)
+            reader.start()
+            self._pipes.append((fd, saved, r, w, reader))
+
+    @staticmethod
+    def _pump(r: int, saved: int, line_tee: "TeeTerminal") -> None:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while True:
+            try:
+                chunk = os.read(r, 4096)
+            except OSError:
+                break
+            if not chunk:
+                break
+            with contextlib.suppress(OSError):
+                os.write(saved, chunk)
+            line_tee._consume(decoder.decode(chunk), echo=False)
+            line_tee._flush_out()
+        line_tee._consume(decoder.decode(b"", final=True), echo=False)
+        line_tee._emit_rest()
+        line_tee._flush_out()
+
+    def stop(self) -> None:
+        for stream in (sys.stdout, sys.stderr):
+            with contextlib.suppress(Exception):
+                stream.flush()
+        for fd, saved, r, w, reader in self._pipes:
+            with contextlib.suppress(OSError):
+                os.dup2(saved, fd)
+            with contextlib.suppress(OSError):
+                os.close(w)  # 마지막 write end가 닫히면 reader가 EOF를 받는다
+            reader.join(timeout=2.0)
+            for extra in (r, saved):
+                with contextlib.suppress(OSError):
+                    os.close(extra)
+        self._pipes.clear()
+        for fd, stream in ((1, sys.stdout), (2, sys.stderr)):
+            if fd in self._line_buffering:
+                with contextlib.suppress(Exception):
+                    stream.reconfigure(line_buffering=self._line_buffering[fd])
+        self._line_buffering.clear()
+        with _FdTee._owner_lock:
+            _FdTee._active = False
 
 # ─────────────────────────────────────────────────────────
 # JSON/파싱 유틸
@@ -407,31 +1025,52 @@ def _parse_victim_turn_text(text: Any) -> Tuple[Optional[str], Optional[Dict[str
         if not isinstance(text, str):
             return None, None
 
-        s = text.strip()
-        if not (s.startswith("{") and s.endswith("}")):
-            return None, None
-
-        obj = json.loads(s)
-        if not isinstance(obj, dict):
+        parsed = _parse_victim_json_str(text)
+        if parsed is None:
             return None, None
-
-        dialogue = obj.get("dialogue")
+        dialogue, is_convinced, thoughts = parsed
+        # meta dict는 턴마다 저장/수정되므로 캐시 결과를 공유하지 않고 매번 새로 만든다.
         meta = {
-            "is_convinced": obj.get("is_convinced"),
-            "thoughts": obj.get("thoughts"),
+            "is_convinced": is_convinced,
+            "thoughts": thoughts,
             "raw_json": text,
         }
-        return (dialogue if isinstance(dialogue, str) else None), meta
+        return dialogue, meta
     except Exception:
         return None, None
 
+@functools.lru_cache(maxsize=4096)
+def _parse_victim_json_str(text: str) -> Optional[Tuple[Optional[str], Any, Any]]:
+    """victim JSON 문자열 파싱 결과(dialogue, is_convinced, thoughts) 캐시. 라벨링 단계에서 같은 텍스트를 다시 파싱하지 않도록."""
+    s = text.strip()
+    if not (s.startswith("{") and s.endswith("}")):
+        return None
+    try:
+        obj = _loads(s)
+    except Exception:
+        return None
+    if not isinstance(obj, dict):
+        return None
+    dialogue = obj.get("dialogue")
+    return (dialogue if isinstance(dialogue, str) else None), obj.get("is_convinced"), obj.get("thoughts")
+
+# label_victim_emotions 결과를 기존 턴에 merge할 때 덮어쓰지 않는 필드
+_LABEL_PROTECT_KEYS = frozenset({
+    "text", "dialogue", "victim_meta", "is_convinced", "thoughts",
+    "gender", "age_group",
+})
+
 def _norm_role(role: Any) -> str:
     """
     MCP/LLM/tool이 role을 다양하게 주는 경우를 통일.
     - victim 계열: victim/user/사용자/피해자
     - offender 계열: offender/scammer/attacker/assistant/agent/가해자/사기범
     """
-    s = str(role or "").strip().lower()
+    return _norm_role_str(str(role or ""))
+
+@functools.lru_cache(maxsize=256)
+def _norm_role_str(raw: str) -> str:
+    s = raw.strip().lower()
     if not s:
         return "unknown"
     if s in ("victim", "user", "사용자", "피해자"):
@@ -440,18 +1079,72 @@ def _norm_role(role: Any) -> str:
         return "offender"
     return s
 
+# 중괄호/따옴표/백슬래시만 골라 보는 스캐너 (문자 하나하나 파이썬 루프를 돌지 않도록)
+_JSON_SCAN_RE = re.compile(r'[{}"\\]')
+# 판정/지침/관찰 파싱 fallback 패턴 (호출마다 re 캐시 조회하지 않도록 모듈 로드시 1회 컴파일)
+_TEXT_KV_RE = re.compile(r"text['\"]\s*:\s*['\"]([^'\"]+)['\"]")
+_ANY_BRACE_RE = re.compile(r"\{.*\}", re.S)
+_ANY_JSON_RE = re.compile(r"(\{.*\}|\[.*\])", re.S)
+_CASE_ID_RE = re.compile(r"CASE_ID:\s*([a-f0-9\-]+)", re.I)
+
+def _find_json_with_key(s: str, *keys: str) -> Optional[Dict[str, Any]]:
+    """
+    s를 한 번 훑으며 최상위(깊이 0) {...} 구간을 찾고, JSON으로 파싱했을 때 keys를 모두
+    최상위 키로 가진 첫 dict를 반환. 없으면 None.
+    - `{.*"key".*}` 정규식의 백트래킹 대신 O(n) 스캔. 중첩 객체는 따로 검사하지 않는다(바깥 우선).
+    """
+    needles = tuple(f'"{k}"' for k in keys)
+    if not all(n in s for n in needles):
+        return None
+    depth = 0
+    top = -1
+    in_str = False
+    skip = -1
+    for hit in _JSON_SCAN_RE.finditer(s):
+        i = hit.start()
+        if i == skip:
+            continue
+        ch = s[i]
+        if in_str:
+            if ch == "\\":
+                skip = i + 1
+            elif ch == '"':
+                in_str = False
+            continue
+        if ch == '"':
+            # 문자열 상태는 {...} 안에서만 추적 (본문 산문의 따옴표는 무시)
+            if depth:
+                in_str = True
+        elif ch == "{":
+            if depth == 0:
+                top = i
+            depth += 1
+        elif ch == "}" and depth:
+            depth -= 1
+            if depth:
+                continue
+            span = s[top:i + 1]
+            if not all(n in span for n in needles):
+                continue
+            try:
+                obj = _loads(span)
+            except Exception:
+                continue
+            if isinstance(obj, dict) and all(k in obj for k in keys):
+                return obj
+    return None
+
 def _extract_json_block(agent_result: Any) -> Dict[str, Any]:
     try:
         if isinstance(agent_result, dict):
             maybe = agent_result.get("output") if "output" in agent_result else agent_result
             if isinstance(maybe, str) and maybe.strip().startswith("{"):
-                return json.loads(maybe)
+                return _loads(maybe)
             if isinstance(maybe, dict):
                 return maybe
-        s = str(agent_result)
-        m = re.search(r"\{.*\"phishing\".*\}", s, re.S)
-        if m:
-            return json.loads(m.group(0))
+        found = _find_json_with_key(str(agent_result), "phishing")
+        if found is not None:
+            return found
     except Exception:
         pass
     return {}
@@ -472,23 +1165,21 @@ def _extract_guidance_text(agent_result: Any) -> str:
     except Exception:
         pass
     try:
-        s = str(agent_result)
-        m = re.search(r"\{.*\"type\".*\"text\".*\}", s, re.S)
-        if m:
-            o = json.loads(m.group(0))
+        o = _find_json_with_key(str(agent_result), "type", "text")
+        if o is not None:
             return (o.get("text") or "").strip()
     except Exception:
         pass
-    m2 = re.search(r"text['\"]\s*:\s*['\"]([^'\"]+)['\"]", str(agent_result))
+    m2 = _TEXT_KV_RE.search(str(agent_result))
     return m2.group(1).strip() if m2 else ""
 
 def _safe_json(obj: Any) -> Dict[str, Any]:
     if isinstance(obj, dict):
         return obj
-    s = str(obj).strip()
+    s = (obj if isinstance(obj, str) else str(obj)).strip()
     try:
         if s.startswith("{") and s.endswith("}"):
-            return json.loads(s)
+            return _loads(s)
     except Exception:
         pass
     return {}
@@ -496,18 +1187,32 @@ def _safe_json(obj: Any) -> Dict[str, Any]:
 def _loose_parse_json(obj: Any) -> Dict[str, Any]:
     if isinstance(obj, dict):
         return obj
-    s = str(obj).strip()
-    j = _safe_json(s)
-    if j:
-        return j
-    try:
-        if s.startswith("{") and s.endswith("}"):
+    if isinstance(obj, (bytes, bytearray)):
+        # ✅ bytes는 str() 하면 "b'...'"가 되어 파싱이 깨지므로 orjson에 그대로 넘긴다.
+        try:
+            j = _loads(obj)
+            if isinstance(j, dict):
+                return j
+        except Exception:
+            pass
+        obj = bytes(obj).decode("utf-8", errors="replace")
+    s = (obj if isinstance(obj, str) else str(obj)).strip()
+    # 중괄호가 없으면 어떤 단계도 dict를 만들 수 없다
+    if "{" not in s:
+        return {}
+    whole = s.startswith("{") and s.endswith("}")
+    if whole:
+        j = _safe_json(s)
+        if j:
+            return j
+        try:
             pyobj = ast.literal_eval(s)
             if isinstance(pyobj, dict):
                 return pyobj
-    except Exception:
-        pass
-    m = re.search(r"\{.*\}", s, re.S)
+        except Exception:
+            pass
+    # s 전체가 {...}면 첫 {~마지막 } 구간도 s 자체라 위에서 이미 실패했다 → 재시도하지 않는다
+    m = None if whole else _ANY_BRACE_RE.search(s)
     if m:
         sub = m.group(0)
         j = _safe_json(sub)
@@ -528,6 +1233,11 @@ def _loose_parse_json_any(obj: Any) -> Any:
     """
     if isinstance(obj, (dict, list)):
         return obj
+    if isinstance(obj, (bytes, bytearray)):
+        try:
+            return _loads(obj)
+        except Exception:
+            obj = bytes(obj).decode("utf-8", errors="replace")
     s = str(obj).strip()
     if not s:
         return obj
@@ -535,7 +1245,7 @@ def _loose_parse_json_any(obj: Any) -> Any:
     # 1) strict json
     try:
         if (s.startswith("{") and s.endswith("}")) or (s.startswith("[") and s.endswith("]")):
-            return json.loads(s)
+            return _loads(s)
     except Exception:
         pass
 
@@ -548,11 +1258,11 @@ def _loose_parse_json_any(obj: Any) -> Any:
 
     # 3) first {...} or [...]
     try:
-        m = re.search(r"(\{.*\}|\[.*\])", s, re.S)
+        m = _ANY_JSON_RE.search(s)
         if m:
             frag = m.group(1)
             try:
-                return json.loads(frag)
+                return _loads(frag)
             except Exception:
                 try:
                     return ast.literal_eval(frag)
@@ -562,6 +1272,11 @@ def _loose_parse_json_any(obj: Any) -> Any:
         pass
     return obj
 
+# Action Input 래퍼/코드펜스 패턴 (모든 도구 호출 입력마다 쓰이므로 모듈 로드시 1회 컴파일)
+_ACTION_INPUT_RE = re.compile(r"(?:Action Input:|action_input:)\s*([\{\[].*)$", re.IGNORECASE | re.DOTALL)
+_CODE_FENCE_OPEN_RE = re.compile(r"^```[a-zA-Z0-9_-]*\s*")
+_CODE_FENCE_CLOSE_RE = re.compile(r"\s*```$")
+
 def _strip_action_input_wrappers(text: str) -> str:
     """
     LLM이 생성한 Action Input 문자열에서 흔한 래퍼를 제거:
@@ -569,14 +1284,15 @@ def _strip_action_input_wrappers(text: str) -> str:
     - 코드펜스 ```json ... ```
     """
     t = (text or "").strip()
-    # "Action Input: {...}" / "action_input: {...}"
-    m = re.search(r"(?:Action Input:|action_input:)\s*([\{\[].*)$", t, flags=re.IGNORECASE | re.DOTALL)
-    if m:
-        t = m.group(1).strip()
+    # "Action Input: {...}" / "action_input: {...}" (대부분은 이미 JSON만 오므로 ':'가 없으면 스킵)
+    if ":" in t:
+        m = _ACTION_INPUT_RE.search(t)
+        if m:
+            t = m.group(1).strip()
     # 코드펜스 제거
     if t.startswith("```"):
-        t = re.sub(r"^```[a-zA-Z0-9_-]*\s*", "", t)
-        t = re.sub(r"\s*```$", "", t)
+        t = _CODE_FENCE_OPEN_RE.sub("", t)
+        t = _CODE_FENCE_CLOSE_RE.sub("", t)
         t = t.strip()
     return t
 
@@ -686,7 +1402,7 @@ def _robust_action_input_to_dict(data: Any) -> Optional[Dict[str, Any]]:
     frag = _extract_first_json_fragment(s)
     if frag:
         try:
-            obj = json.loads(frag)
+            obj = _loads(frag)
             if isinstance(obj, dict):
                 return obj
             if isinstance(obj, list):
@@ -698,7 +1414,7 @@ def _robust_action_input_to_dict(data: Any) -> Optional[Dict[str, Any]]:
     frag2 = _balance_json_fragment(s)
     if frag2:
         try:
-            obj = json.loads(frag2)
+            obj = _loads(frag2)
             if isinstance(obj, dict):
                 return obj
             if isinstance(obj, list):
@@ -718,6 +1434,13 @@ def _robust_action_input_to_dict(data: Any) -> Optional[Dict[str, Any]]:
         return None
     return None
 
+# label_victim_emotions가 턴에 붙이는 emotion/hmm 관련 키
+_LABEL_KEYS = frozenset((
+    "emotion", "pred4", "probs4",
+    "hmm_state", "v_state", "hmm", "hmm_viterbi",
+    "hmm_posterior", "hmm_summary",
+))
+
 def _looks_unlabeled_turns(turns_in: Any) -> bool:
     """
     turns(list[dict])가 '라벨링 전'처럼 보이는지 휴리스틱으로 판단.
@@ -726,18 +1449,12 @@ def _looks_unlabeled_turns(turns_in: Any) -> bool:
     try:
         if not isinstance(turns_in, list) or not turns_in:
             return True
-        sample = next((t for t in turns_in if isinstance(t, dict)), None)
+        sample = turns_in[0]
+        if not isinstance(sample, dict):
+            sample = next((t for t in turns_in if isinstance(t, dict)), None)
         if not isinstance(sample, dict) or not sample:
             return True
-        has_label_key = any(
-            k in sample
-            for k in (
-                "emotion", "pred4", "probs4",
-                "hmm_state", "v_state", "hmm", "hmm_viterbi",
-                "hmm_posterior", "hmm_summary",
-            )
-        )
-        return not has_label_key
+        return _LABEL_KEYS.isdisjoint(sample)
     except Exception:
         return True
 
@@ -759,13 +1476,74 @@ def _flatten_cached_turns_by_round(cache_turns_by_round: Dict[int, List[Dict[str
         pass
     return out
 
+def _to_int(v: Any) -> Optional[int]:
+    """
+    run_no/rounds 같은 값을 int로 정규화. 실패/None이면 None.
+    - 대부분 이미 int로 들어오므로 그 경우는 try/except 없이 바로 반환
+    """
+    if v is None:
+        return None
+    if type(v) is int:
+        return v
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+# ─────────────────────────────────────────────────────────
+# ✅ 읽기 전용 sim 도구 결과 memo (TTL + LRU)
+# - sim.fetch_entities / sim.compose_prompts는 같은 입력이면 같은 결과 → DB 조회/렌더 재사용
+# - 키: 도구 이름 + 정규화 JSON(sort_keys)의 blake2b
+# - 2라운드 이후 guidance가 붙은 compose는 라운드마다 달라지므로 캐시하지 않음
+# ─────────────────────────────────────────────────────────
+_SIM_MEMO_TOOLS = frozenset({"sim.fetch_entities", "sim.compose_prompts"})
+_SIM_MEMO_TTL = 600.0
+_SIM_MEMO_MAX = 1024
+_SIM_MEMO: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_SIM_MEMO_LOCK = ThreadLock()
+
+def _sim_memo_key(tool_name: str, payload: Dict[str, Any]) -> Optional[str]:
+    if tool_name not in _SIM_MEMO_TOOLS:
+        return None
+    d = payload.get("data") if isinstance(payload.get("data"), dict) else payload
+    if d.get("guidance") and (_to_int(d.get("round_no")) or 1) > 1:
+        return None
+    try:
+        return f"{tool_name}:{_digest(payload).hex()}"
+    except (TypeError, ValueError):
+        return None
+
+def _memo_invoke(original_tool, tool_name: str, payload: Dict[str, Any]) -> Any:
+    """original_tool.invoke(payload)와 동일하되, memo 대상이면 TTL 안의 이전 결과를 복사해 반환."""
+    key = _sim_memo_key(tool_name, payload)
+    if key is None:
+        return original_tool.invoke(payload)
+
+    now = time.monotonic()
+    with _SIM_MEMO_LOCK:
+        hit = _SIM_MEMO.get(key)
+        if hit is not None and now - hit[0] < _SIM_MEMO_TTL:
+            _SIM_MEMO.move_to_end(key)
+            logger.info("[SimMemo] hit tool=%s", tool_name)
+            return copy.deepcopy(hit[1])
+
+    out = original_tool.invoke(payload)
+    # 예외는 그대로 전파(캐시 안 함), 정상 dict 결과만 저장
+    if isinstance(out, dict):
+        with _SIM_MEMO_LOCK:
+            _SIM_MEMO[key] = (now, copy.deepcopy(out))
+            _SIM_MEMO.move_to_end(key)
+            while len(_SIM_MEMO) > _SIM_MEMO_MAX:
+                _SIM_MEMO.popitem(last=False)
+    return out
+
 def _wrap_tool_force_json_input(original_tool, *, require_data_wrapper: bool = True):
     """
     ReAct 에이전트가 Action Input을 문자열로 망가뜨려도,
     orchestrator에서 먼저 dict로 복구해서 original_tool.invoke(dict)로 넘긴다.
     """
-    from langchain_core.tools import tool
-    from typing import Any
+    # 래핑 대상 도구 이름은 불변이므로 호출마다가 아니라 래핑 시점에 한 번만 읽는다.
+    tool_name = getattr(original_tool, "name", "") or ""
 
     @tool
     def _wrapped(data: Any) -> Any:
@@ -791,12 +1569,13 @@ def _wrap_tool_force_json_input(original_tool, *, require_data_wrapper: bool = T
         # ─────────────────────────────────────────
         # ✅ stream_id 스코프 emotion 캐시 준비
         # ─────────────────────────────────────────
-        sid = _current_stream_id.get() or "no_stream"
-        if sid not in _EMO_CACHE:
-            _EMO_CACHE[sid] = {"turns_by_round": {}, "hmm_by_round": {}}
+        sid = _get_sid()
+        emo = _EMO_CACHE.get(sid)
+        if emo is None:
+            emo = _EMO_CACHE[sid] = {"turns_by_round": {}, "hmm_by_round": {}}
         # 방어: 키 누락되었을 수 있음(핫리로드/부분 갱신 등)
-        _EMO_CACHE[sid].setdefault("turns_by_round", {})
-        _EMO_CACHE[sid].setdefault("hmm_by_round", {})
+        emo_turns_by_round: Dict[int, Any] = emo.setdefault("turns_by_round", {})
+        emo_hmm_by_round: Dict[int, Any] = emo.setdefault("hmm_by_round", {})
 
         # ─────────────────────────────────────────
         # ✅ (1) admin.make_judgement / admin.make_prevention 입력 자동 보정
@@ -804,22 +1583,17 @@ def _wrap_tool_force_json_input(original_tool, *, require_data_wrapper: bool = T
         # - turns가 라벨링 전(원본)처럼 보이면 캐시 turns로 교체
         # ─────────────────────────────────────────
         try:
-            tool_name = getattr(original_tool, "name", "") or ""
             if tool_name in ("admin.make_judgement", "admin.make_prevention"):
                 d = parsed.get("data") if isinstance(parsed.get("data"), dict) else parsed
                 # -----------------------------
                 # (A) admin.make_judgement: run_no 단위 보정
                 # -----------------------------
                 if tool_name == "admin.make_judgement":
-                    run_no = d.get("run_no") or d.get("run")
-                    try:
-                        run_no = int(run_no)
-                    except Exception:
-                        run_no = None
+                    run_no = _to_int(d.get("run_no") or d.get("run"))
 
                     if run_no is not None:
-                        cached_turns = _EMO_CACHE[sid]["turns_by_round"].get(run_no)
-                        cached_hmm = _EMO_CACHE[sid]["hmm_by_round"].get(run_no)
+                        cached_turns = emo_turns_by_round.get(run_no)
+                        cached_hmm = emo_hmm_by_round.get(run_no)
 
                         # ✅ (0) 키 오타/불일치 정규화: hhm -> hmm
                         if "hhm" in d and "hmm" not in d:
@@ -844,15 +1618,11 @@ def _wrap_tool_force_json_input(original_tool, *, require_data_wrapper: bool = T
                 #   캐시(turns_by_round)로 라벨링된 turns를 강제 주입.
                 # -----------------------------
                 if tool_name == "admin.make_prevention":
-                    rounds = d.get("rounds")
-                    try:
-                        rounds = int(rounds) if rounds is not None else None
-                    except Exception:
-                        rounds = None
+                    rounds = _to_int(d.get("rounds"))
 
                     turns_in = d.get("turns")
                     # 캐시에서 flatten한 "라운드별 라벨링된 turns" 생성
-                    cached_all = _flatten_cached_turns_by_round(_EMO_CACHE[sid]["turns_by_round"], up_to_round=rounds)
+                    cached_all = _flatten_cached_turns_by_round(emo_turns_by_round, up_to_round=rounds)
 
                     # turns가 없거나 / unlabeled로 보이면 캐시로 교체
                     if cached_all and _looks_unlabeled_turns(turns_in):
@@ -873,43 +1643,24 @@ def _wrap_tool_force_json_input(original_tool, *, require_data_wrapper: bool = T
         # - 에이전트가 turns를 누락/라벨링 전 turns를 넣어도 캐시로 강제 교체
         # ─────────────────────────────────────────
         try:
-            tool_name = getattr(original_tool, "name", "") or ""
             if tool_name == "admin.make_prevention":
                 d = parsed.get("data") if isinstance(parsed.get("data"), dict) else parsed
 
                 # rounds 결정: input 우선, 없으면 캐시에서 최대 라운드로
-                rounds = d.get("rounds")
-                try:
-                    rounds = int(rounds) if rounds is not None else None
-                except Exception:
-                    rounds = None
-
-                # cache에서 현재 stream의 라벨링된 라운드 목록
-                cache_rounds = sorted((_EMO_CACHE.get(sid, {}) or {}).get("turns_by_round", {}).keys())
-                if rounds is None and cache_rounds:
-                    rounds = int(cache_rounds[-1])
+                # (캐시 키는 label_victim_emotions 저장 시 이미 int로 정규화됨)
+                rounds = _to_int(d.get("rounds"))
+                if rounds is None and emo_turns_by_round:
+                    rounds = max(emo_turns_by_round)
 
                 # turns가 라벨링 전처럼 보이는지 휴리스틱(=judgement 때와 동일한 느낌)
                 turns_in = d.get("turns")
-                looks_unlabeled = False
-                if isinstance(turns_in, list) and turns_in:
-                    sample = next((t for t in turns_in if isinstance(t, dict)), {})
-                    if isinstance(sample, dict):
-                        has_label_key = any(
-                            k in sample
-                            for k in ("emotion", "pred4", "probs4", "hmm_state", "v_state", "hmm", "hmm_viterbi")
-                        )
-                        looks_unlabeled = not has_label_key
-                else:
-                    looks_unlabeled = True  # turns 누락/비정상 => 교체
+                looks_unlabeled = _looks_unlabeled_turns(turns_in)  # turns 누락/비정상도 True => 교체
 
                 if rounds is not None and looks_unlabeled:
-                    labeled_all: List[Dict[str, Any]] = []
-                    turns_by_round = (_EMO_CACHE.get(sid, {}) or {}).get("turns_by_round", {})
-                    for rno in range(1, rounds + 1):
-                        t = turns_by_round.get(rno)
-                        if isinstance(t, list) and t:
-                            labeled_all.extend(t)
+                    parts = [emo_turns_by_round.get(rno) for rno in range(1, rounds + 1)]
+                    labeled_all: List[Dict[str, Any]] = list(
+                        chain.from_iterable(p for p in parts if isinstance(p, list))
+                    )
                     if labeled_all:
                         d["turns"] = labeled_all
                         d["turns_source"] = "orchestrator._EMO_CACHE(turns_by_round)"
@@ -933,7 +1684,7 @@ def _wrap_tool_force_json_input(original_tool, *, require_data_wrapper: bool = T
                 if x is None:
                     return False
                 if isinstance(x, dict):
-                    s = json.dumps(x, ensure_ascii=False)
+                    s = _dumps(x)
                 else:
                     s = str(x)
                 s_low = s.lower()
@@ -941,16 +1692,10 @@ def _wrap_tool_force_json_input(original_tool, *, require_data_wrapper: bool = T
             except Exception:
                 return False
 
-        tool_name = getattr(original_tool, "name", "") or ""
         if tool_name == "admin.generate_guidance":
             d = parsed.get("data") if isinstance(parsed.get("data"), dict) else parsed
-            run_no_raw = None
-            try:
-                run_no_raw = d.get("run_no") or d.get("run")
-            except Exception:
-                run_no_raw = None
             try:
-                run_no_int = int(run_no_raw) if run_no_raw is not None else None
+                run_no_int = _to_int(d.get("run_no") or d.get("run"))
             except Exception:
                 run_no_int = None
 
@@ -989,7 +1734,7 @@ def _wrap_tool_force_json_input(original_tool, *, require_data_wrapper: bool = T
                     return {"ok": False, "error": "tool_invoke_failed", "message": str(e)}
         else:
             try:
-                out = original_tool.invoke(parsed)
+                out = _memo_invoke(original_tool, tool_name, parsed)
             except Exception as e:
                 return {
                     "ok": False,
@@ -1001,7 +1746,6 @@ def _wrap_tool_force_json_input(original_tool, *, require_data_wrapper: bool = T
         # - input에 run_no를 반드시 포함시키도록 case_mission도 함께 수정되어야 함
         # ─────────────────────────────────────────
         try:
-            tool_name = getattr(original_tool, "name", "") or ""
             if tool_name == "label_victim_emotions":
                 run_no = None
                 # require_data_wrapper=False라 보통 최상위에 run_no가 있음
@@ -1009,19 +1753,25 @@ def _wrap_tool_force_json_input(original_tool, *, require_data_wrapper: bool = T
                     run_no = parsed.get("run_no")
                     if run_no is None and isinstance(parsed.get("data"), dict):
                         run_no = parsed["data"].get("run_no")
-                try:
-                    run_no = int(run_no) if run_no is not None else None
-                except Exception:
-                    run_no = None
+                run_no = _to_int(run_no)
 
-                labeled_any = _loose_parse_json_any(out)
+                # ✅ 대용량 출력(수백 턴) 대비: 이미 dict/list면 파싱 생략, 문자열이면 orjson 우선
+                if isinstance(out, (dict, list)):
+                    labeled_any = out
+                elif isinstance(out, str):
+                    try:
+                        labeled_any = _loads(out)
+                    except Exception:
+                        labeled_any = _loose_parse_json_any(out)
+                else:
+                    labeled_any = _loose_parse_json_any(out)
                 labeled_turns: Optional[List[Dict[str, Any]]] = None
                 hmm_obj: Any = None
 
                 if isinstance(labeled_any, dict):
-                    t = labeled_any.get("turns")
-                    if isinstance(t, list):
-                        labeled_turns = t
+                    labeled_turns = labeled_any.get("turns")
+                    if not isinstance(labeled_turns, list):
+                        labeled_turns = None
                     hmm_obj = (
                         labeled_any.get("hmm")
                         or labeled_any.get("hmm_result")
@@ -1036,9 +1786,9 @@ def _wrap_tool_force_json_input(original_tool, *, require_data_wrapper: bool = T
                         "note": "label_victim_emotions returned list; hmm may be embedded per victim turn",
                     }
                 if run_no is not None and isinstance(labeled_turns, list) and labeled_turns:
-                    _EMO_CACHE[sid]["turns_by_round"][run_no] = labeled_turns
+                    emo_turns_by_round[run_no] = labeled_turns
                     if hmm_obj is not None:
-                        _EMO_CACHE[sid]["hmm_by_round"][run_no] = hmm_obj
+                        emo_hmm_by_round[run_no] = hmm_obj
         except Exception:
             pass
 
@@ -1048,24 +1798,68 @@ def _wrap_tool_force_json_input(original_tool, *, require_data_wrapper: bool = T
     _wrapped.description = getattr(original_tool, "description", "") or ""
     return _wrapped
 
-def _last_observation(cap: "ThoughtCapture", tool_name: str) -> Any:
+def _last_observation_event(cap: "ThoughtCapture", tool_name: str) -> Optional[Dict[str, Any]]:
+    # ✅ on_tool_end에서 갱신되는 도구별 최신 observation 인덱스 우선 (O(1))
+    if cap._last_obs_by_tool:
+        return cap._last_obs_by_tool.get(tool_name)
     for ev in reversed(cap.events):
         if ev.get("type") == "observation" and ev.get("tool") == tool_name:
-            return ev.get("output")
+            return ev
     return None
 
+def _last_observation(cap: "ThoughtCapture", tool_name: str) -> Any:
+    ev = _last_observation_event(cap, tool_name)
+    return ev.get("output") if ev else None
+
+def _event_parsed(ev: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    observation 이벤트의 output을 dict로 파싱한다.
+    - on_tool_end에서 미리 파싱해 둔 ev["_parsed"]가 dict면 그대로 재사용
+    - 아니면 _loose_parse_json 후 결과를 ev에 저장(다음 소비자는 O(1))
+    """
+    cached = ev.get("_parsed")
+    if isinstance(cached, dict):
+        return cached
+    parsed = _loose_parse_json(ev.get("output"))
+    if parsed and "_parsed" not in ev:
+        ev["_parsed"] = parsed
+    return parsed
+
+def _event_parsed_any(ev: Dict[str, Any]) -> Any:
+    """_event_parsed의 dict/list 겸용 버전 (label_victim_emotions처럼 list가 오는 경우)."""
+    if "_parsed" in ev:
+        return ev["_parsed"]
+    parsed = _loose_parse_json_any(ev.get("output"))
+    if isinstance(parsed, (dict, list)):
+        ev["_parsed"] = parsed
+    return parsed
+
+def _get_parsed_observation(cap: "ThoughtCapture", tool_name: str) -> Dict[str, Any]:
+    """가장 최근 tool_name Observation을 dict로 반환(캐시 우선). 없으면 {}."""
+    ev = _last_observation_event(cap, tool_name)
+    if not ev or not ev.get("output"):
+        return {}
+    return _event_parsed(ev)
+
 def _as_dict(x):
-    import copy
+    """
+    pydantic 모델은 model_dump(이미 새 객체), dict/list는 얕은 복사만 한다.
+    (호출부는 모두 읽기 전용이라 deepcopy 비용을 낼 필요가 없음)
+    """
     if hasattr(x, "model_dump"):
         return x.model_dump()
-    return copy.deepcopy(x)
+    if isinstance(x, dict):
+        return dict(x)
+    if isinstance(x, list):
+        return list(x)
+    return x
 
 def _normalize_guidance(g: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
     if not g:
         return None
     if isinstance(g, str):
         try:
-            g = json.loads(g)
+            g = _loads(g)
         except Exception:
             raise HTTPException(400, detail="guidance는 문자열이 아닌 객체(dict)여야 합니다.")
     g = dict(g)
@@ -1090,14 +1884,14 @@ def _clean_payload(
 
 def _make_action_input_for_mcp(payload: Dict[str, Any]) -> str:
     if EXPECT_MCP_DATA_WRAPPER:
-        return json.dumps({"data": payload}, ensure_ascii=False)
+        return _dumps({"data": payload})
     else:
-        return json.dumps(payload, ensure_ascii=False)
+        return _dumps(payload)
 
 def _looks_like_missing_top_fields_error(err_obj: Dict[str, Any]) -> bool:
     try:
         pes = err_obj.get("pydantic_errors") or []
-        text = json.dumps(err_obj, ensure_ascii=False)
+        text = _dumps(err_obj)
         has_data_literal = '"data":' in text or "'data':" in text
         miss_top = any(
             e.get("type") == "missing"
@@ -1109,14 +1903,55 @@ def _looks_like_missing_top_fields_error(err_obj: Dict[str, Any]) -> bool:
     except Exception:
         return False
 
+def _tool_index(executor: AgentExecutor) -> Dict[str, Any]:
+    """executor.tools의 name -> tool 인덱스. 최초 1회 만들어 executor에 붙여둔다."""
+    idx = getattr(executor, "_tool_by_name", None)
+    if idx is None:
+        idx = {t.name: t for t in executor.tools}
+        # AgentExecutor는 pydantic 모델이라 일반 setattr은 막혀 있음
+        with contextlib.suppress(Exception):
+            object.__setattr__(executor, "_tool_by_name", idx)
+    return idx
+
 def _get_tool(executor: AgentExecutor, name: str):
-    for t in executor.tools:
-        if t.name == name:
-            return t
-    return None
+    return _tool_index(executor).get(name)
 
 from app.db import models as m
 
+# 라운드마다 실행되는 문장은 모듈에서 한 번만 만들어 재사용 (컴파일 캐시 키가 매번 같도록 :cid/:run 바인드)
+# 라벨링 덮어쓰기: 행을 SELECT로 들고 오지 않고 turns만 바로 UPDATE (행 유무는 rowcount로 판단)
+_UPD_ROUND_TURNS = (
+    update(m.ConversationRound)
+    .where(
+        m.ConversationRound.case_id == bindparam("cid"),
+        m.ConversationRound.run == bindparam("run"),
+    )
+    .values(turns=bindparam("turns"))
+    .execution_options(synchronize_session=False)
+)
+# 라운드 턴 수가 줄었을 때 남는 꼬리 턴만 지운다 (upsert 뒤 실행)
+_DEL_ROUND_LOGS_TAIL = (
+    delete(m.ConversationLog)
+    .where(
+        m.ConversationLog.case_id == bindparam("cid"),
+        m.ConversationLog.run == bindparam("run"),
+        m.ConversationLog.turn_index > bindparam("max_idx"),
+    )
+    .execution_options(synchronize_session=False)
+)
+# (case_id, run, turn_index) 유니크(uq_case_run_turn) 기준 upsert: 기존 행은 id/created_at 유지한 채 내용만 갱신
+_UPSERT_LOG = pg_insert(m.ConversationLog)
+_UPSERT_LOG = _UPSERT_LOG.on_conflict_do_update(
+    index_elements=["case_id", "run", "turn_index"],
+    set_={
+        col: getattr(_UPSERT_LOG.excluded, col)
+        for col in (
+            "offender_id", "victim_id", "role", "content", "label",
+            "payload", "use_agent", "guidance_type", "guideline",
+        )
+    },
+)
+
 def _ensure_admincase(db: Session, case_id: str, scenario_json: Dict[str, Any]) -> None:
     try:
         case = db.get(m.AdminCase, case_id)
@@ -1141,70 +1976,212 @@ def _ensure_admincase(db: Session, case_id: str, scenario_json: Dict[str, Any])
     except Exception as e:
         logger.warning(f"[AdminCase upsert] failed: {e}")
 
+def _upsert_conversation_logs(
+    db: Session,
+    case_id: Any,
+    offender_id: int,
+    victim_id: int,
+    run: int,
+    turns: List[Dict[str, Any]],
+) -> None:
+    """
+    라운드 turns로 conversationlog를 덮어쓴다. (commit은 호출부에서)
+    - turns는 role(_norm_role 결과)/text(str)가 이미 정규화된 턴이어야 한다 (행 생성 시 재가공 안 함)
+    - executemany upsert 한 번 + 턴 수가 줄었을 때만 의미 있는 꼬리 DELETE (DELETE 후 전체 재INSERT 안 함)
+    - ORM 객체/identity map을 거치지 않음. 신규 행의 id/created_at 기본값은 Core가 채움
+    """
+    if turns:
+        rows = [
+            {
+                "case_id": case_id,
+                "offender_id": offender_id,
+                "victim_id": victim_id,
+                "turn_index": idx,
+                "role": turn["role"],
+                "content": turn["text"],
+                "label": None,
+                "payload": turn,
+                "use_agent": True,
+                "run": run,
+                "guidance_type": None,
+                "guideline": None,
+            }
+            for idx, turn in enumerate(turns, start=1)
+        ]
+        db.execute(_UPSERT_LOG, rows)
+    db.execute(_DEL_ROUND_LOGS_TAIL, {"cid": case_id, "run": run, "max_idx": len(turns)})
+
+class _DbWriteWorker:
+    """
+    라운드 DB 쓰기(conversation_round/conversationlog)를 전용 스레드 + 전용 세션에서 순서대로 실행.
+    - 결과 추출 루프는 메모리 갱신 + SSE만 하고, commit 대기(fsync)는 여기서 흡수
+    - 작업은 FIFO라 simulator_run 저장 → 라벨링 덮어쓰기 순서가 유지됨
+    """
+    _STOP = object()
+
+    def __init__(self, bind: Any):
+        self._bind = bind
+        self._q: "queue.Queue[Any]" = queue.Queue()
+        self._thread: Optional[Thread] = None
+        self._closed = False
+
+    def submit(self, label: str, fn: Callable[[Session], None]) -> None:
+        if self._thread is None:
+            # threading.Thread는 contextvars를 물려주지 않는다 → 제출한 쪽 컨텍스트(_current_stream_id)에서 실행해
+            #    writer 스레드의 경고 로그도 해당 run의 SSE로 가게 한다.
+            ctx = contextvars.copy_context()
+            self._thread = Thread(target=ctx.run, args=(self._run,), name="vp-db-writer", daemon=True)
+            self._thread.start()
+        self._q.put((label, fn))
+
+    def _run(self) -> None:
+        session = SessionLocal(bind=self._bind)
+        try:
+            while True:
+                item = self._q.get()
+                if item is self._STOP:
+                    return
+                label, fn = item
+                try:
+                    fn(session)
+                    session.commit()
+                except Exception as e:
+                    with contextlib.suppress(Exception):
+                        session.rollback()
+                    logger.warning("[DB] %s 실패: %s", label, e)
+        finally:
+            session.close()
+
+    def join(self, timeout: float = 30.0) -> bool:
+        """남은 작업을 모두 처리하고 스레드를 종료. 여러 번 호출해도 안전."""
+        if self._thread is None or self._closed:
+            return True
+        self._closed = True
+        self._q.put(self._STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning("[DB] writer join timeout(%.1fs): 남은 작업=%d", timeout, self._q.qsize())
+            return False
+        return True
+
 # ─────────────────────────────────────────────────────────
 # LangChain 콜백
 # ─────────────────────────────────────────────────────────
 @dataclass
 class ThoughtCapture(BaseCallbackHandler):
+    # 가벼운 동기 핸들러라 ainvoke에서도 executor로 넘기지 않고 루프에서 바로 실행
+    run_inline = True
+
     last_tool: Optional[str] = None
     last_tool_input: Optional[Any] = None
     events: list = field(default_factory=list)
+    # (len(events), 도구 호출 순서, Counter) — _tool_calls_with_counts 전용 캐시
+    _seq_cache: Optional[Tuple[int, List[str], Counter]] = field(default=None, repr=False)
+    # tool name -> 가장 최근 observation 이벤트 (_last_observation_event 전용 인덱스)
+    _last_obs_by_tool: Dict[str, Dict[str, Any]] = field(default_factory=dict, repr=False)
 
     def on_agent_action(self, action, **kwargs):
-        rec = {
-            "type": "action",
-            "tool": getattr(action, "tool", "?"),
-            "tool_input": getattr(action, "tool_input", None),
-        }
-        self.last_tool = rec["tool"]
-        self.last_tool_input = rec["tool_input"]
-        self.events.append(rec)
-        logger.info(
-            "[AgentThought] Tool=%s | Input=%s",
-            rec["tool"],
-            _truncate(rec["tool_input"]),
-        )
-        _emit_to_stream("agent_action", {"tool": rec["tool"], "input": rec["tool_input"]})
+        tool = getattr(action, "tool", "?")
+        tool_input = getattr(action, "tool_input", None)
+        self.last_tool = tool
+        self.last_tool_input = tool_input
+        self.events.append({"type": "action", "tool": tool, "tool_input": tool_input})
+        # SSE에는 아래 agent_action으로 나가므로 로그는 DEBUG (INFO면 root 탭이 같은 내용을 log로 한 번 더 보냄)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "[AgentThought] Tool=%s | Input=%s",
+                tool,
+                _truncate(tool_input),
+            )
+        _emit_to_stream("agent_action", {"tool": tool, "input": tool_input})
 
     def on_tool_end(self, output: Any, **kwargs):
-        self.events.append({
+        ev = {
             "type": "observation",
             "tool": self.last_tool,
             "output": output,
-        })
-        logger.info("[ToolObservation] Tool=%s | Output=%s", self.last_tool, _truncate(output, 1200))
+        }
+        # ✅ 같은 observation을 여러 소비자가 다시 파싱하지 않도록 미리 한 번만 파싱
+        if isinstance(output, (dict, list)):
+            ev["_parsed"] = output
+        elif isinstance(output, (bytes, bytearray)):
+            ev["output_len"] = len(output)
+        elif isinstance(output, str):
+            ev["output_len"] = len(output)
+            if output.lstrip()[:1] in ("{", "["):
+                try:
+                    ev["_parsed"] = _loads(output)
+                except Exception:
+                    # 엄격 파싱 실패(코드펜스/파이썬 리터럴 등)도 여기서 한 번에 끝낸다
+                    loose = _loose_parse_json_any(output)
+                    if isinstance(loose, (dict, list)) and loose:
+                        ev["_parsed"] = loose
+        self.events.append(ev)
+        self._last_obs_by_tool[self.last_tool] = ev
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[ToolObservation] Tool=%s | Output=%s", self.last_tool, _truncate(output, 1200))
         _emit_to_stream("tool_observation", {"tool": self.last_tool, "output": output})
+        parsed = ev.get("_parsed")
+        if isinstance(parsed, dict):
+            emit_structured(parsed)
 
     def on_agent_finish(self, finish, **kwargs):
         self.events.append({"type": "finish", "log": finish.log})
-        logger.info("[AgentFinish] %s", _truncate(finish.log, 1200))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[AgentFinish] %s", _truncate(finish.log, 1200))
         _emit_to_stream("agent_finish", {"log": getattr(finish, "log", "")})
 
-# ─────────────────────────────────────────────────────────
-# Smart Print
-# ─────────────────────────────────────────────────────────
-import builtins as _builtins
+class _SSEStreamCallback(BaseCallbackHandler):
+    """
+    LLM 토큰/도구 시작을 즉시 SSE로 흘려보낸다 (sse_on일 때만 등록).
+    - 케이스 종료까지 기다리지 않고 FE가 진행 상황을 바로 볼 수 있게 함
+    - agent_action/tool_observation은 ThoughtCapture가 이미 emit하므로 여기서는 다루지 않음
+    """
+    run_inline = True
 
-_ORIG_PRINT = _builtins.print
+    def on_llm_new_token(self, token: str, **kwargs):
+        if token:
+            _emit_to_stream("token", {"text": token})
 
-def _smart_print(*args, **kwargs):
-    _ORIG_PRINT(*args, **kwargs)
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs):
+        name = (serialized or {}).get("name") or "?"
+        _emit_to_stream("tool_start", {"tool": name, "input": _truncate(input_str, 1200)})
 
-    try:
-        if len(args) != 1:
-            return
-        obj = args[0]
+# ─────────────────────────────────────────────────────────
+# 구조화 이벤트 emit
+# - 예전에는 builtins.print를 전역 교체해 print된 dict를 잡았지만,
+#   이제 도구 observation(dict)을 ThoughtCapture.on_tool_end에서 직접 넘긴다.
+# ─────────────────────────────────────────────────────────
+# dict의 키 구성으로 SSE 태그를 판별 (앞에서부터 첫 매칭 우선)
+_TAG_RULES: Tuple[Tuple[str, frozenset], ...] = (
+    ("conversation_log", frozenset({"case_id", "turns", "stats"})),  # MCP 대화 결과
+    ("judgement", frozenset({"persisted", "phishing", "risk"})),
+    ("guidance", frozenset({"type", "text", "categories"})),
+    ("guidance", frozenset({"type", "text", "targets"})),
+    ("prevention", frozenset({"personalized_prevention"})),
+)
 
-        data = obj if isinstance(obj, dict) else _loose_parse_json(obj)
-        if not isinstance(data, dict) or not data:
-            return
+def emit_structured(data: Dict[str, Any]) -> Optional[str]:
+    """
+    구조화 결과(dict)를 키 구성으로 태깅해 SSE로 보낸다 (conversation_log면 TTS 캐시도 저장).
+    반환: 매칭된 태그 (없거나 구독 중인 stream이 없으면 None)
+    """
+    try:
+        if not data or not isinstance(data, dict):
+            return None
+        sid = _current_stream_id.get()
+        if not sid or sid not in _STREAMS:
+            return None
 
+        keys = data.keys()
         tag = None
+        for rule_tag, needed in _TAG_RULES:
+            if needed <= keys:
+                tag = rule_tag
+                break
 
         # ★★★ conversation_log 감지 (MCP 대화 결과)
-        if ("case_id" in data) and ("turns" in data) and ("stats" in data):
-            tag = "conversation_log"
-
+        if tag == "conversation_log":
             # ✅ 여기서 TTS 캐시 저장까지 같이 처리
             try:
                 case_id = str(data.get("case_id"))
@@ -1243,71 +2220,94 @@ def _smart_print(*args, **kwargs):
                         len(cleaned_turns),
                     )
             except Exception as e:
-                logger.error("[TTS_CACHE] _smart_print 캐시 저장 실패: %s", e)
-        
-        elif ("persisted" in data) and ("phishing" in data) and ("risk" in data):
-            tag = "judgement"
-        elif ("type" in data) and ("text" in data) and (("categories" in data) or ("targets" in data)):
-            tag = "guidance"
-        elif ("personalized_prevention" in data):
-            tag = "prevention"
+                logger.error("[TTS_CACHE] emit_structured 캐시 저장 실패: %s", e)
 
         if tag:
             safe = _truncate(data, 2000)
-            logger.info("[%s] %s", tag, json.dumps(safe, ensure_ascii=False))
-            _emit_to_stream(tag, safe)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[%s] %s", tag, _dumps(safe))
+            _emit_to_stream(tag, safe, truncated=True)
+        return tag
     except Exception:
-        pass
-
-def _patch_print():
-    if getattr(_builtins, "_smart_print_patched", False):
-        return
-    _builtins.print = _smart_print
-    setattr(_builtins, "_smart_print_patched", True)
-
-def _unpatch_print():
-    if getattr(_builtins, "_smart_print_patched", False):
-        _builtins.print = _ORIG_PRINT
-        try:
-            delattr(_builtins, "_smart_print_patched")
-        except Exception:
-            pass
+        return None
 
 # ─────────────────────────────────────────────────────────
 # 도구 호출 순서 추출 및 검증 헬퍼
 # ─────────────────────────────────────────────────────────
-def _extract_tool_call_sequence(cap: ThoughtCapture, tool_filter: Optional[List[str]] = None) -> List[str]:
-    """ThoughtCapture에서 실제 호출된 도구 순서를 추출"""
-    tools = []
+def _tool_calls_with_counts(cap: ThoughtCapture) -> Tuple[List[str], Counter]:
+    """
+    cap.events를 한 번만 순회해 (도구 호출 순서, 도구별 호출 횟수)를 만든다.
+    같은 턴에서 여러 번 불려도 이벤트 수가 그대로면 캐시된 결과를 재사용.
+    """
+    n = len(cap.events)
+    cached = cap._seq_cache
+    if cached is not None and cached[0] == n:
+        return cached[1], cached[2]
+    tools: List[str] = []
+    counts: Counter = Counter()
     for ev in cap.events:
         if ev.get("type") == "action":
             tool_name = ev.get("tool")
-            if tool_filter is None or tool_name in tool_filter:
-                tools.append(tool_name)
+            tools.append(tool_name)
+            counts[tool_name] += 1
+    cap._seq_cache = (n, tools, counts)
+    return tools, counts
+
+def _bucket_events(
+    cap: ThoughtCapture,
+) -> Tuple[Dict[Tuple[Any, Any], List[Dict[str, Any]]], List[Dict[str, Any]]]:
+    """
+    cap.events를 한 번만 순회해
+    - (type, tool) -> 이벤트 목록 (발생 순서 유지)
+    - observation 이벤트만 발생 순서대로 모은 목록
+    을 만든다. 결과 추출 단계에서 도구별로 cap.events를 반복 스캔하지 않기 위함.
+    """
+    by_key: Dict[Tuple[Any, Any], List[Dict[str, Any]]] = defaultdict(list)
+    observations: List[Dict[str, Any]] = []
+    for ev in cap.events:
+        ev_type = ev.get("type")
+        by_key[(ev_type, ev.get("tool"))].append(ev)
+        if ev_type == "observation":
+            observations.append(ev)
+    return by_key, observations
+
+def _extract_tool_call_sequence(
+    cap: ThoughtCapture,
+    tool_filter: Optional[List[str]] = None,
+    *,
+    collect_counts: bool = False,
+):
+    """
+    ThoughtCapture에서 실제 호출된 도구 순서를 추출
+    - collect_counts=True면 (순서, Counter) 튜플을 반환
+    """
+    tools, counts = _tool_calls_with_counts(cap)
+    if tool_filter is not None:
+        tools = [t for t in tools if t in tool_filter]
+        counts = Counter({k: v for k, v in counts.items() if k in tool_filter})
+    else:
+        tools = list(tools)
+    if collect_counts:
+        return tools, counts
     return tools
 
 def _validate_tool_sequence(actual: List[str], expected: List[str]) -> bool:
     """실제 도구 호출 순서가 기대 순서와 일치하는지 검증 (retry 중복 허용)"""
-    actual_unique = []
-    for tool in actual:
-        base_tool = tool.split("(")[0] if "(" in tool else tool
-        if not actual_unique or actual_unique[-1] != base_tool:
-            actual_unique.append(base_tool)
-    
+    base = (t.partition("(")[0] for t in actual)
+    actual_unique = [k for k, _ in groupby(base)]
     return actual_unique == expected
 
 def _extract_case_id_from_agent_output(result: Any, cap: ThoughtCapture) -> Optional[str]:
     """에이전트 출력 또는 mcp.simulator_run Observation에서 case_id 추출"""
     try:
         output_text = str(result.get("output", ""))
-        match = re.search(r"CASE_ID:\s*([a-f0-9\-]+)", output_text, re.I)
+        match = _CASE_ID_RE.search(output_text)
         if match:
             return match.group(1)
     except:
         pass
     
-    sim_obs = _last_observation(cap, "mcp.simulator_run")
-    sim_dict = _loose_parse_json(sim_obs)
+    sim_dict = _get_parsed_observation(cap, "mcp.simulator_run")
     case_id = sim_dict.get("case_id")
     if case_id:
         return str(case_id)
@@ -1316,9 +2316,6 @@ def _extract_case_id_from_agent_output(result: Any, cap: ThoughtCapture) -> Opti
 
 def _wrap_sim_compose_prompts(original_tool):
     """sim.compose_prompts를 래핑하여 프롬프트를 캐시하고 ID만 반환"""
-    from langchain_core.tools import tool
-    from typing import Any
-
     @tool
     def sim_compose_prompts_cached(data: Any) -> dict:
         """프롬프트 생성 후 캐시에 저장하고 prompt_id만 반환"""
@@ -1400,7 +2397,7 @@ def _wrap_sim_compose_prompts(original_tool):
         # 6) 원본 도구 호출
         try:
             logger.info(f"[PromptCache] 원본 도구 호출 시작 - payload keys: {list(payload.keys())}")
-            result = original_tool.invoke(payload)
+            result = _memo_invoke(original_tool, "sim.compose_prompts", payload)
             logger.info(f"[PromptCache] 원본 도구 호출 성공")
         except Exception as e:
             logger.error(f"[sim.compose_prompts] 원본 도구 호출 실패: {e}")
@@ -1412,7 +2409,7 @@ def _wrap_sim_compose_prompts(original_tool):
         # 7) 결과 파싱
         if isinstance(result, str):
             try:
-                result = json.loads(result)
+                result = _loads(result)
             except Exception:
                 result = _loose_parse_json(result)
 
@@ -1428,7 +2425,7 @@ def _wrap_sim_compose_prompts(original_tool):
 
         # 8) 캐시 저장
         # ✅ stream_id 스코프를 키에 포함 (동시 실행/다중 케이스에서 캐시 충돌/정리 오염 방지)
-        sid = _current_stream_id.get() or "no_stream"
+        sid = _get_sid()
         prompt_id = f"{sid}:r{round_no}:{uuid.uuid4().hex}"
 
         _PROMPT_CACHE[prompt_id] = {
@@ -1463,9 +2460,6 @@ def _wrap_sim_compose_prompts(original_tool):
 
 def _wrap_mcp_simulator_run(original_tool):
     """mcp.simulator_run을 래핑하여 prompt_id로 캐시된 프롬프트 사용"""
-    from langchain_core.tools import tool
-    from typing import Any
-
     @tool
     def mcp_simulator_run_cached(data: Any) -> dict:
         """시뮬레이션 실행 (캐시된 프롬프트 사용)"""
@@ -1503,7 +2497,7 @@ def _wrap_mcp_simulator_run(original_tool):
                 "error": f"프롬프트 {prompt_id}를 캐시에서 찾을 수 없습니다. sim.compose_prompts를 먼저 호출하세요.",
             }
 
-        cache_entry = _PROMPT_CACHE[prompt_id]
+        cache_entry = _PROMPT_CACHE[prompt_id]  # 조회 시 LRU 최신으로 갱신됨
         # ✅ v2 우선 (구버전 캐시 키 fallback)
         attacker_prompt_v2 = (
             cache_entry.get("attacker_prompt_v2")
@@ -1559,27 +2553,19 @@ def _wrap_mcp_simulator_run(original_tool):
 
 def _extract_last_judgement(cap: ThoughtCapture) -> Dict[str, Any]:
     """가장 최근 admin.make_judgement Observation에서 판정 추출"""
-    judge_obs = _last_observation(cap, "admin.make_judgement")
-    if not judge_obs:
-        return {}
-    
-    judgement = _loose_parse_json(judge_obs)
+    judgement = _get_parsed_observation(cap, "admin.make_judgement")
     return judgement if isinstance(judgement, dict) else {}
 
 def _extract_prevention_from_last_observation(cap: ThoughtCapture) -> Dict[str, Any]:
     """admin.make_prevention Observation에서 예방책 추출"""
-    prev_obs = _last_observation(cap, "admin.make_prevention")
-    if not prev_obs:
-        return {}
-    
-    prev_dict = _loose_parse_json(prev_obs)
+    prev_dict = _get_parsed_observation(cap, "admin.make_prevention")
     if prev_dict.get("ok"):
         return prev_dict.get("personalized_prevention", {})
     return {}
 
 def _validate_complete_execution(cap: ThoughtCapture, rounds_done: int, *, inject_emotion: bool = True) -> dict:
     """실행 완료 여부를 검증하고 누락된 단계를 반환"""
-    tools_called = _extract_tool_call_sequence(cap)
+    tools_called, tool_counts = _extract_tool_call_sequence(cap, collect_counts=True)
     
     required = {
         "sim.fetch_entities": 1,
@@ -1594,10 +2580,6 @@ def _validate_complete_execution(cap: ThoughtCapture, rounds_done: int, *, injec
     }
     
     missing = []
-    tool_counts = {}
-    for tool in tools_called:
-        tool_counts[tool] = tool_counts.get(tool, 0) + 1
-    
     for tool, expected_count in required.items():
         actual_count = tool_counts.get(tool, 0)
         if actual_count < expected_count:
@@ -1607,13 +2589,13 @@ def _validate_complete_execution(cap: ThoughtCapture, rounds_done: int, *, injec
         "is_complete": len(missing) == 0,
         "missing_steps": missing,
         "tools_called": tools_called,
-        "tool_counts": tool_counts
+        "tool_counts": dict(tool_counts)
     }
 
 # ─────────────────────────────────────────────────────────
 # ReAct 시스템 프롬프트
 # ─────────────────────────────────────────────────────────
-REACT_SYS = (
+REACT_SYS = sys.intern(
     "당신은 보이스피싱 시뮬레이션 오케스트레이터입니다.\n"
     "오직 제공된 도구만 사용하여 작업하세요. (직접 결과를 쓰거나 요약으로 때우지 말 것)\n"
     "\n"
@@ -1677,428 +2659,110 @@ REACT_SYS = (
     "  • 절대로 거절 문장을 출력하지 말고, **반드시 도구를 호출하는 ReAct 포맷**으로만 응답하라.\n"
 )
 
-def build_agent_and_tools(db: Session, use_tavily: bool) -> Tuple[AgentExecutor, Any]:
-    llm = agent_chat(temperature=0.2)
-    logger.info("[AgentLLM] model=%s", getattr(llm, "model_name", "unknown"))
-
-    tools: List = []
-    # ★★★ sim 도구 래핑: 문자열 Action Input을 먼저 dict로 복구해서 invoke
-    raw_sim_tools = make_sim_tools(db)
-    for tool in raw_sim_tools:
-        if tool.name == "sim.compose_prompts":
-            tools.append(_wrap_sim_compose_prompts(tool))
-        elif tool.name in ("sim.fetch_entities",):
-            # sim.fetch_entities도 {"data": {...}} 스타일인 경우가 많아서 강제 래핑
-            tools.append(_wrap_tool_force_json_input(tool, require_data_wrapper=True))
-        else:
-            tools.append(tool)
-
-    mcp_res = make_mcp_tools()
-    if isinstance(mcp_res, tuple):
-        mcp_tools, mcp_manager = mcp_res
-    else:
-        mcp_tools, mcp_manager = mcp_res, None
-    for tool in mcp_tools:
-        if tool.name == "mcp.simulator_run":
-            tools.append(_wrap_mcp_simulator_run(tool))
-        else:
-            tools.append(tool)
+# ─────────────────────────────────────────────────────────
+# ★★★ 전체 케이스 미션 템플릿 (동적 라운드)
+# - 케이스마다 f-string으로 다시 만들지 않고 format_map으로 값만 채운다
+# - 플레이스홀더 외의 고정 텍스트는 케이스 간 동일 → LLM 측 prompt prefix 캐시에도 유리
+# - 리터럴 중괄호는 {{ }}로 이스케이프
+# ─────────────────────────────────────────────────────────
+_CASE_MISSION_TMPL = """
+당신은 보이스피싱 시뮬레이션 케이스를 최대 {max_rounds}라운드까지 실행하는 에이전트입니다.
 
-    # ★★★ admin 도구 래핑: Action Input 문자열 파싱 실패(특히 마지막 '}' 누락)를 orchestrator에서 크게 줄임
-    raw_admin_tools = make_admin_tools(db, GuidelineRepoDB(db))
-    for tool in raw_admin_tools:
-        if tool.name.startswith("admin."):
-            # admin.*는 모두 SingleData 스타일({"data": {...}})로 강제
-            tools.append(_wrap_tool_force_json_input(tool, require_data_wrapper=True))
-        else:
-            tools.append(tool)
-    # ✅ Emotion tool 등록
-    # - ReAct가 Action Input을 문자열로 망가뜨리는 경우가 있어서, orchestrator에서 먼저 dict로 복구 후 invoke하도록 래핑
-    # - label_victim_emotions는 {"turns": [...], "run_hmm": true, ...} 형태(상위 "data" 래핑 불필요)
-    emotion_tool = label_victim_emotions
-    try:
-        # tool name 고정: 이벤트 처리/validation에서 "label_victim_emotions"로 찾기 때문에 불일치 방지
-        if getattr(emotion_tool, "name", None) != "label_victim_emotions":
-            setattr(emotion_tool, "name", "label_victim_emotions")
-    except Exception:
-        pass
-    tools.append(_wrap_tool_force_json_input(emotion_tool, require_data_wrapper=False))
-    if use_tavily:
-        tools += make_tavily_tools()
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+【중요: 최대 라운드 = {max_rounds}】
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+★ 이 케이스는 정확히 {max_rounds}라운드까지만 실행합니다.
+★ 라운드 {max_rounds} 판정 완료 후 → 즉시 단계 10(예방책 생성)으로 이동
+★ 라운드 {max_rounds_next}은 절대 실행 금지
 
-    logger.info("[Agent] TOOLS REGISTERED: %s", [t.name for t in tools])
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+【실행 단계】
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
-    prompt = ChatPromptTemplate.from_messages(
-        [
-            ("system", REACT_SYS),
-            (
-                "human",
-                "사용 가능한 도구들:\n{tools}\n\n"
-                "도구 이름 목록: {tool_names}\n\n"
-                "아래 포맷을 정확히 따르세요. 포맷 외 임의 텍스트/코드펜스/주석 금지.\n"
-                "Thought: 한 줄\n"
-                "Action: 도구이름  (예: mcp.simulator_run)\n"
-                "Action Input: (툴별 규칙)\n"
-                "Observation: (도구 출력)\n"
-                "... 반복 ...\n"
-                "Final Answer: 결론\n\n"
-                "입력:\n{input}\n\n"
-                "{agent_scratchpad}",
-            ),
-        ]
-    )
+단계 1: 엔티티 가져오기
+- 도구: sim.fetch_entities
+- 입력: {{"data": {{"offender_id": {offender_id}, "victim_id": {victim_id}}}}}
+- 저장: scenario, victim_profile
 
-    agent = create_react_agent(llm=llm, tools=tools, prompt=prompt)
-    ex = AgentExecutor(
-        agent=agent, 
-        tools=tools, 
-        verbose=True,
-        handle_parsing_errors=_parsing_error_handler,
-        max_iterations=50,  # ★ 전체 케이스 단일 호출이므로 충분한 iteration 확보
-        return_intermediate_steps=True,  # ✅ 도구 호출/observation을 결과로 강제 반환
-    )
-    return ex, mcp_manager
+단계 2: 프롬프트 생성 (라운드1)
+- 도구: sim.compose_prompts
+- 입력: {{"data": {{"scenario": <1단계 scenario>, "victim_profile": <1단계 victim_profile>, "round_no": 1}}}}
+- 주의: guidance 필드 포함 금지
+- 결과: prompt_id를 받아서 PROMPT_ID_R1 변수에 저장
 
-# ─────────────────────────────────────────────────────────
-# ★★★ 메인 오케스트레이션 (단일 에이전트 호출 방식)
-# ─────────────────────────────────────────────────────────
-def run_orchestrated(db: Session, payload: Dict[str, Any], _stop: Optional[ThreadEvent] = None) -> Dict[str, Any]:
-    stream_id = str(payload.get("stream_id") or uuid.uuid4())
+단계 3: 시뮬레이션 실행 (라운드1)
+- 도구: mcp.simulator_run
+- 입력: {{"offender_id": {offender_id}, "victim_id": {victim_id}, "scenario": <1단계 scenario>, "prompt_id": PROMPT_ID_R1, "max_turns": {max_turns}, "round_no": 1}}
+- 저장: case_id (CASE_ID 변수), turns
 
-    run_key = _make_run_key(payload)
-    if run_key in _ACTIVE_RUN_KEYS:
-        raise HTTPException(status_code=409, detail="duplicated simulation run detected")
-    _ACTIVE_RUN_KEYS.add(run_key)
+단계 3-1: 감정 라벨링 (라운드1)
+- (inject_emotion==True일 때만 수행)
+- 도구: label_victim_emotions
+- 입력: {{"run_no": 1, "turns": <3단계 turns>, "run_hmm": true, "hmm_attach": "per_victim_turn"{emotion_pair_mode_suffix}{debug_input_suffix}}}
+- 주의:
+  * (요청에서 emotion_pair_mode를 준 경우에만 pair_mode가 포함됩니다)
+  * pair_mode를 생략하면 tools_emotion이 환경변수 EMOTION_PAIR_MODE 또는 내부 기본값을 사용합니다.
+- 저장(매우 중요):
+    * EMO_R1 = label_victim_emotions Observation 원문 전체(그대로 보관)
+    * TURNS_R1_LABELED =
+        - EMO_R1이 list이면 EMO_R1 자체
+        - EMO_R1이 dict이면 EMO_R1.turns
+    * HMM_R1 =
+        - EMO_R1이 dict이면 EMO_R1.hmm 또는 EMO_R1.hmm_result 또는 EMO_R1.hmm_summary (있는 것)
+        - EMO_R1이 list이면 null (턴에 이미 hmm이 붙어있다고 가정)
 
-    token = _current_stream_id.set(stream_id)
-    # ✅ CLI/배치에서는 SSE를 끈다 (running loop 문제 방지)
-    sse_on = _sse_enabled(payload)
-    if sse_on:
-        _attach_global_sse_logging_handlers()
-        _ensure_console_stream_handler()
-        _patch_print()
-        tee_out = TeeTerminal(stream_id, "stdout")
-        tee_err = TeeTerminal(stream_id, "stderr")
-        _emit_to_stream("run_start", {"stream_id": stream_id, "payload_hint": _truncate(payload, 400)})
-    else:
-        tee_out = None
-        tee_err = None
+단계 4: 판정 (라운드1)
+- 도구: admin.make_judgement
+- 입력(중요):
+    - inject_emotion==True: {{"data": {{"case_id": <3단계 case_id>, "run_no": 1, "turns": TURNS_R1_LABELED, "hmm": HMM_R1}}}}
+    - inject_emotion==False: {{"data": {{"case_id": <3단계 case_id>, "run_no": 1, "turns": <3단계 turns>, "hmm": {{"available": false, "reason": "emotion_disabled", "run_no": 1}}}}}}
+- 저장: 판정 결과 (JUDGEMENT_R1)
 
-    req = None
-    ex = None
-    mcp_manager = None
-    _emitted_run_end = False
-    case_id = None  # ✅ finally에서 안전하게 참조하기 위해 선할당
+단계 4-1: 라운드1 종료 조건 체크
+  [A] risk.level == "critical"인가?
+      → YES: 즉시 단계 10으로 이동
+      → NO: 단계 4-2로
+      
+  [B] 현재 라운드 == {max_rounds}인가? (1 == {max_rounds}?)
+      → YES: 즉시 단계 10으로 이동
+      → NO: 단계 5로
 
-    try:
-        if _stop and _stop.is_set():
-            return {"status": "cancelled"}
-            
-        if sse_on:
-            ctx = contextlib.ExitStack()
-            ctx.enter_context(contextlib.redirect_stdout(tee_out))
-            ctx.enter_context(contextlib.redirect_stderr(tee_err))
-        else:
-            ctx = contextlib.nullcontext()
-        with ctx:
-            req = SimulationStartRequest(**payload)
-            ex, mcp_manager = build_agent_and_tools(db, use_tavily=req.use_tavily)
-            # ✅ 감정 주입 ON/OFF (기본 ON)
-            # - payload.inject_emotion=false면 label_victim_emotions 단계를 "미션에서" 생략하도록 유도
-            inject_emotion = payload.get("inject_emotion")
-            if inject_emotion is None:
-                inject_emotion = True
-            inject_emotion = bool(inject_emotion)
-            logger.info("[EmotionInject] inject_emotion=%s", inject_emotion)
-            # 프롬프트 패키지 (DB 조립)
-            pkg = build_prompt_package_from_payload(
-                db, req, tavily_result=None, is_first_run=True, skip_catalog_write=True
-            )
-            scenario = pkg["scenario"]
-            victim_profile = pkg["victim_profile"]
-            templates = pkg["templates"]
+단계 5: 가이던스 생성 (라운드2용)
+- 도구: admin.generate_guidance
+- 입력: {{"data": {{"case_id": CASE_ID, "run_no": 1, "scenario": <1단계 scenario>, "victim_profile": <1단계 victim_profile>}}}}
+- 저장: GUIDANCE_R2
 
-            logger.info("[InitialInput] %s", json.dumps(_truncate(payload), ensure_ascii=False))
-            logger.info("[ComposedPromptPackage] %s", json.dumps(_truncate(pkg), ensure_ascii=False))
+▶ 라운드 N 반복 (N=2~{max_rounds})
 
-            offender_id = int(req.offender_id or 0)
-            victim_id = int(req.victim_id or 0)
+단계 6: 프롬프트 생성 (라운드N)
+- 도구: sim.compose_prompts
+- 입력: {{"data": {{"scenario": <1단계 scenario>, "victim_profile": <1단계 victim_profile>, "round_no": N, "guidance": GUIDANCE_R{{N}}}}}}
+- 결과: PROMPT_ID_R{{N}} 저장
 
-            # ─────────────────────────────────────
-            # 피해자/공격자 성별 정보 정리 (TTS용)
-            # ─────────────────────────────────────
-            def _normalize_gender_str(g: Optional[str]) -> Optional[str]:
-                if not g:
-                    return None
-                s = str(g).strip().lower()
-                if s in ("남", "남자", "male", "m"):
-                    return "male"
-                if s in ("여", "여자", "female", "f"):
-                    return "female"
-                return None
+단계 7: 시뮬레이션 실행 (라운드N)
+- 도구: mcp.simulator_run
+- 입력: {{"offender_id": {offender_id}, "victim_id": {victim_id}, "scenario": <1단계 scenario>, "prompt_id": PROMPT_ID_R{{N}}, "max_turns": {max_turns}, "round_no": N, "case_id_override": CASE_ID, "guidance": {{"type": "A", "text": GUIDANCE_R{{N}}.text}}}}
+- 저장: turns
 
-            victim_profile_base = _as_dict(victim_profile)
-            victim_meta = victim_profile_base.get("meta", {}) if isinstance(victim_profile_base, dict) else {}
+단계 7-1: 감정 라벨링 (라운드N)
+- 도구: label_victim_emotions
+- 입력: {{"run_no": N, "turns": <7단계 turns>, "run_hmm": true, "hmm_attach": "per_victim_turn"{emotion_pair_mode_suffix}{debug_input_suffix}}}
+- 주의:
+  * (요청에서 emotion_pair_mode를 준 경우에만 pair_mode가 포함됩니다)
+  * pair_mode를 생략하면 tools_emotion이 환경변수 EMOTION_PAIR_MODE 또는 내부 기본값을 사용합니다.
+- 저장(매우 중요):
+    * EMO_R{{N}} = label_victim_emotions Observation 원문 전체
+    * TURNS_R{{N}}_LABELED =
+        - EMO_R{{N}}이 list이면 EMO_R{{N}} 자체
+        - EMO_R{{N}}이 dict이면 EMO_R{{N}}.turns
+    * HMM_R{{N}} =
+        - EMO_R{{N}}이 dict이면 EMO_R{{N}}.hmm 또는 EMO_R{{N}}.hmm_result 또는 EMO_R{{N}}.hmm_summary (있는 것)
+        - EMO_R{{N}}이 list이면 null
 
-            # 1순위: 요청 payload에 담긴 victim_gender / offender_gender (FE에서 보내는 값)
-            victim_gender_req = _normalize_gender_str(getattr(req, "victim_gender", None))
-            offender_gender_req = _normalize_gender_str(getattr(req, "offender_gender", None))
-
-            # 2순위: DB victim_profile.meta.gender
-            victim_gender_db = _normalize_gender_str(victim_meta.get("gender"))
-
-            victim_gender = victim_gender_req or victim_gender_db or "female"
-            offender_gender = offender_gender_req or "male"
-
-            # (선택) 나이 → age_group으로 변환 (TTS에서 쓰고 있다면)
-            def _age_to_group(age: Optional[int]) -> Optional[str]:
-                try:
-                    a = int(age)
-                except Exception:
-                    return None
-                if a < 30:
-                    return "20s"
-                if a < 40:
-                    return "30s"
-                if a < 50:
-                    return "40s"
-                if a < 60:
-                    return "50s"
-                if a < 70:
-                    return "60s"
-                return "70s+"
-
-            victim_age_group = _age_to_group(victim_meta.get("age"))
-
-            # 라운드 정책
-            try:
-                requested_rounds = int(getattr(req, "round_limit", MAX_ROUNDS_DEFAULT) or MAX_ROUNDS_DEFAULT)
-            except Exception:
-                requested_rounds = MAX_ROUNDS_DEFAULT
-
-            requested_rounds = max(MIN_ROUNDS, requested_rounds)
-            max_rounds = min(requested_rounds, MAX_ROUNDS_UI_LIMIT)
-
-            scenario_base = _as_dict(scenario)
-            victim_profile_base = _as_dict(victim_profile)
-            templates_base = _as_dict(templates)
-
-            # ─────────────────────────────────────
-            # ✅ Emotion pair_mode 결정 로직 (victim_only 지원 포함)
-            # 우선순위:
-            #  1) 요청(req/payload)에 명시된 pair_mode(또는 emotion_pair_mode)
-            #  2) 환경변수 EMOTION_PAIR_MODE
-            #  3) tools_emotion 내부 기본값
-            #
-            # ※ FE/배치에서 필드명을 pair_mode로 보내는 경우가 많아서 둘 다 지원한다.
-            # ※ env가 설정된 경우, tools_emotion이 env를 안 읽는 환경에서도 동작하도록
-            #    orchestrator가 pair_mode를 "명시적으로" 주입한다.
-            def _env_emotion_pair_mode() -> Optional[str]:
-                try:
-                    v = (os.getenv("EMOTION_PAIR_MODE") or "").strip()
-                    return v or None
-                except Exception:
-                    return None
-
-            def _normalize_emotion_pair_mode(v: Optional[str]) -> Optional[str]:
-                """
-                pair_mode 표준화:
-                - tools_emotion.PairMode 허용값으로만 정규화
-                """
-                if v is None:
-                    return None
-                s = str(v).strip()
-                if not s:
-                    return None
-                s_low = s.lower().strip()
-
-                # 별칭 정규화
-                alias = {
-                    # victim only => tools_emotion에서는 "none"으로 취급
-                    "victimonly": "none",
-                    "victim_only": "none",
-                    "victim-only": "none",
-                    "only_victim": "none",
-                    "victim": "none",
-
-                    # prev offender
-                    "prev": "prev_offender",
-                    "prev_offender": "prev_offender",
-                    "previous_offender": "prev_offender",
-                    "victim+prev": "prev_offender",
-                    "victim+prev_offender": "prev_offender",
-
-                    # prev victim
-                    "prev_victim": "prev_victim",
-                    "previous_victim": "prev_victim",
-                    "victim+prev_victim": "prev_victim",
-
-                    # thoughts
-                    "thought": "thoughts",
-                    "thoughts": "thoughts",
-                    "victim+thought": "thoughts",
-                    "victim+thoughts": "thoughts",
-
-                    # combos
-                    "prev_offender+thoughts": "prev_offender+thoughts",
-                    "prev_victim+thoughts": "prev_victim+thoughts",
-                    "none": "none",
-                }
-                return alias.get(s_low, None)
-
-            def _req_emotion_pair_mode() -> Optional[str]:
-                # SimulationStartRequest에 필드가 없을 수도 있으니 payload도 같이 본다.
-                # FE/배치 호환: pair_mode / emotion_pair_mode 둘 다 지원
-                try:
-                    v = getattr(req, "emotion_pair_mode", None)
-                    if v is not None:
-                        return _normalize_emotion_pair_mode(v)
-                except Exception:
-                    pass
-                try:
-                    v = getattr(req, "pair_mode", None)
-                    if v is not None:
-                        return _normalize_emotion_pair_mode(v)
-                except Exception:
-                    pass
-                try:
-                    v = payload.get("emotion_pair_mode")
-                    if v is not None:
-                        return _normalize_emotion_pair_mode(v)
-                except Exception:
-                    pass
-                try:
-                    v = payload.get("pair_mode")
-                    if v is not None:
-                        return _normalize_emotion_pair_mode(v)
-                except Exception:
-                    pass
-                return None
-
-            req_pair_mode = _req_emotion_pair_mode()                 # ex) "victim_only" / "prev_offender" / ...
-            env_pair_mode = _normalize_emotion_pair_mode(_env_emotion_pair_mode())  # ex) "prev_offender"
-            # ✅ 유효값이 뭔지 tool 쪽에서 더 엄격히 검증할 수도 있어서,
-            #    여기서는 "요청 > env > None" 순으로만 결정한다.
-            pair_mode_effective = req_pair_mode or env_pair_mode or None
-
-            if req_pair_mode:
-                logger.info("[EmotionPairMode] override(from_request)=%s", req_pair_mode)
-            elif env_pair_mode:
-                logger.info("[EmotionPairMode] using_env=%s (case_mission will INCLUDE pair_mode for safety)", env_pair_mode)
-            else:
-                logger.info("[EmotionPairMode] not set (tools default will apply; case_mission will OMIT pair_mode)")
-
-            # case_mission에 넣을 Action Input suffix (없으면 빈 문자열로 pair_mode 생략)
-            # ✅ 요청 또는 env에서 결정된 값이 있으면 명시적으로 넣는다.
-            emotion_pair_mode_suffix = f', "pair_mode": "{pair_mode_effective}"' if pair_mode_effective else ""
-
-            # ✅ 디버그 입력 플래그(원하면 payload로)
-            # - label_victim_emotions 입력(turns/pair_mode 등)을 서버 로그로 찍게 만들 때 사용
-            debug_input = payload.get("emotion_debug_input")
-            debug_input = 1 if str(debug_input).strip() in ("1", "true", "True") else 0
-            debug_input_suffix = f', "debug_input": {debug_input}' if debug_input else ""
-
-            # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-            # ★★★ 전체 케이스 미션 구성 (동적 라운드)
-            # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-            case_mission = f"""
-당신은 보이스피싱 시뮬레이션 케이스를 최대 {max_rounds}라운드까지 실행하는 에이전트입니다.
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-【중요: 최대 라운드 = {max_rounds}】
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-★ 이 케이스는 정확히 {max_rounds}라운드까지만 실행합니다.
-★ 라운드 {max_rounds} 판정 완료 후 → 즉시 단계 10(예방책 생성)으로 이동
-★ 라운드 {max_rounds + 1}은 절대 실행 금지
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-【실행 단계】
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-단계 1: 엔티티 가져오기
-- 도구: sim.fetch_entities
-- 입력: {{"data": {{"offender_id": {offender_id}, "victim_id": {victim_id}}}}}
-- 저장: scenario, victim_profile
-
-단계 2: 프롬프트 생성 (라운드1)
-- 도구: sim.compose_prompts
-- 입력: {{"data": {{"scenario": <1단계 scenario>, "victim_profile": <1단계 victim_profile>, "round_no": 1}}}}
-- 주의: guidance 필드 포함 금지
-- 결과: prompt_id를 받아서 PROMPT_ID_R1 변수에 저장
-
-단계 3: 시뮬레이션 실행 (라운드1)
-- 도구: mcp.simulator_run
-- 입력: {{"offender_id": {offender_id}, "victim_id": {victim_id}, "scenario": <1단계 scenario>, "prompt_id": PROMPT_ID_R1, "max_turns": {req.max_turns}, "round_no": 1}}
-- 저장: case_id (CASE_ID 변수), turns
-
-단계 3-1: 감정 라벨링 (라운드1)
-- (inject_emotion==True일 때만 수행)
-- 도구: label_victim_emotions
-- 입력: {{"run_no": 1, "turns": <3단계 turns>, "run_hmm": true, "hmm_attach": "per_victim_turn"{emotion_pair_mode_suffix}{debug_input_suffix}}}
-- 주의:
-  * (요청에서 emotion_pair_mode를 준 경우에만 pair_mode가 포함됩니다)
-  * pair_mode를 생략하면 tools_emotion이 환경변수 EMOTION_PAIR_MODE 또는 내부 기본값을 사용합니다.
-- 저장(매우 중요):
-    * EMO_R1 = label_victim_emotions Observation 원문 전체(그대로 보관)
-    * TURNS_R1_LABELED =
-        - EMO_R1이 list이면 EMO_R1 자체
-        - EMO_R1이 dict이면 EMO_R1.turns
-    * HMM_R1 =
-        - EMO_R1이 dict이면 EMO_R1.hmm 또는 EMO_R1.hmm_result 또는 EMO_R1.hmm_summary (있는 것)
-        - EMO_R1이 list이면 null (턴에 이미 hmm이 붙어있다고 가정)
-
-단계 4: 판정 (라운드1)
-- 도구: admin.make_judgement
-- 입력(중요):
-    - inject_emotion==True: {{"data": {{"case_id": <3단계 case_id>, "run_no": 1, "turns": TURNS_R1_LABELED, "hmm": HMM_R1}}}}
-    - inject_emotion==False: {{"data": {{"case_id": <3단계 case_id>, "run_no": 1, "turns": <3단계 turns>, "hmm": {{"available": false, "reason": "emotion_disabled", "run_no": 1}}}}}}
-- 저장: 판정 결과 (JUDGEMENT_R1)
-
-단계 4-1: 라운드1 종료 조건 체크
-  [A] risk.level == "critical"인가?
-      → YES: 즉시 단계 10으로 이동
-      → NO: 단계 4-2로
-      
-  [B] 현재 라운드 == {max_rounds}인가? (1 == {max_rounds}?)
-      → YES: 즉시 단계 10으로 이동
-      → NO: 단계 5로
-
-단계 5: 가이던스 생성 (라운드2용)
-- 도구: admin.generate_guidance
-- 입력: {{"data": {{"case_id": CASE_ID, "run_no": 1, "scenario": <1단계 scenario>, "victim_profile": <1단계 victim_profile>}}}}
-- 저장: GUIDANCE_R2
-
-▶ 라운드 N 반복 (N=2~{max_rounds})
-
-단계 6: 프롬프트 생성 (라운드N)
-- 도구: sim.compose_prompts
-- 입력: {{"data": {{"scenario": <1단계 scenario>, "victim_profile": <1단계 victim_profile>, "round_no": N, "guidance": GUIDANCE_R{{N}}}}}}
-- 결과: PROMPT_ID_R{{N}} 저장
-
-단계 7: 시뮬레이션 실행 (라운드N)
-- 도구: mcp.simulator_run
-- 입력: {{"offender_id": {offender_id}, "victim_id": {victim_id}, "scenario": <1단계 scenario>, "prompt_id": PROMPT_ID_R{{N}}, "max_turns": {req.max_turns}, "round_no": N, "case_id_override": CASE_ID, "guidance": {{"type": "A", "text": GUIDANCE_R{{N}}.text}}}}
-- 저장: turns
-
-단계 7-1: 감정 라벨링 (라운드N)
-- 도구: label_victim_emotions
-- 입력: {{"run_no": N, "turns": <7단계 turns>, "run_hmm": true, "hmm_attach": "per_victim_turn"{emotion_pair_mode_suffix}{debug_input_suffix}}}
-- 주의:
-  * (요청에서 emotion_pair_mode를 준 경우에만 pair_mode가 포함됩니다)
-  * pair_mode를 생략하면 tools_emotion이 환경변수 EMOTION_PAIR_MODE 또는 내부 기본값을 사용합니다.
-- 저장(매우 중요):
-    * EMO_R{{N}} = label_victim_emotions Observation 원문 전체
-    * TURNS_R{{N}}_LABELED =
-        - EMO_R{{N}}이 list이면 EMO_R{{N}} 자체
-        - EMO_R{{N}}이 dict이면 EMO_R{{N}}.turns
-    * HMM_R{{N}} =
-        - EMO_R{{N}}이 dict이면 EMO_R{{N}}.hmm 또는 EMO_R{{N}}.hmm_result 또는 EMO_R{{N}}.hmm_summary (있는 것)
-        - EMO_R{{N}}이 list이면 null
-
-단계 8: 판정 (라운드N)
-- 도구: admin.make_judgement
-- 입력(중요): {{"data": {{"case_id": CASE_ID, "run_no": N, "turns": TURNS_R{{N}}_LABELED, "hmm": HMM_R{{N}}}}}}
-- 저장: JUDGEMENT_R{{N}}
+단계 8: 판정 (라운드N)
+- 도구: admin.make_judgement
+- 입력(중요): {{"data": {{"case_id": CASE_ID, "run_no": N, "turns": TURNS_R{{N}}_LABELED, "hmm": HMM_R{{N}}}}}}
+- 저장: JUDGEMENT_R{{N}}
 
 단계 8-1: 라운드N 종료 조건 체크 ← **매우 중요**
   
@@ -2158,66 +2822,535 @@ def run_orchestrated(db: Session, payload: Dict[str, Any], _stop: Optional[Threa
    - PROMPT_ID_RN: 각 라운드마다 새로 생성
    - GUIDANCE_RN: 이전 라운드 판정 기반 생성
 
-4. **도구별 입력 형식**
-   - mcp.simulator_run: data 래핑 없음
-   - 나머지 도구: {{"data": {{...}}}} 형식
-   - label_victim_emotions: data 래핑 없음 ({{"turns": [...], ...}})
+4. **도구별 입력 형식**
+   - mcp.simulator_run: data 래핑 없음
+   - 나머지 도구: {{"data": {{...}}}} 형식
+   - label_victim_emotions: data 래핑 없음 ({{"turns": [...], ...}})
+
+5. **Action Input 작성**
+   - 반드시 한 줄로 작성
+   - 줄바꿈, 들여쓰기, 주석 금지
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+【실행 흐름 예시 - max_rounds={max_rounds}】
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+초기화: 1 (엔티티 로드)
+
+라운드1:
+  2→3→4→4-1 체크: critical? NO, 1=={max_rounds}? NO → 5
+
+라운드2:
+  6→7→8→8-1 체크: critical? NO, 2=={max_rounds}? NO → 9→6
+
+라운드3:
+  6→7→8→8-1 체크: critical? NO, 3=={max_rounds}? NO → 9→6
+
+라운드4:
+  6→7→8→8-1 체크: critical? NO, 4=={max_rounds}? NO → 9→6
+
+라운드5:
+  6→7→8→8-1 체크: critical? NO, 5=={max_rounds}? YES → **10**
+
+종료: 10 (예방책 생성) → 11 (예방책 저장) → 12 (Final Answer)
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+【조기 종료 예시 - critical 발생】
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+라운드3에서 critical 발생 시:
+  6→7→8→8-1 체크: critical? YES → **즉시 10**
+
+종료: 10 (예방책 생성) → 11 (예방책 저장) → 12 (Final Answer)
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+【절대 금지 사항】
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+❌ 라운드 {max_rounds_next} 실행 금지
+❌ 단계 10, 11 생략 금지
+❌ N > {max_rounds} 상태 진입 금지
+
+**핵심**: 라운드 {max_rounds} 판정(단계 8) 완료 후 → 무조건 단계 10
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+【Final Answer 작성 조건】
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+다음을 **모두 완료**한 후에만 Final Answer 작성:
+✓ admin.make_prevention 호출 및 Observation 확인
+✓ admin.save_prevention 호출 및 Observation 확인
+
+위 2개 도구를 호출하지 않고 Final Answer 작성 시 **포맷 오류**로 처리됩니다.
+"""
+
+@functools.lru_cache(maxsize=1)
+def _react_prompt() -> ChatPromptTemplate:
+    """ReAct 프롬프트 템플릿은 요청마다 동일하므로 프로세스당 1회만 만든다."""
+    return ChatPromptTemplate.from_messages(
+        [
+            ("system", REACT_SYS),
+            (
+                "human",
+                "사용 가능한 도구들:\n{tools}\n\n"
+                "도구 이름 목록: {tool_names}\n\n"
+                # 포맷 본문은 REACT_SYS에만 둔다 (매 스텝 재전송되는 중복 토큰 제거)
+                "시스템 메시지의 ▼ 출력 포맷을 정확히 따르세요. 포맷 외 임의 텍스트/코드펜스/주석 금지.\n\n"
+                "입력:\n{input}\n\n"
+                "{agent_scratchpad}",
+            ),
+        ]
+    )
+
+# ─────────────────────────────────────────────────────────
+# ✅ agent_scratchpad 슬라이딩 윈도우
+# - 라운드가 쌓일수록 Thought/Action/Observation(대화 turns, 판정 등)이 계속 붙어 입력이 커진다.
+# - 전체 길이가 예산을 넘으면 최근 스텝만 원문 유지, 이전 스텝은 핵심 필드만 남긴 요약으로 치환
+# - executor가 들고 있는 intermediate_steps 자체는 건드리지 않음(프롬프트 렌더링용 사본만 축약)
+# - turns/hmm는 도구 래퍼가 _EMO_CACHE에서 다시 주입하므로 요약돼도 판정/예방책 입력은 유지됨
+# ─────────────────────────────────────────────────────────
+_SCRATCHPAD_MAX_CHARS = int(os.getenv("VP_SCRATCHPAD_MAX_CHARS", "32000"))  # ≈ 8000 tokens
+_SCRATCHPAD_KEEP_RECENT = 6  # 약 1라운드(compose → run → emotion → judgement → guidance) 분량
+# scenario/victim_profile은 모든 라운드에서 재사용되므로 항상 원문 유지
+_SCRATCHPAD_PINNED_TOOLS = frozenset({"sim.fetch_entities"})
+_SCRATCHPAD_SUMMARY_KEYS = (
+    "ok", "error", "case_id", "run_no", "round_no", "prompt_id",
+    "phishing", "risk", "type", "text", "ended_by",
+)
+
+def _compact_observation(obs: Any) -> str:
+    parsed: Any = obs
+    if isinstance(obs, str):
+        parsed = _loose_parse_json_any(obs) if obs.lstrip()[:1] in ("{", "[") else None
+    if isinstance(parsed, dict):
+        body = parsed.get("data") if isinstance(parsed.get("data"), dict) else parsed
+        summary = {k: body[k] for k in _SCRATCHPAD_SUMMARY_KEYS if k in body}
+        if isinstance(summary.get("risk"), dict):
+            summary["risk"] = {"level": summary["risk"].get("level")}
+        if isinstance(summary.get("text"), str) and len(summary["text"]) > 200:
+            summary["text"] = summary["text"][:200] + "…"
+        if summary:
+            return "[이전 단계 요약] " + _dumps(summary)
+    return "[이전 단계 요약] " + str(obs)[:200]
+
+def _window_intermediate_steps(steps: List[Tuple[AgentAction, Any]]) -> List[Tuple[AgentAction, Any]]:
+    if len(steps) <= _SCRATCHPAD_KEEP_RECENT:
+        return steps
+    total = sum(len(a.log or "") + len(str(o)) for a, o in steps)
+    if total <= _SCRATCHPAD_MAX_CHARS:
+        return steps
+
+    cut = len(steps) - _SCRATCHPAD_KEEP_RECENT
+    windowed: List[Tuple[AgentAction, Any]] = []
+    for i, (action, obs) in enumerate(steps):
+        if i >= cut or action.tool in _SCRATCHPAD_PINNED_TOOLS:
+            windowed.append((action, obs))
+            continue
+        compact = AgentAction(
+            tool=action.tool,
+            tool_input="(생략)",
+            log=f"Action: {action.tool}\nAction Input: (이전 단계 입력 생략)",
+        )
+        windowed.append((compact, _compact_observation(obs)))
+    return windowed
+
+# ─────────────────────────────────────────────────────────
+# 도구 래핑 dispatch (이름 정확히 일치 → prefix 순)
+# ─────────────────────────────────────────────────────────
+_TOOL_WRAPPERS = {
+    # ★★★ sim 도구 래핑: 문자열 Action Input을 먼저 dict로 복구해서 invoke
+    "sim.compose_prompts": _wrap_sim_compose_prompts,
+    # sim.fetch_entities도 {"data": {...}} 스타일인 경우가 많아서 강제 래핑
+    "sim.fetch_entities": functools.partial(_wrap_tool_force_json_input, require_data_wrapper=True),
+    "mcp.simulator_run": _wrap_mcp_simulator_run,
+}
+_TOOL_PREFIX_WRAPPERS = (
+    # ★★★ admin 도구 래핑: Action Input 문자열 파싱 실패(특히 마지막 '}' 누락)를 orchestrator에서 크게 줄임
+    # admin.*는 모두 SingleData 스타일({"data": {...}})로 강제
+    ("admin.", functools.partial(_wrap_tool_force_json_input, require_data_wrapper=True)),
+)
+
+def _wrap_registered_tool(t):
+    wrapper = _TOOL_WRAPPERS.get(t.name)
+    if wrapper is None:
+        for prefix, prefix_wrapper in _TOOL_PREFIX_WRAPPERS:
+            if t.name.startswith(prefix):
+                wrapper = prefix_wrapper
+                break
+    return wrapper(t) if wrapper is not None else t
+
+def build_agent_and_tools(
+    db: Session,
+    use_tavily: bool,
+    streaming: bool = False,
+    http_async_client: Any = None,
+) -> Tuple[AgentExecutor, Any]:
+    llm = agent_chat(temperature=0.2, streaming=streaming, http_async_client=http_async_client)
+    logger.info("[AgentLLM] model=%s", getattr(llm, "model_name", "unknown"))
+
+    mcp_res = make_mcp_tools()
+    if isinstance(mcp_res, tuple):
+        mcp_tools, mcp_manager = mcp_res
+    else:
+        mcp_tools, mcp_manager = mcp_res, None
+
+    tools: List = [
+        _wrap_registered_tool(t)
+        for t in chain(make_sim_tools(db), mcp_tools, make_admin_tools(db, GuidelineRepoDB(db)))
+    ]
+    # ✅ Emotion tool 등록
+    # - ReAct가 Action Input을 문자열로 망가뜨리는 경우가 있어서, orchestrator에서 먼저 dict로 복구 후 invoke하도록 래핑
+    # - label_victim_emotions는 {"turns": [...], "run_hmm": true, ...} 형태(상위 "data" 래핑 불필요)
+    emotion_tool = label_victim_emotions
+    try:
+        # tool name 고정: 이벤트 처리/validation에서 "label_victim_emotions"로 찾기 때문에 불일치 방지
+        if getattr(emotion_tool, "name", None) != "label_victim_emotions":
+            setattr(emotion_tool, "name", "label_victim_emotions")
+    except Exception:
+        pass
+    tools.append(_wrap_tool_force_json_input(emotion_tool, require_data_wrapper=False))
+    if use_tavily:
+        tools += make_tavily_tools()
+
+    logger.info("[Agent] TOOLS REGISTERED: %s", [t.name for t in tools])
+
+    agent = RunnablePassthrough.assign(
+        intermediate_steps=lambda x: _window_intermediate_steps(x["intermediate_steps"])
+    ) | create_react_agent(llm=llm, tools=tools, prompt=_react_prompt())
+    ex = AgentExecutor(
+        agent=agent, 
+        tools=tools, 
+        verbose=True,
+        handle_parsing_errors=_parsing_error_handler,
+        max_iterations=50,  # ★ 전체 케이스 단일 호출이므로 충분한 iteration 확보
+        return_intermediate_steps=True,  # ✅ 도구 호출/observation을 결과로 강제 반환
+    )
+    return ex, mcp_manager
+
+# ─────────────────────────────────────────────────────────
+# ✅ event loop별 공용 executor
+# - 요청마다 LLM 클라이언트/도구 래핑/AgentExecutor를 새로 만들지 않는다.
+# - 도구 팩토리는 세션을 클로저로 잡기 때문에, 실제 세션 대신 _CONTEXT_DB를 넘기고
+#   요청별 세션은 _current_db(ContextVar)로 주입한다. (도구 실행 스레드에도 context가 복사됨)
+# ─────────────────────────────────────────────────────────
+_current_db: contextvars.ContextVar[Optional[Session]] = contextvars.ContextVar("_current_db", default=None)
+
+class _ContextBoundSession:
+    """속성 접근을 현재 context의 Session으로 위임하는 대리자."""
+    __slots__ = ()
+
+    def __getattr__(self, name: str) -> Any:
+        db = _current_db.get()
+        if db is None:
+            raise RuntimeError("현재 context에 바인딩된 DB 세션이 없습니다 (_current_db 미설정)")
+        return getattr(db, name)
+
+_CONTEXT_DB = _ContextBoundSession()
+
+# event loop -> {(use_tavily, streaming): executor}
+# - LLM async 클라이언트(httpx 커넥션)는 처음 쓴 loop에 묶이므로 executor도 loop별로 둔다
+# - 닫힌 loop의 항목은 다음 조회 때 정리 (asyncio.run 반복 호출 시 누적 방지)
+_EXECUTORS: Dict[asyncio.AbstractEventLoop, Dict[Tuple[bool, bool], AgentExecutor]] = {}
+_EXECUTORS_LOCK = ThreadLock()
+
+def _get_executor(loop: asyncio.AbstractEventLoop, use_tavily: bool, streaming: bool = False) -> AgentExecutor:
+    """loop·(use_tavily, streaming) 조합별로 executor를 1회만 만든다. 호출 전 _current_db가 설정돼 있어야 함."""
+    key = (use_tavily, streaming)
+    with _EXECUTORS_LOCK:
+        for closed in [lp for lp in _EXECUTORS if lp.is_closed()]:
+            del _EXECUTORS[closed]
+        per_loop = _EXECUTORS.setdefault(loop, {})
+        ex = per_loop.get(key)
+        if ex is None:
+            # make_mcp_tools()는 도구 list만 반환한다(run 단위 수명의 MCP manager 없음) → executor만 캐시
+            ex, _mcp_manager = build_agent_and_tools(
+                _CONTEXT_DB, use_tavily, streaming, http_async_client=DefaultAsyncHttpxClient()
+            )
+            per_loop[key] = ex
+        return ex
+
+# ─────────────────────────────────────────────────────────
+# 케이스 JSON 덤프
+# ─────────────────────────────────────────────────────────
+# 기본은 compact JSON (기계 소비용). 사람이 직접 볼 때만 VP_CASE_DUMP_PRETTY=1 로 indent=2
+_CASE_DUMP_PRETTY = os.getenv("VP_CASE_DUMP_PRETTY", "").strip() in ("1", "true", "TRUE", "yes", "YES")
+# dump_dir이 이 값이면 파일을 아예 쓰지 않는다
+_CASE_DUMP_NOOP_DIRS = frozenset({"-", os.devnull})
+# 케이스마다 한 줄씩 요약을 append하는 인덱스 파일 (jq/grep으로 케이스 전체를 한 번에 훑기용)
+_CASE_DUMP_INDEX = "cases.ndjson"
+
+def _encode_case_json(obj: Any, pretty: bool) -> bytes:
+    if orjson is not None:
+        try:
+            option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+            return orjson.dumps(obj, option=option)
+        except TypeError:
+            pass
+    if pretty:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _case_index_line(path: Path, obj: Dict[str, Any]) -> Dict[str, Any]:
+    jr = obj.get("judgement_risk") or {}
+    cr = obj.get("case_risk") or {}
+    return {
+        "case_id": obj.get("case_id"),
+        "timestamp": obj.get("timestamp"),
+        "offender_id": obj.get("offender_id"),
+        "victim_id": obj.get("victim_id"),
+        "rounds_done": obj.get("rounds_done"),
+        "max_rounds": obj.get("max_rounds"),
+        "finished_reason": obj.get("finished_reason"),
+        "judgement_risk_level": jr.get("level"),
+        "judgement_risk_score": jr.get("score"),
+        "case_risk_level": cr.get("level"),
+        "path": path.name,
+    }
+
+def _dump_case_artifact_sync(path: Path, obj: Dict[str, Any], pretty: bool = _CASE_DUMP_PRETTY) -> None:
+    """
+    케이스 아티팩트를 메모리에서 한 번에 인코딩(orjson)해 write 1회로 저장. orjson이 못 다루는 값은 json으로 fallback.
+    - tmp 파일에 쓰고 os.replace로 원자적으로 교체
+    - 같은 폴더의 cases.ndjson에 요약 한 줄 append
+    """
+    # tmp에 다 쓴 뒤 rename: artifact_saved를 받은 쪽이 반쯤 쓰인 파일을 읽지 않도록
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    try:
+        tmp.write_bytes(_encode_case_json(obj, pretty))
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            tmp.unlink()
+        raise
+    with contextlib.suppress(Exception):
+        with (path.parent / _CASE_DUMP_INDEX).open("ab") as f:
+            f.write(_encode_case_json(_case_index_line(path, obj), False) + b"\n")
+
+async def _dump_case_artifact_async(path: Path, obj: Dict[str, Any]) -> None:
+    """async 경로용: 디렉터리 생성/인코딩/쓰기를 워커 스레드에서 실행해 SSE 루프를 막지 않는다."""
+    def _work() -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _dump_case_artifact_sync(path, obj)
+    await asyncio.to_thread(_work)
+
+# ─────────────────────────────────────────────────────────
+# run 종료 정리
+# ─────────────────────────────────────────────────────────
+def _safe(fn: Callable[..., Any], *args: Any) -> None:
+    """정리 단계용: 실패해도 다음 단계는 계속 진행 (원인은 debug 로그로만)."""
+    try:
+        fn(*args)
+    except Exception as e:
+        logger.debug("[Cleanup] %s 실패: %s", getattr(fn, "__qualname__", fn), e)
+
+def _drop_run_caches(stream_id: str, case_id: Optional[str]) -> None:
+    # 대부분의 짧은 run은 두 캐시에 이 stream 엔트리가 없다 → 조회 2번으로 끝
+    if not _PROMPT_CACHE.has_stream(stream_id) and stream_id not in _EMO_CACHE:
+        return
+    # ✅ 기존: "round_" 포함이면 전부 삭제 → 다른 케이스/동시 실행 캐시까지 싹 지워짐
+    # ✅ 수정: stream_id 스코프로만 제거
+    removed = _PROMPT_CACHE.drop_stream(stream_id)
+    if removed:
+        logger.info("[PromptCache] 정리: stream_id=%s removed=%s", stream_id, removed)
+
+        # 🔊 TTS용 대화 캐시도 함께 정리
+        try:
+            if case_id:
+                clear_case_dialog_cache(str(case_id))
+        except Exception as e:
+            logger.warning("[TTS_CACHE] clear_case_dialog_cache 실패: case_id=%s error=%s", case_id, e)
+    # ✅ Emotion/HMM 캐시도 stream_id 스코프로 정리 (레벨 A: run 동안만 유지)
+    if _EMO_CACHE.pop(stream_id, None) is not None:
+        logger.info("[EMO_CACHE] 정리: stream_id=%s", stream_id)
+
+# ─────────────────────────────────────────────────────────
+# ★★★ 메인 오케스트레이션 (단일 에이전트 호출 방식)
+# ─────────────────────────────────────────────────────────
+async def arun_orchestrated(db: Session, payload: Dict[str, Any], _stop: Optional[ThreadEvent] = None) -> Dict[str, Any]:
+    """
+    케이스 전체를 단일 에이전트 호출로 실행한다.
+    - LLM/도구 대기 중 이벤트 루프를 막지 않도록 ex.ainvoke를 await
+    - 동기 전용 준비 작업(도구/MCP 구성, DB 프롬프트 패키지 조립)은 asyncio.to_thread로 실행
+    """
+    stream_id = str(payload.get("stream_id") or uuid.uuid4())
+
+    run_key = _make_run_key(payload)
+    if not _claim_run_key(run_key):
+        raise HTTPException(status_code=409, detail="duplicated simulation run detected")
+
+    token = _current_stream_id.set(stream_id)
+    db_token = _current_db.set(db)
+    # ✅ CLI/배치에서는 SSE를 끈다 (running loop 문제 방지)
+    # ✅ stream_id를 받지 않은 호출(서버가 uuid 생성)은 아무도 구독할 수 없으므로 tee/SSE를 아예 켜지 않는다.
+    #    stream_id가 명시된 경우는 FE가 곧 구독할 수 있으니 구독자가 아직 없어도 유지
+    sse_on = _sse_enabled(payload) and (bool(payload.get("stream_id")) or _stream_has_subscribers(stream_id))
+    if sse_on:
+        _init_sse_logging_once()
+        tee_out = TeeTerminal(stream_id, "stdout")
+        tee_err = TeeTerminal(stream_id, "stderr")
+        _emit_to_stream("run_start", {"stream_id": stream_id, "payload_hint": _truncate(payload, 400)})
+    else:
+        tee_out = None
+        tee_err = None
+
+    req = None
+    ex = None
+    _emitted_run_end = False
+    case_id = None  # ✅ finally에서 안전하게 참조하기 위해 선할당
+    db_writer: Optional[_DbWriteWorker] = None
+    fd_tee: Optional[_FdTee] = None
+
+    try:
+        if _stop and _stop.is_set():
+            return {"status": "cancelled"}
+            
+        if sse_on:
+            ctx = contextlib.ExitStack()
+            if _SSE_FD_TEE and _is_sole_active_run():
+                fd_tee = _FdTee.try_start(stream_id)
+            # fd 레벨에서 이미 전부 잡히면 sys.stdout 교체는 하지 않는다(중복 전송 방지).
+            # stop은 reader join으로 블로킹되므로 finally에서 워커 스레드로 실행
+            if fd_tee is None:
+                ctx.enter_context(contextlib.redirect_stdout(tee_out))
+                ctx.enter_context(contextlib.redirect_stderr(tee_err))
+        else:
+            ctx = contextlib.nullcontext()
+        with ctx:
+            req = SimulationStartRequest(**payload)
+            ex = await asyncio.to_thread(_get_executor, asyncio.get_running_loop(), bool(req.use_tavily), sse_on)
+            # ✅ 감정 주입 ON/OFF (기본 ON)
+            # - payload.inject_emotion=false면 label_victim_emotions 단계를 "미션에서" 생략하도록 유도
+            inject_emotion = payload.get("inject_emotion")
+            if inject_emotion is None:
+                inject_emotion = True
+            inject_emotion = bool(inject_emotion)
+            logger.info("[EmotionInject] inject_emotion=%s", inject_emotion)
+            # 프롬프트 패키지 (DB 조립)
+            pkg = await asyncio.to_thread(
+                build_prompt_package_from_payload,
+                db, req, tavily_result=None, is_first_run=True, skip_catalog_write=True,
+            )
+            scenario = pkg["scenario"]
+            victim_profile = pkg["victim_profile"]
+            templates = pkg["templates"]
+
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("[InitialInput] %s", _dumps(_truncate(payload)))
+                logger.info("[ComposedPromptPackage] %s", _dumps(_truncate(pkg)))
 
-5. **Action Input 작성**
-   - 반드시 한 줄로 작성
-   - 줄바꿈, 들여쓰기, 주석 금지
+            offender_id = int(req.offender_id or 0)
+            victim_id = int(req.victim_id or 0)
 
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-【실행 흐름 예시 - max_rounds={max_rounds}】
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+            # ─────────────────────────────────────
+            # 피해자/공격자 성별 정보 정리 (TTS용)
+            # ─────────────────────────────────────
+            def _normalize_gender_str(g: Optional[str]) -> Optional[str]:
+                if not g:
+                    return None
+                s = str(g).strip().lower()
+                if s in ("남", "남자", "male", "m"):
+                    return "male"
+                if s in ("여", "여자", "female", "f"):
+                    return "female"
+                return None
 
-초기화: 1 (엔티티 로드)
+            victim_profile_base = _as_dict(victim_profile)
+            victim_meta = victim_profile_base.get("meta", {}) if isinstance(victim_profile_base, dict) else {}
 
-라운드1:
-  2→3→4→4-1 체크: critical? NO, 1=={max_rounds}? NO → 5
+            # 1순위: 요청 payload에 담긴 victim_gender / offender_gender (FE에서 보내는 값)
+            victim_gender_req = _normalize_gender_str(getattr(req, "victim_gender", None))
+            offender_gender_req = _normalize_gender_str(getattr(req, "offender_gender", None))
 
-라운드2:
-  6→7→8→8-1 체크: critical? NO, 2=={max_rounds}? NO → 9→6
+            # 2순위: DB victim_profile.meta.gender
+            victim_gender_db = _normalize_gender_str(victim_meta.get("gender"))
 
-라운드3:
-  6→7→8→8-1 체크: critical? NO, 3=={max_rounds}? NO → 9→6
+            victim_gender = victim_gender_req or victim_gender_db or "female"
+            offender_gender = offender_gender_req or "male"
 
-라운드4:
-  6→7→8→8-1 체크: critical? NO, 4=={max_rounds}? NO → 9→6
+            # (선택) 나이 → age_group으로 변환 (TTS에서 쓰고 있다면)
+            def _age_to_group(age: Optional[int]) -> Optional[str]:
+                try:
+                    a = int(age)
+                except Exception:
+                    return None
+                if a < 30:
+                    return "20s"
+                if a < 40:
+                    return "30s"
+                if a < 50:
+                    return "40s"
+                if a < 60:
+                    return "50s"
+                if a < 70:
+                    return "60s"
+                return "70s+"
 
-라운드5:
-  6→7→8→8-1 체크: critical? NO, 5=={max_rounds}? YES → **10**
+            victim_age_group = _age_to_group(victim_meta.get("age"))
 
-종료: 10 (예방책 생성) → 11 (예방책 저장) → 12 (Final Answer)
+            # 라운드 정책
+            try:
+                requested_rounds = int(getattr(req, "round_limit", MAX_ROUNDS_DEFAULT) or MAX_ROUNDS_DEFAULT)
+            except Exception:
+                requested_rounds = MAX_ROUNDS_DEFAULT
 
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-【조기 종료 예시 - critical 발생】
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+            requested_rounds = max(MIN_ROUNDS, requested_rounds)
+            max_rounds = min(requested_rounds, MAX_ROUNDS_UI_LIMIT)
 
-라운드3에서 critical 발생 시:
-  6→7→8→8-1 체크: critical? YES → **즉시 10**
+            scenario_base = _as_dict(scenario)
+            victim_profile_base = _as_dict(victim_profile)
+            templates_base = _as_dict(templates)
 
-종료: 10 (예방책 생성) → 11 (예방책 저장) → 12 (Final Answer)
+            # ─────────────────────────────────────
+            # ✅ Emotion pair_mode 결정 로직 (victim_only 지원 포함)
+            # 우선순위:
+            #  1) 요청(req/payload)에 명시된 pair_mode(또는 emotion_pair_mode)
+            #  2) 환경변수 EMOTION_PAIR_MODE
+            #  3) tools_emotion 내부 기본값
+            #
+            # ※ FE/배치에서 필드명을 pair_mode로 보내는 경우가 많아서 둘 다 지원한다.
+            # ※ env가 설정된 경우, tools_emotion이 env를 안 읽는 환경에서도 동작하도록
+            #    orchestrator가 pair_mode를 "명시적으로" 주입한다.
+            def _env_emotion_pair_mode() -> Optional[str]:
+                try:
+                    v = (os.getenv("EMOTION_PAIR_MODE") or "").strip()
+                    return v or None
+                except Exception:
+                    return None
 
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-【절대 금지 사항】
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+            req_pair_mode = _req_emotion_pair_mode(req, payload)                 # ex) "victim_only" / "prev_offender" / ...
+            env_pair_mode = _normalize_emotion_pair_mode(_env_emotion_pair_mode())  # ex) "prev_offender"
+            # ✅ 유효값이 뭔지 tool 쪽에서 더 엄격히 검증할 수도 있어서,
+            #    여기서는 "요청 > env > None" 순으로만 결정한다.
+            pair_mode_effective = req_pair_mode or env_pair_mode or None
 
-❌ 라운드 {max_rounds + 1} 실행 금지
-❌ 단계 10, 11 생략 금지
-❌ N > {max_rounds} 상태 진입 금지
+            if req_pair_mode:
+                logger.info("[EmotionPairMode] override(from_request)=%s", req_pair_mode)
+            elif env_pair_mode:
+                logger.info("[EmotionPairMode] using_env=%s (case_mission will INCLUDE pair_mode for safety)", env_pair_mode)
+            else:
+                logger.info("[EmotionPairMode] not set (tools default will apply; case_mission will OMIT pair_mode)")
 
-**핵심**: 라운드 {max_rounds} 판정(단계 8) 완료 후 → 무조건 단계 10
+            # case_mission에 넣을 Action Input suffix (없으면 빈 문자열로 pair_mode 생략)
+            # ✅ 요청 또는 env에서 결정된 값이 있으면 명시적으로 넣는다.
+            emotion_pair_mode_suffix = f', "pair_mode": "{pair_mode_effective}"' if pair_mode_effective else ""
 
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-【Final Answer 작성 조건】
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-다음을 **모두 완료**한 후에만 Final Answer 작성:
-✓ admin.make_prevention 호출 및 Observation 확인
-✓ admin.save_prevention 호출 및 Observation 확인
+            # ✅ 디버그 입력 플래그(원하면 payload로)
+            # - label_victim_emotions 입력(turns/pair_mode 등)을 서버 로그로 찍게 만들 때 사용
+            debug_input = payload.get("emotion_debug_input")
+            debug_input = 1 if str(debug_input).strip() in ("1", "true", "True") else 0
+            debug_input_suffix = f', "debug_input": {debug_input}' if debug_input else ""
 
-위 2개 도구를 호출하지 않고 Final Answer 작성 시 **포맷 오류**로 처리됩니다.
-"""
+            # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+            # ★★★ 전체 케이스 미션 구성 (동적 라운드)
+            # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+            case_mission = _CASE_MISSION_TMPL.format_map({
+                "max_rounds": max_rounds,
+                "max_rounds_next": max_rounds + 1,
+                "offender_id": offender_id,
+                "victim_id": victim_id,
+                "max_turns": req.max_turns,
+                "emotion_pair_mode_suffix": emotion_pair_mode_suffix,
+                "debug_input_suffix": debug_input_suffix,
+            })
 
             logger.info("[CaseMission] 전체 케이스 미션 시작")
             logger.info(f"[CaseMission] max_rounds={max_rounds}")
@@ -2227,12 +3360,14 @@ def run_orchestrated(db: Session, payload: Dict[str, Any], _stop: Optional[Threa
             # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
             try:
                 cap = ThoughtCapture()
+                # ✅ SSE 모드에서만 토큰/도구 시작 스트리밍 (CLI/배치는 기존과 동일)
+                callbacks = [cap, _SSEStreamCallback()] if sse_on else [cap]
                 # ✅ callbacks는 환경에 따라 무시될 수 있어 config로도 전달(이중 안전장치)
                 try:
-                    result = ex.invoke({"input": case_mission}, config={"callbacks": [cap]})
+                    result = await ex.ainvoke({"input": case_mission}, config={"callbacks": callbacks})
                 except TypeError:
                     # 일부 버전 호환
-                    result = ex.invoke({"input": case_mission}, callbacks=[cap])
+                    result = await ex.ainvoke({"input": case_mission}, callbacks=callbacks)
                 logger.info(f"[CaseMission] Agent result: {_truncate(result)}")
             except Exception as e:
                 logger.error(f"[CaseMission] Agent execution failed: {e}")
@@ -2253,39 +3388,27 @@ def run_orchestrated(db: Session, payload: Dict[str, Any], _stop: Optional[Threa
                 if isinstance(result, dict):
                     steps = result.get("intermediate_steps") or []
 
+                # ✅ 한 번만 순회: 도구 이름 복구 + (case_id가 아직 없으면) 첫 simulator_run observation에서 case_id 복구
+                # intermediate_steps: 보통 [(AgentAction, observation), ...] 형태
                 if steps:
-                    try:
-                        recovered_tools = []
-                        # intermediate_steps: 보통 [(AgentAction, observation), ...] 형태
-                        for step in steps:
-                            if isinstance(step, (list, tuple)) and len(step) >= 1:
-                                action = step[0]
-                                tool_name = getattr(action, "tool", None)
-                                if tool_name:
-                                    recovered_tools.append(tool_name)
-                        actual_tools = recovered_tools
-                        logger.warning("[CaseMission] cap.events 비어있음 → intermediate_steps로 도구 호출 복구: %s", actual_tools)
-                    except Exception as e:
-                        logger.warning("[CaseMission] intermediate_steps 복구 실패: %s", e)
-                # ✅ cap.events가 비어있을 때 case_id도 intermediate_steps observation에서 복구 시도
-                if not case_id and steps:
-                    try:
-                        for step in steps:
-                            if not (isinstance(step, (list, tuple)) and len(step) >= 2):
-                                continue
-                            action, obs = step[0], step[1]
-                            if getattr(action, "tool", None) != "mcp.simulator_run":
-                                continue
-                            sim_dict = _loose_parse_json(obs)
-                            if isinstance(sim_dict, dict):
-                                body = sim_dict.get("data") if isinstance(sim_dict.get("data"), dict) else sim_dict
-                                _cid = body.get("case_id")
-                                if _cid:
-                                    case_id = str(_cid)
-                                    logger.warning("[CaseMission] case_id intermediate_steps로 복구: %s", case_id)
-                                    break
-                    except Exception as e:
-                        logger.warning("[CaseMission] case_id intermediate_steps 복구 실패: %s", e)
+                    recovered_tools = []
+                    for step in steps:
+                        if not isinstance(step, (list, tuple)) or not step:
+                            continue
+                        tool_name = getattr(step[0], "tool", None)
+                        if not tool_name:
+                            continue
+                        recovered_tools.append(tool_name)
+                        if case_id or tool_name != "mcp.simulator_run" or len(step) < 2:
+                            continue
+                        sim_dict = _loose_parse_json(step[1])
+                        body = sim_dict.get("data") if isinstance(sim_dict.get("data"), dict) else sim_dict
+                        _cid = body.get("case_id")
+                        if _cid:
+                            case_id = str(_cid)
+                            logger.warning("[CaseMission] case_id intermediate_steps로 복구: %s", case_id)
+                    actual_tools = recovered_tools
+                    logger.warning("[CaseMission] cap.events 비어있음 → intermediate_steps로 도구 호출 복구: %s", actual_tools)
 
                 # dump 모드가 아니면 기존처럼 500 유지(프론트 영향 최소)
                 if not actual_tools and not dump_enabled:
@@ -2305,7 +3428,13 @@ def run_orchestrated(db: Session, payload: Dict[str, Any], _stop: Optional[Threa
                 logger.error("[CaseMission] case_id 추출 실패")
                 raise HTTPException(500, "case_id 추출 실패")
 
-            _ensure_admincase(db, case_id, scenario_base)
+            # ✅ AdminCase upsert(SELECT+commit)는 루프에서 기다리지 않고 writer 큐 맨 앞에 넣는다
+            #    (FIFO라 뒤이은 라운드 저장보다 항상 먼저 실행됨)
+            db_writer = _DbWriteWorker(db.get_bind())
+            db_writer.submit(
+                "AdminCase upsert",
+                lambda s, _cid=case_id, _sc=scenario_base: _ensure_admincase(s, _cid, _sc),
+            )
             logger.info(f"[CaseMission] case_id 확정: {case_id}")
 
             # 3. 완료된 라운드 수 계산
@@ -2314,11 +3443,11 @@ def run_orchestrated(db: Session, payload: Dict[str, Any], _stop: Optional[Threa
             # ✅ rounds_done 계산 전용(=count 전용) dedupe 키 모음
             seen_judgement_keys_for_count: Set[Any] = set()
             rounds_done = 0
+            # ✅ cap.events는 여기서 한 번만 훑고, 이후에는 버킷/observation 목록을 사용
+            events_by_key, observation_events = _bucket_events(cap)
             try:
-                for ev in cap.events:
-                    if ev.get("type") != "observation" or ev.get("tool") != "admin.make_judgement":
-                        continue
-                    j = _loose_parse_json(ev.get("output"))
+                for ev in events_by_key.get(("observation", "admin.make_judgement"), ()):
+                    j = _event_parsed(ev)
                     if not isinstance(j, dict):
                         continue
                     # admin.make_judgement 출력에 run_no/run이 있으면 그걸 사용
@@ -2327,9 +3456,7 @@ def run_orchestrated(db: Session, payload: Dict[str, Any], _stop: Optional[Threa
                         seen_judgement_keys_for_count.add(rno)
                     else:
                         # run_no가 없으면 "내용 기반"으로 중복 제거(최소 안전장치)
-                        seen_judgement_keys_for_count.add(
-                            json.dumps(_truncate(j, 2000), ensure_ascii=False, sort_keys=True)
-                        )
+                        seen_judgement_keys_for_count.add(_digest(_truncate(j, 2000)))
                 rounds_done = len(seen_judgement_keys_for_count)
             except Exception:
                 rounds_done = 0
@@ -2359,434 +3486,362 @@ def run_orchestrated(db: Session, payload: Dict[str, Any], _stop: Optional[Threa
             # ✅ "가장 최근 simulator_run의 라운드키" 기억: label_victim_emotions merge 대상을 정확히 지정
             last_sim_round_key: Optional[int] = None
 
-            logger.info(f"[DEBUG] ===== cap.events 전체 ({len(cap.events)}개) =====")
-            for i, ev in enumerate(cap.events):
-                logger.info(f"[DEBUG] Event {i}: type={ev.get('type')}, tool={ev.get('tool', 'N/A')}")
-
-            for ev in cap.events:
-                if ev.get("type") == "observation":
-                    tool_name = ev.get("tool")
-                    output = ev.get("output")
-                    logger.info(f"[DEBUG] Observation detected: tool={tool_name}, output_len={len(str(output))}")
-                    # admin.make_judgement
-                    if tool_name == "admin.make_judgement":
-                        judgement = _loose_parse_json(output)
-                        if judgement:
-                            # ✅ 가능한 경우, 실제 run_no를 따르고 중복을 제거
-                            rno = judgement.get("run_no", judgement.get("run"))
-                            if isinstance(rno, int):
-                                if rno in judgement_seen_run_nos:
-                                    continue
-                                judgement_seen_run_nos.add(rno)
-                                use_run_no = rno
-                            else:
-                                judgement_idx += 1
-                                use_run_no = judgement_idx
-                            judgements_history.append({
-                                "run_no": use_run_no,
-                                "phishing": judgement.get("phishing", False),
-                                "risk": judgement.get("risk", {}),
-                                "evidence": judgement.get("evidence", "")
-                            })
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[DEBUG] ===== cap.events 전체 (%d개) =====", len(cap.events))
+                for i, ev in enumerate(cap.events):
+                    logger.debug("[DEBUG] Event %d: type=%s, tool=%s", i, ev.get("type"), ev.get("tool", "N/A"))
+
+            # ✅ 라운드 DB 쓰기는 백그라운드 writer(위에서 생성)로 넘기고 루프 뒤에서 join
+
+            for ev in observation_events:
+                tool_name = ev.get("tool")
+                output = ev.get("output")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        "[DEBUG] Observation detected: tool=%s, output=%s(len=%s)",
+                        tool_name, type(output).__name__, ev.get("output_len", "n/a"),
+                    )
+                # admin.make_judgement
+                if tool_name == "admin.make_judgement":
+                    judgement = _event_parsed(ev)
+                    if judgement:
+                        # ✅ 가능한 경우, 실제 run_no를 따르고 중복을 제거
+                        rno = judgement.get("run_no", judgement.get("run"))
+                        if isinstance(rno, int):
+                            if rno in judgement_seen_run_nos:
+                                continue
+                            judgement_seen_run_nos.add(rno)
+                            use_run_no = rno
+                        else:
+                            judgement_idx += 1
+                            use_run_no = judgement_idx
+                        judgements_history.append({
+                            "run_no": use_run_no,
+                            "phishing": judgement.get("phishing", False),
+                            "risk": judgement.get("risk", {}),
+                            "evidence": judgement.get("evidence", "")
+                        })
                     
-                    # mcp.simulator_run 결과 처리: 대화 로그를 testdb + TTS 캐시에 저장
-                    elif tool_name == "mcp.simulator_run":
-                        sim_run_idx += 1
-                        logger.info(f"[DEBUG] mcp.simulator_run 처리 시작: sim_run_idx={sim_run_idx}")
-                        logger.info(f"[DEBUG] output 타입: {type(output)}")
-                        logger.info(f"[DEBUG] output 길이: {len(str(output))}")
-                        # 1) MCP 결과 파싱
-                        sim_dict = _loose_parse_json(output)
-                        if not isinstance(sim_dict, dict):
-                            logger.warning(
-                                "[MCP] simulator_run output이 dict가 아님: type=%s value=%s",
-                                type(sim_dict).__name__,
-                                _truncate(sim_dict, 300),
-                            )
-                            continue
-                        logger.info(f"[DEBUG] sim_dict keys: {list(sim_dict.keys())}")
+                # mcp.simulator_run 결과 처리: 대화 로그를 testdb + TTS 캐시에 저장
+                elif tool_name == "mcp.simulator_run":
+                    sim_run_idx += 1
+                    if logger.isEnabledFor(logging.DEBUG):
+                        # output 타입/길이는 위 Observation detected 로그에 이미 찍힌다
+                        logger.debug("[DEBUG] mcp.simulator_run 처리 시작: sim_run_idx=%d", sim_run_idx)
+                    # 1) MCP 결과 파싱
+                    sim_dict = _event_parsed(ev)
+                    if not isinstance(sim_dict, dict):
+                        logger.warning(
+                            "[MCP] simulator_run output이 dict가 아님: type=%s value=%s",
+                            type(sim_dict).__name__,
+                            _truncate(sim_dict, 300),
+                        )
+                        continue
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("[DEBUG] sim_dict keys: %s", list(sim_dict.keys()))
 
-                        # 2) data 래퍼 지원: {"ok": true, "data": {...}} 형태 처리
-                        body = sim_dict.get("data") if isinstance(sim_dict.get("data"), dict) else sim_dict
-                        logger.info(f"[DEBUG] body keys: {list(body.keys())}")
+                    # 2) data 래퍼 지원: {"ok": true, "data": {...}} 형태 처리
+                    body = sim_dict.get("data") if isinstance(sim_dict.get("data"), dict) else sim_dict
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("[DEBUG] body keys: %s", list(body.keys()))
 
 
-                        # ★★★ log.turns 우선 사용 (중복 구조 해결)
-                        if "log" in body and isinstance(body["log"], dict):
-                            raw_turns = body["log"].get("turns", [])
-                        else:
-                            raw_turns = body.get("turns", [])
-                        if not isinstance(raw_turns, list) or not raw_turns:
-                            logger.warning(
-                                "[MCP] simulator_run 결과에 turns 리스트가 없음: keys=%s",
-                                list(body.keys()),
-                            )
-                            continue  # turns 없으면 저장/캐시도 의미 없음
-
-                        # case_id / stats / ended_by는 body 기준으로 우선
-                        sim_case_id = body.get("case_id") or case_id
-                        stats = body.get("stats") or {}
-                        ended_by = body.get("ended_by")
-                        # ✅ 라운드 키: 가능하면 MCP가 준 round_no/run_no를 사용(재시도 시 sim_run_idx 부풀림 방지)
-                        round_key = body.get("round_no") or body.get("run_no") or body.get("run") or sim_run_idx
-                        try:
-                            round_key = int(round_key)
-                        except Exception:
-                            round_key = sim_run_idx
-                        last_sim_round_key = round_key
-                        # ✅ label_victim_emotions 단계에서 DB 업데이트 시 사용할 case_id 추적
-                        try:
-                            if sim_case_id:
-                                case_id_by_round[round_key] = str(sim_case_id)
-                        except Exception:
-                            pass
-                        # ★★★ victim dialogue 추출 (JSON → text)
-                        cleaned_turns = []
-                        for turn in raw_turns:
-                            role = _norm_role(turn.get("role", ""))
-                            text = turn.get("text", "")
-                            
-                            cleaned: Dict[str, Any] = {"role": role, "text": text}
-
-                            # ✅ victim의 JSON 응답 처리: dialogue는 text로, 속마음/신뢰도는 victim_meta로 저장
-                            if role == "victim":
-                                dialogue, vmeta = _parse_victim_turn_text(text)
-                                if dialogue:
-                                    cleaned["text"] = dialogue  # UI/판정/DB content 호환
-                                if vmeta:
-                                    cleaned["victim_meta"] = vmeta
-                                    # (선택) 분석 편의상 최상위에도 복사
-                                    cleaned["is_convinced"] = vmeta.get("is_convinced")
-                                    cleaned["thoughts"] = vmeta.get("thoughts")
-
-                            # 🔊 TTS용 성별/나이 정보 주입
-                            if role == "victim":
-                                cleaned["gender"] = victim_gender       # "male"/"female"
-                                if victim_age_group:
-                                    cleaned["age_group"] = victim_age_group
-                            elif role == "offender":
-                                cleaned["gender"] = offender_gender     # "male"/"female"
-
-                            cleaned_turns.append(cleaned)
-                        # ✅ turns_all은 여기서 바로 누적하지 말고
-                        #    label_victim_emotions 결과로 덮인 뒤 최종 재구성
-
-                        # ✅ 케이스 덤프용 라운드별 저장 (DB 재조회 필요 없게)
-                        try:
-                            turns_by_round[round_key] = cleaned_turns
-                            stats_by_round[round_key] = stats if isinstance(stats, dict) else {}
-                            ended_by_by_round[round_key] = ended_by
-                        except Exception:
-                            pass
-
-                        # ── SSE: 라운드 단위 대화 전달 (TTS 모달 버튼 생성용) ─────────────
-                        try:
-                            _emit_to_stream(
-                                "conversation_round",
-                                {
-                                    "case_id": str(sim_case_id) if sim_case_id else None,
-                                    "run_no": round_key,
-                                    "turns": _truncate(cleaned_turns, 2000),
-                                    "ended_by": ended_by,
-                                    "stats": _truncate(stats, 2000),
-                                },
-                            )
-                        except Exception as e:
-                            logger.warning(f"[SSE] conversation_round emit 실패: {e}")
-
-                        # ── DB 저장 (라운드별: conversation_round) ───────────────────────
-                        try:
-                            round_row = (
-                                db.query(m.ConversationRound)
-                                .filter(
-                                    m.ConversationRound.case_id == sim_case_id,
-                                    m.ConversationRound.run == round_key,
-                                )
-                                .first()
-                            )
-                            if not round_row:
-                                round_row = m.ConversationRound(
-                                    case_id=sim_case_id,
-                                    run=round_key,
-                                    offender_id=offender_id,
-                                    victim_id=victim_id,
-                                    turns=cleaned_turns,
-                                    ended_by=ended_by,
-                                    stats=stats,
-                                )
-                                db.add(round_row)
-                            else:
-                                round_row.turns = cleaned_turns
-                                round_row.ended_by = ended_by
-                                round_row.stats = stats
-                            db.commit()
-                            logger.info(
-                                "[DB] ConversationRound stored: case_id=%s run=%s turns=%s",
-                                sim_case_id,
-                                round_key,
-                                len(cleaned_turns),
-                            )
-                        except Exception as e:
-                            logger.warning(f"[DB] round {sim_run_idx} 저장 실패: {e}")
-
-                        # ── DB 저장 (턴 단위: conversationlog) ────────────────────────────
-                        try:
-                            (
-                                db.query(m.ConversationLog)
-                                .filter(
-                                    m.ConversationLog.case_id == sim_case_id,
-                                    m.ConversationLog.run == round_key,
-                                )
-                                .delete(synchronize_session=False)
-                            )
-
-                            for idx, turn in enumerate(cleaned_turns, start=1):
-                                role = (turn.get("role") or "").strip() or "unknown"
-                                text = turn.get("text") or ""
-
-                                log_row = m.ConversationLog(
-                                    case_id=sim_case_id,
-                                    offender_id=offender_id,
-                                    victim_id=victim_id,
-                                    turn_index=idx,
-                                    role=role,
-                                    content=text,
-                                    label=None,
-                                    payload=turn,
-                                    use_agent=True,
-                                    run=round_key,
-                                    guidance_type=None,
-                                    guideline=None,
-                                )
-                                db.add(log_row)
-
-                            db.commit()
-                            logger.info(
-                                "[DB] ConversationLog stored: case_id=%s run=%s turns=%s",
-                                sim_case_id,
-                                round_key,
-                                len(cleaned_turns),
-                            )
-                        except Exception as e:
-                            logger.warning(
-                                "[DB] ConversationLog 저장 실패: case_id=%s run=%s error=%s",
-                                sim_case_id,
-                                round_key,
-                                e,
-                            )
-
-                        # ✅ TTS용 메모리 캐시에 라운드별 대화 저장
-                        try:
-                            cache_run_dialog(
-                                case_id=str(sim_case_id),
-                                run_no=round_key,
-                                turns=cleaned_turns,
-                                victim_age=victim_meta.get("age"),
-                                victim_gender=victim_gender,
-                            )
-                            logger.info(
-                                "[TTS_CACHE] cached dialog for case_id=%s run_no=%s (turns=%s, age=%s, gender=%s)",
-                                sim_case_id,
-                                round_key,
-                                len(cleaned_turns),
-                                victim_meta.get("age"),
-                                victim_gender,
-                            )
-                        except Exception as e:
-                            logger.warning(
-                                "[TTS_CACHE] cache_run_dialog failed for case_id=%s run_no=%s: %s",
-                                sim_case_id,
-                                sim_run_idx,
-                                e,
-                            )
-                    # ✅ 감정 라벨링 결과 처리: 직전 mcp.simulator_run 라운드(turns_by_round[sim_run_idx])를 덮어쓰기
-                    elif tool_name == "label_victim_emotions":
-                        # tool output은 보통 list(turns) 또는 {"turns":[...]} 형태
-                        labeled_any = _loose_parse_json_any(output)
-                        if isinstance(labeled_any, dict) and labeled_any.get("ok") is False:
-                            logger.warning("[Emotion] label_victim_emotions failed: %s", _truncate(labeled_any, 500))
-                        labeled_turns: Optional[List[Dict[str, Any]]] = None
-                        # ✅ merge 대상 라운드: 직전 simulator_run의 round_key 우선
-                        target_round = last_sim_round_key if isinstance(last_sim_round_key, int) else sim_run_idx
-
-                        if isinstance(labeled_any, dict):
-                            t = labeled_any.get("turns")
-                            if isinstance(t, list):
-                                labeled_turns = t
-                        elif isinstance(labeled_any, list):
-                            labeled_turns = labeled_any
-
-                        if not labeled_turns:
-                            logger.warning(
-                                "[Emotion] label_victim_emotions output이 turns(list)가 아님: type=%s value=%s",
-                                type(labeled_any).__name__,
-                                _truncate(labeled_any, 300),
-                            )
-                            continue
+                    # ★★★ log.turns 우선 사용 (중복 구조 해결)
+                    if "log" in body and isinstance(body["log"], dict):
+                        raw_turns = body["log"].get("turns", [])
+                    else:
+                        raw_turns = body.get("turns", [])
+                    if not isinstance(raw_turns, list) or not raw_turns:
+                        logger.warning(
+                            "[MCP] simulator_run 결과에 turns 리스트가 없음: keys=%s",
+                            list(body.keys()),
+                        )
+                        continue  # turns 없으면 저장/캐시도 의미 없음
+
+                    # case_id / stats / ended_by는 body 기준으로 우선
+                    sim_case_id = body.get("case_id") or case_id
+                    stats = body.get("stats") or {}
+                    ended_by = body.get("ended_by")
+                    # ✅ 라운드 키: 가능하면 MCP가 준 round_no/run_no를 사용(재시도 시 sim_run_idx 부풀림 방지)
+                    round_key = body.get("round_no") or body.get("run_no") or body.get("run") or sim_run_idx
+                    try:
+                        round_key = int(round_key)
+                    except Exception:
+                        round_key = sim_run_idx
+                    last_sim_round_key = round_key
+                    # ✅ label_victim_emotions 단계에서 DB 업데이트 시 사용할 case_id 추적
+                    try:
+                        if sim_case_id:
+                            case_id_by_round[round_key] = str(sim_case_id)
+                    except Exception:
+                        pass
+                    # ★★★ victim dialogue 추출 (JSON → text)
+                    # ✅ 길이를 아는 리스트는 미리 잡아두고 인덱스로 채운다 (append 재할당 방지)
+                    cleaned_turns: List[Dict[str, Any]] = [None] * len(raw_turns)  # type: ignore[list-item]
+                    for ti, turn in enumerate(raw_turns):
+                        role = _norm_role(turn.get("role", ""))  # 항상 비어있지 않은 정규화 값("unknown" 포함)
+                        text = turn.get("text") or ""
+
+                        cleaned: Dict[str, Any] = {"role": role, "text": text}
+
+                        # ✅ victim의 JSON 응답 처리: dialogue는 text로, 속마음/신뢰도는 victim_meta로 저장
+                        if role == "victim":
+                            dialogue, vmeta = _parse_victim_turn_text(text)
+                            if dialogue:
+                                cleaned["text"] = dialogue  # UI/판정/DB content 호환
+                            if vmeta:
+                                cleaned["victim_meta"] = vmeta
+                                # (선택) 분석 편의상 최상위에도 복사
+                                cleaned["is_convinced"] = vmeta.get("is_convinced")
+                                cleaned["thoughts"] = vmeta.get("thoughts")
+
+                        # 🔊 TTS용 성별/나이 정보 주입
+                        if role == "victim":
+                            cleaned["gender"] = victim_gender       # "male"/"female"
+                            if victim_age_group:
+                                cleaned["age_group"] = victim_age_group
+                        elif role == "offender":
+                            cleaned["gender"] = offender_gender     # "male"/"female"
+
+                        cleaned_turns[ti] = cleaned
+                    # ✅ turns_all은 여기서 바로 누적하지 말고
+                    #    label_victim_emotions 결과로 덮인 뒤 최종 재구성
+
+                    # ✅ 케이스 덤프용 라운드별 저장 (DB 재조회 필요 없게)
+                    try:
+                        turns_by_round[round_key] = cleaned_turns
+                        stats_by_round[round_key] = stats if isinstance(stats, dict) else {}
+                        ended_by_by_round[round_key] = ended_by
+                    except Exception:
+                        pass
 
-                        # ✅ 기존 cleaned_turns(성별/age_group/victim_meta 등 유지) 위에 라벨 필드만 merge
-                        base_turns = turns_by_round.get(target_round) or []
-                        merged: List[Dict[str, Any]] = []
-                        try:
-                            max_len = max(len(base_turns), len(labeled_turns))
-                            for i in range(max_len):
-                                b = base_turns[i] if i < len(base_turns) and isinstance(base_turns[i], dict) else {}
-                                l = labeled_turns[i] if i < len(labeled_turns) and isinstance(labeled_turns[i], dict) else {}
-                                mt = dict(b)     # base 우선
-                                # ✅ labeled 쪽에서 붙은 감정/확률/HMM 관련 모든 필드를 반영하되,
-                                #    base의 텍스트/성별/메타는 보호한다.
-                                PROTECT_KEYS = {
-                                    "text", "dialogue", "victim_meta", "is_convinced", "thoughts",
-                                    "gender", "age_group",
-                                }
-                                for k, v in l.items():
-                                    if k in PROTECT_KEYS:
-                                        continue
-                                    mt[k] = v
-
-                                # base에 role이 비어있으면 labeled role을 채우되 정규화
-                                if not mt.get("role") and l.get("role"):
-                                    mt["role"] = _norm_role(l.get("role"))
-                                merged.append(mt)
-                        except Exception:
-                            merged = [t for t in labeled_turns if isinstance(t, dict)]
-
-                        # ✅ 최종 안전 정규화:
-                        # - role 재정규화
-                        # - victim text가 JSON이면 dialogue로 복구
-                        # - gender/age_group 누락 시 주입
-                        normalized: List[Dict[str, Any]] = []
-                        for t in merged:
-                            if not isinstance(t, dict):
-                                continue
-                            tt = dict(t)
-                            tt["role"] = _norm_role(tt.get("role"))
+                    # ── SSE: 라운드 단위 대화 전달 (TTS 모달 버튼 생성용) ─────────────
+                    try:
+                        _emit_to_stream(
+                            "conversation_round",
+                            {
+                                "case_id": str(sim_case_id) if sim_case_id else None,
+                                "run_no": round_key,
+                                "turns": cleaned_turns,
+                                "ended_by": ended_by,
+                                "stats": stats,
+                            },
+                        )
+                    except Exception as e:
+                        logger.warning(f"[SSE] conversation_round emit 실패: {e}")
+
+                    # ── DB 저장 (conversation_round + conversationlog를 한 트랜잭션으로, writer 스레드에서) ──
+                    def _store_round(
+                        s: Session,
+                        _cid=sim_case_id, _run=round_key, _turns=cleaned_turns,
+                        _ended_by=ended_by, _stats=stats,
+                    ) -> None:
+                        # (case_id, run) 유니크(uq_round_case_run) 기준 원자적 upsert: 조회+삽입 왕복/경합 제거
+                        round_stmt = pg_insert(m.ConversationRound).values(
+                            case_id=_cid,
+                            run=_run,
+                            offender_id=offender_id,
+                            victim_id=victim_id,
+                            turns=_turns,
+                            ended_by=_ended_by,
+                            stats=_stats,
+                        )
+                        round_stmt = round_stmt.on_conflict_do_update(
+                            index_elements=["case_id", "run"],
+                            set_={
+                                "turns": round_stmt.excluded.turns,
+                                "ended_by": round_stmt.excluded.ended_by,
+                                "stats": round_stmt.excluded.stats,
+                            },
+                        )
+                        s.execute(round_stmt)
+
+                        # 턴 단위: conversationlog
+                        _upsert_conversation_logs(s, _cid, offender_id, victim_id, _run, _turns)
+                        logger.info(
+                            "[DB] ConversationRound/ConversationLog stored: case_id=%s run=%s turns=%s",
+                            _cid,
+                            _run,
+                            len(_turns),
+                        )
+
+                    db_writer.submit(f"round/ConversationLog 저장(case_id={sim_case_id} run={round_key})", _store_round)
+
+                    # ✅ TTS용 메모리 캐시에 라운드별 대화 저장
+                    try:
+                        cache_run_dialog(
+                            case_id=str(sim_case_id),
+                            run_no=round_key,
+                            turns=cleaned_turns,
+                            victim_age=victim_meta.get("age"),
+                            victim_gender=victim_gender,
+                        )
+                        logger.info(
+                            "[TTS_CACHE] cached dialog for case_id=%s run_no=%s (turns=%s, age=%s, gender=%s)",
+                            sim_case_id,
+                            round_key,
+                            len(cleaned_turns),
+                            victim_meta.get("age"),
+                            victim_gender,
+                        )
+                    except Exception as e:
+                        logger.warning(
+                            "[TTS_CACHE] cache_run_dialog failed for case_id=%s run_no=%s: %s",
+                            sim_case_id,
+                            sim_run_idx,
+                            e,
+                        )
+                # ✅ 감정 라벨링 결과 처리: 직전 mcp.simulator_run 라운드(turns_by_round[sim_run_idx])를 덮어쓰기
+                elif tool_name == "label_victim_emotions":
+                    # tool output은 보통 list(turns) 또는 {"turns":[...]} 형태
+                    labeled_any = _event_parsed_any(ev)
+                    if isinstance(labeled_any, dict) and labeled_any.get("ok") is False:
+                        logger.warning("[Emotion] label_victim_emotions failed: %s", _truncate(labeled_any, 500))
+                    labeled_turns: Optional[List[Dict[str, Any]]] = None
+                    # ✅ merge 대상 라운드: 직전 simulator_run의 round_key 우선
+                    target_round = last_sim_round_key if isinstance(last_sim_round_key, int) else sim_run_idx
+
+                    if isinstance(labeled_any, dict):
+                        t = labeled_any.get("turns")
+                        if isinstance(t, list):
+                            labeled_turns = t
+                    elif isinstance(labeled_any, list):
+                        labeled_turns = labeled_any
+
+                    if not labeled_turns:
+                        logger.warning(
+                            "[Emotion] label_victim_emotions output이 turns(list)가 아님: type=%s value=%s",
+                            type(labeled_any).__name__,
+                            _truncate(labeled_any, 300),
+                        )
+                        continue
 
-                            if tt["role"] == "victim":
+                    # ✅ 기존 cleaned_turns(성별/age_group/victim_meta 등 유지) 위에 라벨 필드만 merge
+                    base_turns = turns_by_round.get(target_round) or []
+                    merged: List[Dict[str, Any]] = []
+                    try:
+                        max_len = max(len(base_turns), len(labeled_turns))
+                        merged = [None] * max_len  # type: ignore[list-item]
+                        for i in range(max_len):
+                            b = base_turns[i] if i < len(base_turns) and isinstance(base_turns[i], dict) else {}
+                            l = labeled_turns[i] if i < len(labeled_turns) and isinstance(labeled_turns[i], dict) else {}
+                            # ✅ labeled 쪽에서 붙은 감정/확률/HMM 관련 모든 필드를 반영하되,
+                            #    base의 텍스트/성별/메타는 보호한다. (base 우선)
+                            mt = {**b, **{k: v for k, v in l.items() if k not in _LABEL_PROTECT_KEYS}}
+
+                            # base에 role이 비어있으면 labeled role을 채우되 정규화
+                            if not mt.get("role") and l.get("role"):
+                                mt["role"] = _norm_role(l.get("role"))
+                            merged[i] = mt
+                    except Exception:
+                        merged = [t for t in labeled_turns if isinstance(t, dict)]
+
+                    # ✅ 최종 안전 정규화:
+                    # - role 재정규화
+                    # - victim text가 JSON이면 dialogue로 복구
+                    # - gender/age_group 누락 시 주입
+                    normalized: List[Dict[str, Any]] = [None] * len(merged)  # type: ignore[list-item]
+                    n_norm = 0
+                    for t in merged:
+                        if not isinstance(t, dict):
+                            continue
+                        tt = dict(t)
+                        tt["role"] = _norm_role(tt.get("role"))
+                        if not tt.get("text"):
+                            tt["text"] = ""
+
+                        if tt["role"] == "victim":
+                            # ✅ simulator_run 단계에서 이미 파싱된 턴(victim_meta 보유, text=dialogue)은 다시 파싱하지 않는다.
+                            #    (victim_meta/text는 merge 시 보호 키라 base 값이 그대로 유지됨)
+                            if "victim_meta" not in tt:
                                 dialogue, vmeta = _parse_victim_turn_text(tt.get("text"))
                                 if dialogue:
                                     tt["text"] = dialogue
                                 if vmeta:
-                                    tt.setdefault("victim_meta", vmeta)
+                                    tt["victim_meta"] = vmeta
                                     tt.setdefault("is_convinced", vmeta.get("is_convinced"))
                                     tt.setdefault("thoughts", vmeta.get("thoughts"))
-                                tt.setdefault("gender", victim_gender)
-                                if victim_age_group:
-                                    tt.setdefault("age_group", victim_age_group)
-                            elif tt["role"] == "offender":
-                                tt.setdefault("gender", offender_gender)
-
-                            normalized.append(tt)
-                        merged = normalized
-
-                        # ✅ 현재 라운드 turns 덮어쓰기
-                        turns_by_round[target_round] = merged
-
-                        _cid = case_id_by_round.get(target_round) or str(case_id)
-
-                        # ✅ SSE 업데이트(프론트가 후처리된 turns로 교체 가능)
-                        try:
-                            _emit_to_stream(
-                                "conversation_round",
-                                {
-                                    "case_id": _cid,
-                                    "run_no": target_round,
-                                    "turns": _truncate(merged, 2000),
-                                    "ended_by": ended_by_by_round.get(target_round),
-                                    "stats": _truncate(stats_by_round.get(target_round, {}), 2000),
-                                    "labeled": True,
-                                },
-                            )
-                        except Exception:
-                            pass
-
-                        # ✅ DB ConversationRound 덮어쓰기
-                        try:
-                            round_row = (
-                                db.query(m.ConversationRound)
-                                .filter(
-                                    m.ConversationRound.case_id == _cid,
-                                    m.ConversationRound.run == target_round,
-                                )
-                                .first()
-                            )
-                            if round_row:
-                                round_row.turns = merged
-                                db.commit()
-                                logger.info(
-                                    "[DB] ConversationRound updated(labeled): case_id=%s run=%s",
-                                    _cid,
-                                    target_round,
-                                )
-                        except Exception as e:
-                            logger.warning("[DB] ConversationRound labeled update failed: %s", e)
-
-                        # ✅ DB ConversationLog 덮어쓰기(턴 payload에 emotion/hmm 포함)
-                        try:
-                            (
-                                db.query(m.ConversationLog)
-                                .filter(
-                                    m.ConversationLog.case_id == _cid,
-                                    m.ConversationLog.run == target_round,
-                                )
-                                .delete(synchronize_session=False)
-                            )
-
-                            for idx, turn in enumerate(merged, start=1):
-                                role = (turn.get("role") or "").strip() or "unknown"
-                                text = turn.get("text") or ""
-                                log_row = m.ConversationLog(
-                                    case_id=_cid,
-                                    offender_id=offender_id,
-                                    victim_id=victim_id,
-                                    turn_index=idx,
-                                    role=role,
-                                    content=text,
-                                    label=None,
-                                    payload=turn,  # ✅ emotion/hmm 포함된 전체 턴 저장
-                                    use_agent=True,
-                                    run=target_round,
-                                    guidance_type=None,
-                                    guideline=None,
-                                )
-                                db.add(log_row)
-                            db.commit()
-                            logger.info(
-                                "[DB] ConversationLog updated(labeled): case_id=%s run=%s turns=%s",
-                                _cid,
-                                target_round,
-                                len(merged),
-                            )
-                        except Exception as e:
-                            logger.warning("[DB] ConversationLog labeled update failed: %s", e)
-
-                        # ✅ TTS 캐시도 라벨 결과로 최신화(음성엔 영향 없고, turn 구조 유지용)
-                        try:
-                            cache_run_dialog(
-                                case_id=str(_cid),
-                                run_no=target_round,
-                                turns=merged,
-                                victim_age=victim_meta.get("age"),
-                                victim_gender=victim_gender,
-                            )
-                        except Exception:
-                            pass
-                    # admin.generate_guidance
-                    elif tool_name == "admin.generate_guidance":
-                        guidance_idx += 1
-                        guidance_obj = _loose_parse_json(output)
-                        if guidance_obj:
-                            guidance_history.append({
-                                "for_round": guidance_idx + 1,
-                                "kind": guidance_obj.get("type", ""),
-                                "text": guidance_obj.get("text", "")
-                            })
+                            tt.setdefault("gender", victim_gender)
+                            if victim_age_group:
+                                tt.setdefault("age_group", victim_age_group)
+                        elif tt["role"] == "offender":
+                            tt.setdefault("gender", offender_gender)
+
+                        normalized[n_norm] = tt
+                        n_norm += 1
+                    if n_norm < len(normalized):
+                        del normalized[n_norm:]
+                    merged = normalized
+
+                    # ✅ 현재 라운드 turns 덮어쓰기
+                    turns_by_round[target_round] = merged
+
+                    _cid = case_id_by_round.get(target_round) or str(case_id)
+
+                    # ✅ SSE 업데이트(프론트가 후처리된 turns로 교체 가능)
+                    try:
+                        _emit_to_stream(
+                            "conversation_round",
+                            {
+                                "case_id": _cid,
+                                "run_no": target_round,
+                                "turns": merged,
+                                "ended_by": ended_by_by_round.get(target_round),
+                                "stats": stats_by_round.get(target_round, {}),
+                                "labeled": True,
+                            },
+                        )
+                    except Exception:
+                        pass
+
+                    # ✅ DB ConversationRound + ConversationLog 덮어쓰기 (한 트랜잭션, writer 스레드에서)
+                    def _store_labeled(s: Session, _cid=_cid, _run=target_round, _turns=merged) -> None:
+                        updated = s.execute(_UPD_ROUND_TURNS, {"cid": _cid, "run": _run, "turns": _turns}).rowcount
+
+                        # ✅ ConversationLog 덮어쓰기: payload에는 emotion/hmm 포함된 전체 턴 저장
+                        _upsert_conversation_logs(s, _cid, offender_id, victim_id, _run, _turns)
+                        logger.info(
+                            "[DB] ConversationRound/ConversationLog updated(labeled): case_id=%s run=%s turns=%s round_row=%s",
+                            _cid,
+                            _run,
+                            len(_turns),
+                            bool(updated),
+                        )
+
+                    db_writer.submit("ConversationRound/ConversationLog labeled update", _store_labeled)
+
+                    # ✅ TTS 캐시도 라벨 결과로 최신화(음성엔 영향 없고, turn 구조 유지용)
+                    try:
+                        cache_run_dialog(
+                            case_id=str(_cid),
+                            run_no=target_round,
+                            turns=merged,
+                            victim_age=victim_meta.get("age"),
+                            victim_gender=victim_gender,
+                        )
+                    except Exception:
+                        pass
+                # admin.generate_guidance
+                elif tool_name == "admin.generate_guidance":
+                    guidance_idx += 1
+                    guidance_obj = _event_parsed(ev)
+                    if guidance_obj:
+                        guidance_history.append({
+                            "for_round": guidance_idx + 1,
+                            "kind": guidance_obj.get("type", ""),
+                            "text": guidance_obj.get("text", "")
+                        })
+
+            # ✅ 라운드 저장이 끝난 뒤에 이후 단계(DB fallback 조회/덤프)로 진행
+            await asyncio.to_thread(db_writer.join)
 
             # ✅ 최종 turns_all 재구성(라벨링 덮어쓰기 반영)
             try:
-                turns_all = []
-                for rno in sorted(turns_by_round.keys()):
-                    turns_all.extend(turns_by_round.get(rno) or [])
+                # dict 삽입 순서 = 라운드 최초 저장 순서(거의 항상 오름차순)라 역전이 있을 때만 정렬
+                round_keys = list(turns_by_round)
+                if any(a > b for a, b in zip(round_keys, round_keys[1:])):
+                    round_keys.sort()
+                turns_all = list(chain.from_iterable(turns_by_round[rno] or () for rno in round_keys))
             except Exception:
                 pass
 
@@ -2795,8 +3850,9 @@ def run_orchestrated(db: Session, payload: Dict[str, Any], _stop: Optional[Threa
             try:
                 dump_enabled = bool(payload.get("dump_case_json", False))
                 if dump_enabled and case_id and (not turns_by_round):
-                    rows = (
-                        db.query(m.ConversationRound)
+                    # ✅ 동기 DB 조회는 워커 스레드에서 (event loop 블로킹 방지)
+                    rows = await asyncio.to_thread(
+                        lambda: db.query(m.ConversationRound)
                         .filter(m.ConversationRound.case_id == case_id)
                         .order_by(m.ConversationRound.run.asc())
                         .all()
@@ -2901,7 +3957,7 @@ def run_orchestrated(db: Session, payload: Dict[str, Any], _stop: Optional[Threa
                     "case_id": case_id,
                     "rounds": rounds_done,
                     "finished_reason": finished_reason,
-                    "prevention": _truncate(prevention_obj, 2000),
+                    "prevention": prevention_obj,
                 })
             else:
                 logger.warning("[Prevention] 예방책 객체를 끝내 확보하지 못했습니다.")
@@ -2909,13 +3965,6 @@ def run_orchestrated(db: Session, payload: Dict[str, Any], _stop: Optional[Threa
             # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
             # 정상 종료 전 정리
             # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-            try:
-                if mcp_manager and getattr(mcp_manager, "is_running", False):
-                    mcp_manager.stop_mcp_server()
-                    logger.info("[MCP] stop_mcp_server called for case_id=%s", case_id)
-            except Exception:
-                logger.exception("[MCP] stop_mcp_server failed")
-
             result_obj = {
                 "status": "success",
                 "case_id": case_id,
@@ -2950,24 +3999,27 @@ def run_orchestrated(db: Session, payload: Dict[str, Any], _stop: Optional[Threa
             # ─────────────────────────────────────
             try:
                 dump_enabled = bool(payload.get("dump_case_json", False))
+                dump_dir = (
+                    payload.get("dump_dir")
+                    or os.getenv("VP_CASE_DUMP_DIR")
+                    or "./artifacts/cases"
+                )
+                if dump_enabled and str(dump_dir) in _CASE_DUMP_NOOP_DIRS:
+                    # 덤프 경로가 no-op이면 아티팩트 조립/인코딩 자체를 건너뛴다
+                    dump_enabled = False
                 if dump_enabled:
-                    dump_dir = (
-                        payload.get("dump_dir")
-                        or os.getenv("VP_CASE_DUMP_DIR")
-                        or "./artifacts/cases"
-                    )
-                    Path(dump_dir).mkdir(parents=True, exist_ok=True)
                     rounds_payload: List[Dict[str, Any]] = []
                     # range의 end는 미포함이므로 rounds_done까지 포함하려면 +1
                     safe_rounds_done = max(0, int(rounds_done))
+                    # 라운드별 judgement 인덱스 (같은 run_no가 여럿이면 기존처럼 첫 번째 우선 → 역순으로 채움)
+                    judgements_by_run: Dict[Any, Dict[str, Any]] = {}
+                    if isinstance(judgements_history, list):
+                        judgements_by_run = {
+                            x.get("run_no"): x for x in reversed(judgements_history) if isinstance(x, dict)
+                        }
                     for rno in range(1, safe_rounds_done + 1):
                         # 라운드별 judgement를 rounds에도 붙여서 한 번에 보기 쉽게
-                        j = None
-                        try:
-                            if isinstance(judgements_history, list):
-                                j = next((x for x in judgements_history if x.get("run_no") == rno), None)
-                        except Exception:
-                            j = None
+                        j = judgements_by_run.get(rno)
                         rounds_payload.append({
                             "run_no": rno,
                             "turns": turns_by_round.get(rno, []),
@@ -3016,15 +4068,28 @@ def run_orchestrated(db: Session, payload: Dict[str, Any], _stop: Optional[Threa
                         }
                     }
                     out_path = Path(dump_dir) / f"{case_id}.json"
-                    with out_path.open("w", encoding="utf-8") as f:
-                        json.dump(case_artifact, f, ensure_ascii=False, indent=2)
+                    await _dump_case_artifact_async(out_path, case_artifact)
                     logger.info("[CaseDump] saved: %s", str(out_path))
                     _emit_to_stream("artifact_saved", {"case_id": case_id, "path": str(out_path)})
                     # (선택) 결과에도 경로 포함
                     result_obj["artifact_path"] = str(out_path)
+                    # 덤프용 사본 해제 (값 객체는 result_obj와 공유될 수 있으니 컨테이너만 비움)
+                    case_artifact.clear()
+                    rounds_payload.clear()
             except Exception as e:
                 logger.warning("[CaseDump] failed: %s", e)
 
+            # ✅ 반환 전에 result_obj가 참조하지 않는 큰 중간 구조를 바로 놓아준다
+            #    (cap.events에는 도구 raw output이 통째로 들어 있음)
+            with contextlib.suppress(Exception):
+                cap.events.clear()
+                observation_events.clear()
+                events_by_key.clear()
+                turns_by_round.clear()
+                stats_by_round.clear()
+                guidance_history.clear()
+                turns_all = []
+
             with contextlib.suppress(Exception):
                 _emit_run_end("success", {"case_id": case_id, "rounds": rounds_done})
                 _emitted_run_end = True
@@ -3032,58 +4097,45 @@ def run_orchestrated(db: Session, payload: Dict[str, Any], _stop: Optional[Threa
             return result_obj
 
     finally:
-        with contextlib.suppress(Exception):
-            # ✅ 기존: "round_" 포함이면 전부 삭제 → 다른 케이스/동시 실행 캐시까지 싹 지워짐
-            # ✅ 수정: stream_id 스코프(prefix)로만 제거
-            sid = stream_id
-            keys_to_remove = [k for k, v in _PROMPT_CACHE.items() if str(k).startswith(f"{sid}:")]
-            for k in keys_to_remove:
-                _PROMPT_CACHE.pop(k, None)
-            if keys_to_remove:
-                logger.info("[PromptCache] 정리: stream_id=%s removed=%s", sid, len(keys_to_remove))
-
-                # 🔊 TTS용 대화 캐시도 함께 정리
-                try:
-                    _cid = locals().get("case_id", None)
-                    if _cid:
-                        clear_case_dialog_cache(str(_cid))
-                except Exception as e:
-                    _cid = locals().get("case_id", None)
-                    logger.warning("[TTS_CACHE] clear_case_dialog_cache 실패: case_id=%s error=%s", _cid, e)
-        # ✅ Emotion/HMM 캐시도 stream_id 스코프로 정리 (레벨 A: run 동안만 유지)
-        with contextlib.suppress(Exception):
-            sid = stream_id
-            if sid in _EMO_CACHE:
-                _EMO_CACHE.pop(sid, None)
-                logger.info("[EMO_CACHE] 정리: stream_id=%s", sid)
-        with contextlib.suppress(Exception):
-            _ACTIVE_RUN_KEYS.discard(run_key)
-        if sse_on:
+        if db_writer is not None:
+            # 예외로 빠져나온 경우에도 writer 스레드를 정리 (join은 멱등)
             with contextlib.suppress(Exception):
-                tee_out.flush()
-                tee_err.flush()
-        with contextlib.suppress(Exception):
-            _unpatch_print()
-        with contextlib.suppress(Exception):
-            _current_stream_id.reset(token)
+                await asyncio.to_thread(db_writer.join)
+        if fd_tee is not None:
+            with contextlib.suppress(Exception):
+                await asyncio.to_thread(fd_tee.stop)
+        _safe(_drop_run_caches, stream_id, case_id)
+        _safe(_release_run_key, run_key)
+        # ✅ 배치 버퍼에 남은 이벤트는 result 이벤트보다 먼저 나가야 한다.
+        _flush_emit_buffer(stream_id)
         if sse_on:
             with contextlib.suppress(Exception):
-                logger.removeHandler(_sse_log_handler)
-            _detach_global_sse_logging_handlers()
-        with contextlib.suppress(Exception):
-            if locals().get("mcp_manager") and getattr(mcp_manager, "is_running", False):
-                mcp_manager.stop_mcp_server()
+                await asyncio.to_thread(tee_out.drain)
+                await asyncio.to_thread(tee_err.drain)
+        _safe(_current_stream_id.reset, token)
+        _safe(_current_db.reset, db_token)
+
+def run_orchestrated(db: Session, payload: Dict[str, Any], _stop: Optional[ThreadEvent] = None) -> Dict[str, Any]:
+    """
+    arun_orchestrated의 동기 진입점 (CLI/배치, 워커 스레드용).
+    - 현재 스레드에 running loop가 없을 때만 사용 (async 코드에서는 arun_orchestrated를 await)
+    - 호출마다 asyncio.run이 새 loop를 만들므로 executor/LLM 클라이언트도 그 loop용으로 새로 만든다
+      (_get_executor가 loop별 캐시) → 반복 호출해도 안전하지만, 여러 케이스를 돌릴 때는
+      loop 하나에서 arun_orchestrated를 반복 await 하는 편이 executor를 재사용해 더 싸다.
+    """
+    return asyncio.run(arun_orchestrated(db, payload, _stop))
 
 # ─────────────────────────────────────────────────────────
 # SSE 스트림
 # ─────────────────────────────────────────────────────────
-_RUN_TASKS: dict[str, asyncio.Task] = {}
-_STREAM_CONN_COUNT: dict[str, int] = {}
+_STREAM_TERMINAL_TYPES = frozenset({"run_end", "error", "result"})
+# 실행 중인 runner task의 강한 참조 (stream 상태가 먼저 정리돼도 task가 GC되지 않도록)
+_LIVE_RUN_TASKS: Set[asyncio.Task] = set()
 
 async def run_orchestrated_stream(db: Session, payload: Dict[str, Any], stop_event: Optional[asyncio.Event] = None):
     stream_id = str(payload.get("stream_id") or uuid.uuid4())
-    _ensure_stream(stream_id)
-    main_q = _get_main_queue(stream_id)
+    st = _ensure_stream(stream_id)
+    main_q = st.queue
 
     thread_stop = ThreadEvent()
 
@@ -3095,62 +4147,66 @@ async def run_orchestrated_stream(db: Session, payload: Dict[str, Any], stop_eve
 
     bridge_task = None
     if stop_event is not None:
-        bridge_task = asyncio.create_task(_bridge_cancel())
+        if stop_event.is_set():
+            # 이미 취소된 상태로 들어오면 bridge task 없이 바로 전달
+            thread_stop.set()
+        else:
+            bridge_task = asyncio.create_task(_bridge_cancel())
 
     async def _runner():
         try:
-            def _work():
-                from app.db.session import SessionLocal
-                with SessionLocal() as thread_db:
-                    return run_orchestrated(thread_db, {**payload, "stream_id": stream_id}, thread_stop)
-            res = await asyncio.to_thread(_work)
-            ev = {"type": "result", "content": res, "ts": datetime.now().isoformat()}
-            loop = _get_loop(stream_id)
-            loop.call_soon_threadsafe(main_q.put_nowait, ev)
+            # ✅ 스레드 + asyncio.run(별도 루프) 이중 디스패치 대신 같은 루프에서 바로 await
+            #    (블로킹 구간(준비/DB 쓰기/덤프)은 arun_orchestrated 내부에서 to_thread로 빠짐)
+            with SessionLocal() as run_db:
+                res = await arun_orchestrated(run_db, {**payload, "stream_id": stream_id}, thread_stop)
+            ev = {"type": "result", "content": res, "ts": _now_iso()}
+            # runner는 stream loop 위에서 돌므로 스레드 간 전달 없이 바로 넣는다
+            # (먼저 pending에 남은 emit을 비워서 result가 그보다 앞서지 않게)
+            _drain_pending(st)
+            _enqueue(st, ev)
         except Exception as e:
-            loop = _get_loop(stream_id)
+            # 종료 이벤트는 한 번만 만들고(시각도 한 번) 그대로 넣는다
+            if isinstance(e, HTTPException) and getattr(e, "status_code", None) == 499:
+                ev = {"type": "result", "content": {"status": "cancelled"}, "ts": _now_iso()}
+            else:
+                ev = {"type": "error", "message": str(e)}
             try:
-                from fastapi import HTTPException as _HTTPEx
-                if isinstance(e, _HTTPEx) and getattr(e, "status_code", None) == 499:
-                    loop.call_soon_threadsafe(
-                        main_q.put_nowait,
-                        {"type": "result", "content": {"status": "cancelled"}, "ts": datetime.now().isoformat()},
-                    )
-                else:
-                    loop.call_soon_threadsafe(main_q.put_nowait, {"type": "error", "message": str(e)})
+                _drain_pending(st)
+                _enqueue(st, ev)
             except Exception:
-                loop.call_soon_threadsafe(main_q.put_nowait, {"type": "error", "message": str(e)})
+                _enqueue(st, {"type": "error", "message": str(e)})
 
-    task = _RUN_TASKS.get(stream_id)
-    if task is None or task.done():
-        task = asyncio.create_task(_runner())
-        _RUN_TASKS[stream_id] = task
+    if st.task is None or st.task.done():
+        st.task = asyncio.create_task(_runner())
+        _LIVE_RUN_TASKS.add(st.task)
+        st.task.add_done_callback(_LIVE_RUN_TASKS.discard)
 
-    _STREAM_CONN_COUNT[stream_id] = _STREAM_CONN_COUNT.get(stream_id, 0) + 1
+    st.conn_count += 1
 
     try:
-        while True:
+        # ✅ 한 번 await로 깨어나면 이미 쌓인 이벤트는 get_nowait로 연달아 내보낸다 (이벤트마다 루프 왕복 X)
+        done = False
+        while not done:
             ev = await main_q.get()
-            yield ev
-
-            if ev.get("type") in ("run_end", "error", "result"):
-                break
-
-            await asyncio.sleep(0)
+            while True:
+                yield ev
+                if ev.get("type") in _STREAM_TERMINAL_TYPES:
+                    done = True
+                    break
+                try:
+                    ev = main_q.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
     finally:
-        try:
-            _STREAM_CONN_COUNT[stream_id] = max(0, _STREAM_CONN_COUNT.get(stream_id, 1) - 1)
-        except Exception:
-            _STREAM_CONN_COUNT[stream_id] = 0
+        st.conn_count = max(0, st.conn_count - 1)
 
-        if _STREAM_CONN_COUNT.get(stream_id, 0) == 0:
+        if st.conn_count == 0:
             thread_stop.set()
-            _STREAMS.pop(stream_id, None)
-
-            t = _RUN_TASKS.get(stream_id)
-            if t and t.done():
-                _RUN_TASKS.pop(stream_id, None)
-        
-        if bridge_task:
-            with contextlib.suppress(Exception):
-                bridge_task.cancel()
\ No newline at end of file
+            _drop_stream_state(stream_id, st)
+
+        if bridge_task is not None:
+            # cancel만 걸고 두면 다음 tick까지 stop_event waiter가 남는다 → 여기서 끝까지 회수
+            task_to_reap, bridge_task = bridge_task, None
+            task_to_reap.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await task_to_reap
\ No newline at end of file
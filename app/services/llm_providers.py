@@ -43,7 +43,8 @@ def openai_chat(model: Optional[str] = None, temperature: float = 0.7):
 # STOP_SAFE_DEFAULT = "gpt-4o-2024-08-06"  # ReAct/stop 호환 안정판
 
 
-def agent_chat(model: str | None = None, temperature: float = 0.2):
+def agent_chat(model: str | None = None, temperature: float = 0.2, streaming: bool = False,
+               http_async_client=None):
     name = (model or getattr(settings, "AGENT_MODEL", None))
     if not name:
         raise RuntimeError("AGENT_MODEL not set")
@@ -57,11 +58,16 @@ def agent_chat(model: str | None = None, temperature: float = 0.2):
     if not settings.OPENAI_API_KEY:
         raise RuntimeError("OPENAI_API_KEY not set")
 
+    # ✅ http_async_client를 안 주면 langchain-openai가 프로세스 공용 httpx 풀을 쓰는데,
+    #    그 커넥션은 처음 쓴 event loop에 묶인다 → loop별로 executor를 캐시하는 쪽은 직접 넘긴다
+    extra = {"http_async_client": http_async_client} if http_async_client is not None else {}
     return ChatOpenAI(
         model=name,
         temperature=temperature,  # non-o 모델은 0~0.3 권장
         api_key = settings.OPENAI_API_KEY,
         timeout=600000,
+        streaming=streaming,  # ✅ SSE 실행 시 토큰 단위 콜백(on_llm_new_token) 활성화
+        **extra,
     )
 
 
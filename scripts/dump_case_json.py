@@ -6,7 +6,6 @@ import os
 from dotenv import load_dotenv
 import uuid
 import json
-import time
 import traceback
 from datetime import datetime
 from pathlib import Path
@@ -37,7 +36,7 @@ if env2.exists():
     print(f"[ENV-DEBUG] env2 values: EMOTION_ENABLED={dotenv_values(env2).get('EMOTION_ENABLED')!r}")
 
 from app.db.session import SessionLocal
-from app.services.agent.orchestrator_react import run_orchestrated, _ensure_stream
+from app.services.agent.orchestrator_react import arun_orchestrated, _ensure_stream
 
 
 # =========================
@@ -100,12 +99,11 @@ async def main():
             "stream_id": stream_id,
         }
 
-        def _work():
-            with SessionLocal() as db:
-                return run_orchestrated(db, payload)
-
         try:
-            result = await asyncio.to_thread(_work)
+            # ✅ 같은 loop에서 계속 await (run_orchestrated=asyncio.run을 반복 호출하면
+            #    캐시된 executor/LLM 클라이언트의 커넥션이 닫힌 이전 loop에 묶여 2회차부터 실패)
+            with SessionLocal() as db:
+                result = await arun_orchestrated(db, payload)
 
             artifact_path = result.get("artifact_path") if isinstance(result, dict) else None
             case_id = result.get("case_id") if isinstance(result, dict) else None
@@ -136,7 +134,7 @@ async def main():
             print(f"[FAIL attempt={attempts}] saved error={err_path}")
 
         if SLEEP_SEC:
-            time.sleep(SLEEP_SEC)
+            await asyncio.sleep(SLEEP_SEC)
 
     print("\n=== DONE ===")
     print(f"success={success}, attempts={attempts}, ok_dir={ok_dir}, failed_dir={fail_dir}")
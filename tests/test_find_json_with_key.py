@@ -0,0 +1,32 @@
+# 판정/지침 JSON 추출 스캐너: 바깥 객체 우선 + 값 충돌 케이스
+import pytest
+
+orch = pytest.importorskip("app.services.agent.orchestrator_react")
+find = orch._find_json_with_key
+
+
+def test_outermost_object_wins_over_nested():
+    s = 'Final: {"phishing": true, "risk": {"level": "high", "phishing": false}} done'
+    assert find(s, "phishing") == {"phishing": True, "risk": {"level": "high", "phishing": False}}
+
+
+def test_key_name_as_value_is_not_a_match():
+    s = '{"phishing": false, "meta": {"label": "phishing"}}'
+    assert find(s, "phishing") == {"phishing": False, "meta": {"label": "phishing"}}
+    assert find('{"meta": {"label": "phishing"}}', "phishing") is None
+
+
+def test_guidance_keys_on_nested_object():
+    s = 'x {"type": "A", "text": "hi", "extra": {"type": "B", "text": "no"}}'
+    assert find(s, "type", "text")["text"] == "hi"
+
+
+def test_skips_non_json_braces_and_braces_in_strings():
+    s = 'Thought {x} then {"phishing": true, "reason": "a \\"}\\" b"}'
+    assert find(s, "phishing") == {"phishing": True, "reason": 'a "}" b'}
+    assert find('{"phishing": tru', "phishing") is None
+
+
+def test_stray_quote_in_prose_does_not_hide_object():
+    s = '판정: 5" 화면 {"phishing": true, "reason": "x"}'
+    assert find(s, "phishing") == {"phishing": True, "reason": "x"}
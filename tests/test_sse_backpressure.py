@@ -0,0 +1,34 @@
+# SSE main_q backpressure: 토큰 폭주 중에도 중요 이벤트는 버려지지 않아야 한다
+import asyncio
+
+import pytest
+
+orch = pytest.importorskip("app.services.agent.orchestrator_react")
+
+
+def test_token_flood_keeps_critical_events():
+    async def _run():
+        sid = "test-backpressure"
+        st = orch._ensure_stream(sid)
+        try:
+            critical = [
+                {"type": "conversation_round", "content": {"run_no": 1}},
+                {"type": "judgement", "content": {"phishing": True}},
+                {"type": "result", "content": {"status": "success"}},
+            ]
+            for i in range(orch._SSE_QMAX * 3):
+                orch._enqueue(st, {"type": "token", "content": {"text": str(i)}})
+                if i % orch._SSE_QMAX == 0:
+                    orch._enqueue(st, critical[i // orch._SSE_QMAX])
+            got = []
+            while not st.queue.empty():
+                got.append(st.queue.get_nowait())
+            return st, got, critical
+        finally:
+            orch._drop_stream_state(sid, st)
+
+    st, got, critical = asyncio.run(_run())
+    for ev in critical:
+        assert ev in got
+    assert sum(1 for ev in got if ev["type"] == "token") <= orch._SSE_QMAX
+    assert st.dropped > 0